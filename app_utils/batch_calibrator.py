@@ -0,0 +1,220 @@
+""" 複数の.speファイルをまとめて校正するクラス
+
+同じ校正設定(ランプ・フィルター・波長・pixel数)のファイルには、校正用imageを1回だけ作って使い回す。
+ファイルごとの校正はプロセスプールで並列に行う。
+出力ファイルには校正元と設定を属性として記録し、変わっていなければ次回は校正し直さない。
+
+"""
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from app_utils.writer import CalibrateSpectraWriter
+from modules.data_model.spectrum_data import SpectrumData
+from modules.file_format.HDF5 import ChunkLayout, hdf_handle_pool
+from modules.file_format.spe_wrapper import SpeWrapper
+from log_util import logger
+
+
+def _calibrate_file(task: dict) -> dict:
+    """ プロセスプールの中で1ファイルを校正する (pickleできるようにモジュールの関数にしておく) """
+    radiation = SpectrumData(task['spe_path'])
+    if task['lazy']:
+        result = CalibrateSpectraWriter.output_lazy_to_hdf5(
+            original_radiation=radiation,
+            lamp_spectrum=task['lamp_spectrum'],
+            up_response=task['up_response'],
+            down_response=task['down_response'],
+            path_to_hdf5=task['output_path'],
+            dtype=task['dtype'],
+            calibration_image=task['calibration_image'],
+            attrs=task['attrs']
+        )
+    else:
+        result = CalibrateSpectraWriter.output_to_hdf5(
+            original_radiation=radiation,
+            lamp_spectrum=task['lamp_spectrum'],
+            up_response=task['up_response'],
+            down_response=task['down_response'],
+            path_to_hdf5=task['output_path'],
+            prefetch_depth=task['prefetch_depth'],
+            chunk_layout=task['chunk_layout'],
+            compression=task['compression'],
+            dtype=task['dtype'],
+            calibration_image=task['calibration_image'],
+            attrs=task['attrs']
+        )
+    return {**result, 'spe_path': task['spe_path'], 'output_path': task['output_path']}
+
+
+class BatchCalibrator:
+    OUTPUT_SUFFIX = '_calib.hdf'
+    DEFAULT_MAX_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1)) # 1ファイルの中でもスレッドを使うので控えめにする
+
+    def __init__(self, lamp_path: str, up_path: str, down_path: str, save_path: str,
+                 chunk_layout: ChunkLayout = ChunkLayout.HYBRID, compression: str = None, dtype=np.float32,
+                 prefetch_depth: int = SpectrumData.PREFETCH_DEPTH, lazy: bool = False):
+        """
+        :param lamp_path: 参照ランプデータ(.csv)
+        :param up_path: Upのフィルター応答(.spe)
+        :param down_path: Downのフィルター応答(.spe)
+        :param save_path: 出力先フォルダ
+        :param chunk_layout, compression, dtype, prefetch_depth: CalibrateSpectraWriter.output_to_hdf5を参照
+        :param lazy: Trueなら校正済みの値を書き込まず、遅延校正の.hdfを作る (CalibrateSpectraWriter.output_lazy_to_hdf5)
+        """
+        self.lamp_path = lamp_path
+        self.up_path = up_path
+        self.down_path = down_path
+        self.save_path = save_path
+        self.chunk_layout = chunk_layout
+        self.compression = compression
+        self.dtype = np.dtype(dtype)
+        self.prefetch_depth = prefetch_depth
+        self.lazy = lazy
+        # 校正元のデータは全ファイル共通なので、最初に1回だけ読む
+        self.lamp_spectrum = pd.read_csv(lamp_path, header=None, names=["wavelength", "intensity"])
+        self.up_response = SpeWrapper(up_path, header_only=True).get_frame_data(frame=0)[0]
+        self.down_response = SpeWrapper(down_path, header_only=True).get_frame_data(frame=0)[0]
+        self._calibration_images = {} # 校正設定のキー -> 校正用image
+
+    @staticmethod
+    def find_spe_files(path_or_glob: str) -> list:
+        """ フォルダなら直下の.speを、それ以外はglobのパターンとして一致する.speを返す """
+        if os.path.isdir(path_or_glob):
+            pattern = os.path.join(path_or_glob, '*.spe')
+        else:
+            pattern = path_or_glob
+        return sorted(
+            path for path in glob.glob(pattern)
+            if path.endswith('.spe') and not os.path.basename(path).startswith('.')
+        )
+
+    def get_output_path(self, spe_path: str) -> str:
+        file_name = os.path.splitext(os.path.basename(spe_path))[0]
+        return os.path.join(self.save_path, file_name + self.OUTPUT_SUFFIX)
+
+    @staticmethod
+    def _file_stamp(path: str) -> str:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def get_provenance(self, spe_path: str) -> dict:
+        """ 出力ファイルに記録する、校正元と設定。これが一致すれば出力は最新とみなす """
+        return {
+            'source_spe': self._file_stamp(spe_path),
+            'source_lamp': self._file_stamp(self.lamp_path),
+            'source_up': self._file_stamp(self.up_path),
+            'source_down': self._file_stamp(self.down_path),
+            'dtype': self.dtype.name,
+            'chunk_layout': self.chunk_layout.value,
+            'compression': self.compression or 'none',
+            'lazy': str(self.lazy),
+        }
+
+    def is_up_to_date(self, spe_path: str) -> bool:
+        output_path = self.get_output_path(spe_path)
+        if not os.path.exists(output_path):
+            return False
+        try:
+            with h5py.File(output_path, 'r') as f:
+                recorded = {key: f.attrs.get(key) for key in self.get_provenance(spe_path)}
+        except OSError:
+            return False # 壊れている・書きかけのファイルは作り直す
+        recorded = {key: (value.decode('utf-8') if isinstance(value, bytes) else value) for key, value in recorded.items()}
+        return recorded == self.get_provenance(spe_path)
+
+    def get_calibration_image(self, radiation: SpectrumData) -> np.ndarray:
+        """ 波長とpixel数が同じファイルには同じimageを返す。前回までの校正で保存したものがあれば、それを読み込む """
+        wavelength_arr = radiation.get_wavelength_arr()
+        key = (
+            hashlib.sha1(np.ascontiguousarray(wavelength_arr, dtype=np.float64).tobytes()).hexdigest(),
+            radiation.position_pixel_num,
+            radiation.center_pixel,
+        )
+        if key not in self._calibration_images:
+            self._calibration_images[key] = CalibrateSpectraWriter.get_calibration_image(
+                wavelength_arr, self.lamp_spectrum, self.up_response, self.down_response,
+                radiation.position_pixel_num, radiation.center_pixel
+            ).astype(self.dtype)
+            logger.debug(f"校正用imageを用意しました ({len(self._calibration_images)} 種類目)")
+        return self._calibration_images[key]
+
+    def _write_log(self, spe_path: str, output_path: str):
+        # 1ファイルずつ校正した場合と同じ形式で記録する
+        os.makedirs('log', exist_ok=True)
+        with open('log/calibration_log.txt', 'a') as f:
+            f.write(f"{datetime.now()}\n\tfrom {spe_path}\n\tto {output_path}\n\twith {self.lamp_path}\n\t     {self.up_path}\n\t     {self.down_path}\n\n")
+
+    def run(self, spe_paths: list, max_workers: int = DEFAULT_MAX_WORKERS, overwrite: bool = False,
+            progress_callback=None) -> pd.DataFrame:
+        """
+        :param spe_paths: 校正する.speファイルのリスト
+        :param max_workers: プロセス数。1ならプロセスを作らずに順番に校正する
+        :param overwrite: Trueなら最新の出力があっても校正し直す
+        :param progress_callback: 0から1の進捗を受け取る関数。Noneなら報告しない
+        :return: ファイルごとの結果 (status: 'done', 'skipped', 'failed')
+        """
+        os.makedirs(self.save_path, exist_ok=True)
+        results = []
+        tasks = []
+        for spe_path in spe_paths:
+            output_path = self.get_output_path(spe_path)
+            if not overwrite and self.is_up_to_date(spe_path):
+                results.append({'spe_path': spe_path, 'output_path': output_path, 'status': 'skipped'})
+                continue
+            try:
+                # アプリで開いたままの読み込み用handleがあると、校正するプロセスから書き込めない
+                hdf_handle_pool.close(output_path)
+            except RuntimeError as e:
+                logger.warning(f"出力ファイルが使用中なので校正しません: {output_path}, {e}")
+                results.append({'spe_path': spe_path, 'output_path': output_path, 'status': 'failed',
+                                'error': f"出力ファイルが使用中です(読み込み中のため閉じられません): {output_path}"})
+                continue
+            radiation = SpectrumData(spe_path)
+            tasks.append({
+                'spe_path': spe_path,
+                'output_path': output_path,
+                'lamp_spectrum': self.lamp_spectrum,
+                'up_response': self.up_response,
+                'down_response': self.down_response,
+                'calibration_image': self.get_calibration_image(radiation),
+                'prefetch_depth': self.prefetch_depth,
+                'chunk_layout': self.chunk_layout,
+                'compression': self.compression,
+                'dtype': self.dtype,
+                'lazy': self.lazy,
+                'attrs': self.get_provenance(spe_path),
+            })
+        skipped_num = sum(result['status'] == 'skipped' for result in results)
+        logger.info(f"一括校正: {len(tasks)} ファイルを校正、{skipped_num} ファイルは最新なので飛ばします")
+
+        def report(result):
+            results.append(result)
+            if progress_callback is not None:
+                progress_callback(len(results) / len(spe_paths))
+
+        if max_workers <= 1:
+            for task in tasks:
+                report(self._collect(task, lambda: _calibrate_file(task)))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(_calibrate_file, task): task for task in tasks}
+                for future in as_completed(futures):
+                    report(self._collect(futures[future], future.result))
+        return pd.DataFrame(results)
+
+    def _collect(self, task: dict, get_result) -> dict:
+        """ 1ファイルの校正結果を受け取り、失敗してもほかのファイルは続ける """
+        try:
+            result = {**get_result(), 'status': 'done'}
+            self._write_log(task['spe_path'], task['output_path'])
+            return result
+        except Exception as e:
+            logger.warning(f"校正に失敗しました: {task['spe_path']}, {e}")
+            return {'spe_path': task['spe_path'], 'output_path': task['output_path'], 'status': 'failed', 'error': repr(e)}
@@ -3,26 +3,31 @@ import os
 import pandas as pd
 import streamlit as st
 
-from modules.file_format.spe_wrapper import SpeWrapper
+from modules.file_format.spe_catalog import SpeCatalog
 
 class FileHandler:
     @staticmethod
     def get_file_list_with_OD(path_to_files, files):
-        spe_list = []
-        spe_display_data = []
+        """
+        フォルダ内の索引から、ファイル名とODの表を作る。索引にない・変更されたファイルはバックグラウンドで読み込み始め、
+        読み込みを待たずに返す(そのファイルのODはNone)。残りのファイル数はget_indexing_file_numで分かる
+        """
         for file in files:
             if not file.endswith('.spe'):
                 raise Exception(".spe以外のファイルが含まれています。")
-            spe_list.append(SpeWrapper(os.path.join(path_to_files, file)))
-        for spe in spe_list:
-            try:
-                spe.get_params_from_xml()
-                OD = spe.OD
-            except Exception as e:
-                OD = None
-            spe_display_data.append({"File Name": spe.file_name, "OD": OD})
+        catalog = SpeCatalog.for_folder(path_to_files)
+        catalog.update(files)
+        spe_display_data = []
+        for file, entry in zip(files, catalog.get_entries(files)):
+            OD = entry.get('OD') if entry is not None else None
+            spe_display_data.append({"File Name": os.path.splitext(file)[0], "OD": OD})
         return pd.DataFrame(spe_display_data)
 
+    @staticmethod
+    def get_indexing_file_num(path_to_files) -> int:
+        """ バックグラウンドで読み込み中の.speファイルの数 """
+        return SpeCatalog.for_folder(path_to_files).get_pending_num()
+
     @staticmethod
     def build_tree_structure(path_to_calib, walked):
         """os.walk の結果からツリー構造を辞書形式で構築"""
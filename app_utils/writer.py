@@ -1,4 +1,5 @@
 import json
+import os
 
 import h5py
 import numpy as np
@@ -6,18 +7,99 @@ import pandas as pd
 from tqdm import tqdm
 
 from modules.data_model.spectrum_data import SpectrumData
-from modules.file_format.HDF5 import HDF5Writer
+from modules.data_model.frame_cache import frame_cache
+from modules.data_model.block_pipeline import BlockPipeline
+from modules.data_model.calibration_cache import calibration_image_cache
+from modules.file_format.HDF5 import HDF5Writer, ChunkLayout, hdf_handle_pool
+from log_util import logger
 
 
 class CalibrateSpectraWriter():
+    SUPPORTED_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+    @staticmethod
+    def build_calibration_image(
+            wavelength_arr: np.ndarray,
+            lamp_spectrum: pd.DataFrame,
+            up_response: np.ndarray,
+            down_response: np.ndarray,
+            position_pixel_num: int,
+            center_pixel: int
+    ) -> np.ndarray:
+        """
+        元データ(frame)に掛けると校正されるimage(position, wavelength)をfloat64で作る
+        """
+        wavelength_pixel_num = len(wavelength_arr)
+        # NumPy の補間関数を使用して、ランプデータのデータ点の波長を揃える
+        lamp_intensity_interpolated = np.interp(
+            wavelength_arr,
+            lamp_spectrum['wavelength'],
+            lamp_spectrum['intensity']
+        )
+
+        # ここまでの情報をもとに校正用のimage(2次元配列)を作成する
+        filter_image = np.zeros((position_pixel_num, wavelength_pixel_num))
+        lamp_image = np.zeros((position_pixel_num, wavelength_pixel_num))
+        # まずup, downのフィルター補正を展開
+        filter_image[:center_pixel, :] = up_response[:, np.newaxis].T  # 256は含まれない。
+        filter_image[center_pixel:, :] = down_response[:, np.newaxis].T
+        # 加えてlamp_spectrumを展開
+        lamp_image[:, :] = lamp_intensity_interpolated[:, np.newaxis].T
+        # これが校正用image
+        return lamp_image / filter_image
+
+    @staticmethod
+    def get_calibration_image(
+            wavelength_arr: np.ndarray,
+            lamp_spectrum: pd.DataFrame,
+            up_response: np.ndarray,
+            down_response: np.ndarray,
+            position_pixel_num: int,
+            center_pixel: int
+    ) -> np.ndarray:
+        """
+        build_calibration_imageと同じものを返す。入力が同じなら、ディスクに保存したものを読み込むだけで済ませる
+        """
+        key = calibration_image_cache.make_key(
+            lamp_spectrum, up_response, down_response, wavelength_arr, position_pixel_num, center_pixel
+        )
+        return calibration_image_cache.get_or_build(key, lambda: CalibrateSpectraWriter.build_calibration_image(
+            wavelength_arr, lamp_spectrum, up_response, down_response, position_pixel_num, center_pixel
+        ))
+
     @staticmethod
     def output_to_hdf5(
             original_radiation: SpectrumData,
             lamp_spectrum: pd.DataFrame,
             up_response: np.ndarray,
             down_response: np.ndarray,
-            path_to_hdf5: str
-    ):
+            path_to_hdf5: str,
+            prefetch_depth: int = SpectrumData.PREFETCH_DEPTH,
+            chunk_layout: ChunkLayout = ChunkLayout.HYBRID,
+            compression: str = None,
+            dtype=np.float32,
+            block_size: int = None,
+            calibration_image: np.ndarray = None,
+            attrs: dict = None
+    ) -> dict:
+        """
+        block_sizeずつframeを読み込み、校正用imageを掛けて、blockごとに1回で書き込む
+        読み込み・掛け算・書き込みはBlockPipelineで別スレッドにして重ねる
+        掛け算は使い回すバッファに直接書き込むので、frame数によらずメモリはおよそ 2 * (prefetch_depth + 2) block分で済む
+        prefetch_depth: 段階の間のキューに貯めるblock数 (0でも1として扱う)
+        calibration_image: build_calibration_imageで作ったimage。複数ファイルで使い回す場合に渡す。Noneならここで作る
+        attrs: ファイルに記録する属性 (校正元のファイルなど)
+        block_size: 1回に読み書きするframe数。Noneなら元データから決め、chunkのframe数の倍数に揃える
+        chunk_layout: calibrated_spectraの区切り方。ChunkLayoutを参照
+        compression: None, 'gzip', 'lzf' のいずれか。圧縮する場合はshuffleフィルタも掛ける
+        dtype: 保存する精度。np.float32かnp.float64。元データは16bitのカウントなので、通常はfloat32で十分
+        return: {'frame_num', 'block_size', 'seconds', 'frames_per_second', 'busy_seconds', 'wait_seconds', 'bottleneck'}
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in CalibrateSpectraWriter.SUPPORTED_DTYPES:
+            raise ValueError(f"保存する精度が不正です: {dtype}\n以下で指定してください: {', '.join(str(d) for d in CalibrateSpectraWriter.SUPPORTED_DTYPES)}")
+        if compression is not None and chunk_layout == ChunkLayout.CONTIGUOUS:
+            raise ValueError("contiguousな配置では圧縮できません。chunkの配置を変えてください。")
         print(f'log: Writing calibrated spectra to {path_to_hdf5}')
 
         # hdfファイルを生成し、書き込み先のpathを作成
@@ -33,36 +115,144 @@ class CalibrateSpectraWriter():
         wavelength_pixel_num = shape_data['wavelength_pixel_num']
         wavelength_arr = original_radiation.get_wavelength_arr()
 
-        # NumPy の補間関数を使用して、ランプデータのデータ点の波長を揃える
-        lamp_intensity_interpolated = np.interp(
-            wavelength_arr,
-            lamp_spectrum['wavelength'],
-            lamp_spectrum['intensity']
-        )
-
-        # ここまでの情報をもとに校正用のimage(2次元配列)を作成する
-        filter_image = np.zeros((position_pixel_num, wavelength_pixel_num))
-        lamp_image = np.zeros((position_pixel_num, wavelength_pixel_num))
-        # まずup, downのフィルター補正を展開
-        filter_image[:center_pixel, :] = up_response[:, np.newaxis].T  # 256は含まれない。
-        filter_image[center_pixel:, :] = down_response[:, np.newaxis].T
-        # 加えてlamp_spectrumを展開
-        lamp_image[:, :] = lamp_intensity_interpolated[:, np.newaxis].T
-        # これが校正用image。元データに掛けて使う
-        calibration_image = lamp_image / filter_image
+        # 校正用のimage(2次元配列)を作成する。元データに掛けて使う
+        if calibration_image is None:
+            calibration_image = CalibrateSpectraWriter.get_calibration_image(
+                wavelength_arr, lamp_spectrum, up_response, down_response, position_pixel_num, center_pixel
+            )
+        elif calibration_image.shape != (position_pixel_num, wavelength_pixel_num):
+            raise ValueError(f"校正用imageの形が元データと合いません: {calibration_image.shape}")
+        calibration_image = calibration_image.astype(dtype) # 掛け算の結果も同じ精度になる
 
         # 校正して書き込み
-        with h5py.File(path_to_hdf5, 'w') as f:
+        hdf_handle_pool.close(path_to_hdf5) # 読み込み用に開いたままだと書き込めない
+        with h5py.File(path_to_hdf5, 'w', rdcc_nbytes=hdf_handle_pool.rdcc_nbytes) as f:
+            for key, value in (attrs or {}).items():
+                f.attrs[key] = value
             # 波長データ
             f.create_dataset(path_to_wavelength_arr, data=wavelength_arr)
 
             # imageデータ
-            calib_dataset = f.create_dataset(path_to_calibrated_spectra, shape=(frame_num, position_pixel_num, wavelength_pixel_num))
-            for frame in tqdm(range(frame_num)):
-                calibrated_image = original_radiation.get_frame_data(frame=frame) * calibration_image
-                calib_dataset[frame, :, :] = calibrated_image
+            shape = (frame_num, position_pixel_num, wavelength_pixel_num)
+            chunks = chunk_layout.get_chunks(shape, dtype.itemsize)
+            calib_dataset = f.create_dataset(
+                path_to_calibrated_spectra,
+                shape=shape,
+                dtype=dtype,
+                chunks=chunks,
+                compression=compression,
+                shuffle=compression is not None
+            )
+            calib_dataset.attrs['chunk_layout'] = chunk_layout.value # 読み込む側が読み方を選べるように記録する
+            # chunkをまたいで書き込むと、圧縮したchunkを読み直すことになるので、blockをchunkのframe数の倍数にする
+            if block_size is None:
+                block_size = original_radiation.get_default_block_size()
+                if chunks is not None:
+                    block_size = max(1, block_size // chunks[0]) * chunks[0]
+            block_size = max(1, min(block_size, frame_num))
+            # 読み込み・掛け算・書き込みを別スレッドで重ねる。校正結果を入れるバッファはblockごとに確保せず使い回す
+            depth = max(1, prefetch_depth)
+            buffers = [
+                np.empty((block_size, position_pixel_num, wavelength_pixel_num), dtype=dtype)
+                for _ in range(BlockPipeline.get_buffer_num(depth))
+            ]
+
+            def calibrate(item, buffer):
+                start, block = item
+                out = buffer[:len(block)]
+                np.multiply(block, calibration_image, out=out) # (frame, position, wavelength) * (position, wavelength)
+                return start, out
+
+            with tqdm(total=frame_num) as progress:
+                def write(result):
+                    start, out = result
+                    calib_dataset[start:start + len(out), :, :] = out # 1回のhyperslabとして書き込む
+                    progress.update(len(out))
+
+                timing = BlockPipeline(
+                    source=original_radiation.iter_frame_blocks(block_size),
+                    compute=calibrate,
+                    sink=write,
+                    buffers=buffers,
+                    depth=depth
+                ).run()
+            seconds = timing['wall_seconds']
+
+        frame_cache.invalidate(path_to_hdf5) # 書き換えたファイルのframeがキャッシュに残らないようにする
+        frames_per_second = frame_num / seconds if seconds > 0 else float('inf')
+        print(f'log: Finished writing calibrated spectra to hdf5 ({frame_num} frames, {seconds:.2f} s, {frames_per_second:.1f} frames/s)')
+        print(f'log: busy seconds per stage {timing["busy_seconds"]} -> bottleneck: {timing["bottleneck"]}')
+        return {
+            'frame_num': frame_num,
+            'block_size': block_size,
+            'seconds': seconds,
+            'frames_per_second': frames_per_second,
+            'busy_seconds': timing['busy_seconds'],
+            'wait_seconds': timing['wait_seconds'],
+            'bottleneck': timing['bottleneck'],
+        }
+
+    @staticmethod
+    def output_lazy_to_hdf5(
+            original_radiation: SpectrumData,
+            lamp_spectrum: pd.DataFrame,
+            up_response: np.ndarray,
+            down_response: np.ndarray,
+            path_to_hdf5: str,
+            dtype=np.float32,
+            calibration_image: np.ndarray = None,
+            attrs: dict = None
+    ) -> dict:
+        """
+        校正済みの値は書き込まず、元の.speへの参照と校正用imageだけを書き込む(遅延校正)
+        SpectrumDataで開くと、読み込んだframe・positionにだけ校正用imageを掛ける
+        書き込みはすぐ終わり、容量はほぼ校正用imageの分だけになる。元の.speを移動・削除すると読めなくなるので注意
+        引数はoutput_to_hdf5を参照
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in CalibrateSpectraWriter.SUPPORTED_DTYPES:
+            raise ValueError(f"保存する精度が不正です: {dtype}\n以下で指定してください: {', '.join(str(d) for d in CalibrateSpectraWriter.SUPPORTED_DTYPES)}")
+        if original_radiation.file_extension != ".spe":
+            raise ValueError("遅延校正は.speファイルからのみ作れます。")
+        logger.info(f'Writing lazy calibration to {path_to_hdf5}')
+
+        shape_data = original_radiation.get_data_shape()
+        position_pixel_num = shape_data['position_pixel_num']
+        center_pixel = shape_data['center_pixel']
+        wavelength_pixel_num = shape_data['wavelength_pixel_num']
+        wavelength_arr = original_radiation.get_wavelength_arr()
+        if calibration_image is None:
+            calibration_image = CalibrateSpectraWriter.get_calibration_image(
+                wavelength_arr, lamp_spectrum, up_response, down_response, position_pixel_num, center_pixel
+            )
+        elif calibration_image.shape != (position_pixel_num, wavelength_pixel_num):
+            raise ValueError(f"校正用imageの形が元データと合いません: {calibration_image.shape}")
+        calibration_image = calibration_image.astype(dtype)
+
+        raw_spe_path = os.path.abspath(original_radiation.file_path)
+        hdf5_dir = os.path.dirname(os.path.abspath(path_to_hdf5))
+        # ファイルを開く前に求めておく。Windowsでドライブが違うと相対パスにできないので、そのときは絶対パスだけ保存する
+        try:
+            raw_spe_relpath = os.path.relpath(raw_spe_path, hdf5_dir)
+        except ValueError:
+            raw_spe_relpath = None
+        hdf_handle_pool.close(path_to_hdf5) # 読み込み用に開いたままだと書き込めない
+        with h5py.File(path_to_hdf5, 'w') as f:
+            for key, value in (attrs or {}).items():
+                f.attrs[key] = value
+            f.attrs['calibration_mode'] = SpectrumData.LAZY_CALIBRATION_MODE
+            f.attrs['raw_spe_path'] = raw_spe_path
+            if raw_spe_relpath is not None:
+                f.attrs['raw_spe_relpath'] = raw_spe_relpath
+            f.create_dataset('entry/wavelength_arr', data=wavelength_arr)
+            f.create_dataset('entry/calibration_image', data=calibration_image)
 
-        print('log: Finished writing calibrated spectra to hdf5')
+        frame_cache.invalidate(path_to_hdf5)
+        logger.info('Finished writing lazy calibration to hdf5')
+        return {
+            'frame_num': shape_data['frame_num'],
+            'raw_spe_path': raw_spe_path,
+        }
 
 class TemperatureDistributionWriter():
     @staticmethod
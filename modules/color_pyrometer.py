@@ -61,6 +61,9 @@ class ColorPyrometer:
         warning_pairs : list of tuples
             警告が発生した波長ペアのリスト
         """
+        # float32で保存されたスペクトルでも、比と方程式はfloat64で解く
+        wavelength_fit = np.asarray(wavelength_fit, dtype=np.float64)
+        intensity_fit = np.asarray(intensity_fit, dtype=np.float64)
         temperatures = []
         warning_pairs = []  # 警告が発生したペアを記録
         excepted_pairs = [] # 例外が発生したペアも記録
@@ -0,0 +1,179 @@
+""" 読み込み・計算・書き込みの3段階を別スレッドで重ねて実行するパイプライン
+
+読み込みスレッド -> (キュー) -> 計算スレッド -> (キュー) -> 書き込み(呼び出したスレッド) の順にblockを流す。
+キューの大きさはdepthで制限するので、メモリは数block分しか使わない。
+NumPyの大きな配列の計算やh5pyのI/OはGILを解放するので、スレッドでも3段階が重なる。
+段階ごとに処理していた時間と待っていた時間を測り、どこが律速かを確かめられるようにする。
+
+"""
+import queue
+import threading
+import time
+
+from log_util import logger
+
+
+class BlockPipeline:
+    """ 使い方:
+        pipeline = BlockPipeline(
+            source=spectrum.iter_frame_blocks(),        # (start, block) を返すイテラブル
+            compute=lambda item, buffer: ...,            # 計算結果を返す
+            sink=lambda result: ...,                     # 書き込む
+            buffers=[np.empty(...) for _ in range(BlockPipeline.get_buffer_num(depth))]
+        )
+        timing = pipeline.run()
+    """
+    STAGES = ('read', 'compute', 'write')
+    _END = object() # 読み込み終了の目印
+
+    def __init__(self, source, compute, sink, buffers: list = None, depth: int = 2):
+        """
+        :param source: 読み込みの段階。blockを返すイテラブル
+        :param compute: 計算の段階。buffersを渡した場合は compute(item, buffer)、そうでなければ compute(item)
+        :param sink: 書き込みの段階。sink(計算結果)。呼び出したスレッドで実行する
+        :param buffers: 計算結果を入れるバッファのリスト。書き込みが終わったら次のblockで使い回す。
+            足りないと計算が書き込みを待つので、get_buffer_num(depth)個用意する
+        :param depth: 段階の間のキューに貯める最大のblock数
+        """
+        if depth < 1:
+            raise ValueError(f"キューの深さは1以上にしてください: {depth}")
+        self.source = source
+        self.compute = compute
+        self.sink = sink
+        self.depth = depth
+        self._read_queue = queue.Queue(maxsize=depth)
+        self._compute_queue = queue.Queue(maxsize=depth)
+        self._free_buffers = None
+        if buffers is not None:
+            self._free_buffers = queue.Queue()
+            for buffer in buffers:
+                self._free_buffers.put(buffer)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.busy_seconds = {stage: 0.0 for stage in self.STAGES} # 段階ごとの処理時間
+        self.wait_seconds = {stage: 0.0 for stage in self.STAGES} # 段階ごとの待ち時間(キューやバッファ)
+
+    @staticmethod
+    def get_buffer_num(depth: int) -> int:
+        """ 計算中・キュー・書き込み中のblockが全てバッファを持てる数 """
+        return depth + 2
+
+    def _add_time(self, table: dict, stage: str, seconds: float):
+        with self._lock:
+            table[stage] += seconds
+
+    def _put(self, target_queue, item, stage) -> bool:
+        """ キューが空くまで待って入れる。止められたらFalse """
+        start = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    target_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self._add_time(self.wait_seconds, stage, time.perf_counter() - start)
+
+    def _get(self, source_queue, stage):
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    return source_queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stop_event.is_set():
+                        return self._END
+        finally:
+            self._add_time(self.wait_seconds, stage, time.perf_counter() - start)
+
+    def _read(self):
+        try:
+            iterator = iter(self.source)
+            while not self._stop_event.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self._add_time(self.busy_seconds, 'read', time.perf_counter() - start)
+                if not self._put(self._read_queue, item, 'read'):
+                    return
+        except BaseException as e: # スレッドで起きた例外は書き込み側で投げ直す
+            self._put(self._read_queue, e, 'read')
+            return
+        self._put(self._read_queue, self._END, 'read')
+
+    def _compute(self):
+        try:
+            while True:
+                item = self._get(self._read_queue, 'compute')
+                if item is self._END or isinstance(item, BaseException):
+                    self._put(self._compute_queue, item, 'compute')
+                    return
+                if self._free_buffers is not None:
+                    buffer = self._get(self._free_buffers, 'compute')
+                    if buffer is self._END:
+                        return
+                    start = time.perf_counter()
+                    result = (self.compute(item, buffer), buffer)
+                else:
+                    start = time.perf_counter()
+                    result = (self.compute(item), None)
+                self._add_time(self.busy_seconds, 'compute', time.perf_counter() - start)
+                if not self._put(self._compute_queue, result, 'compute'):
+                    return
+        except BaseException as e:
+            self._put(self._compute_queue, e, 'compute')
+
+    def run(self) -> dict:
+        """ 最後のblockを書き込むまで実行する
+
+        :return: get_timingを参照
+        """
+        wall_start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._read, name='pipeline_read', daemon=True),
+            threading.Thread(target=self._compute, name='pipeline_compute', daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(self._compute_queue, 'write')
+                if item is self._END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                result, buffer = item
+                start = time.perf_counter()
+                self.sink(result)
+                self._add_time(self.busy_seconds, 'write', time.perf_counter() - start)
+                if buffer is not None:
+                    self._free_buffers.put(buffer) # 書き込みが終わったので次のblockで使う
+        finally:
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+        timing = self.get_timing(time.perf_counter() - wall_start)
+        logger.info(f"パイプライン終了: {timing}")
+        return timing
+
+    def get_timing(self, wall_seconds: float) -> dict:
+        """
+        :return dict:
+            wall_seconds: 全体の時間
+            busy_seconds, wait_seconds: 段階ごとの処理時間と待ち時間
+            bottleneck: 処理時間が最も長い段階
+        """
+        with self._lock:
+            busy_seconds = dict(self.busy_seconds)
+            wait_seconds = dict(self.wait_seconds)
+        return {
+            'wall_seconds': wall_seconds,
+            'busy_seconds': busy_seconds,
+            'wait_seconds': wait_seconds,
+            'bottleneck': max(busy_seconds, key=busy_seconds.get),
+        }
@@ -0,0 +1,117 @@
+""" 校正用imageをディスクに保存して使い回すキャッシュ
+
+同じ時期・ODのファイルは、ランプデータ・Up/Downのフィルター応答・波長配列が全て同じなので、校正用imageも同じになる。
+これらの中身(値)のハッシュをキーにしてCACHE_DIRに保存し、次からは計算せずに読み込む。
+ファイル名ではなく中身で引くので、同じデータを別の場所に置いても使い回せる。
+保存した合計がmax_bytesを超えたら、最も長く使われていないものから消す。
+
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from log_util import logger
+
+
+class CalibrationImageCache:
+    CACHE_DIR = os.path.join('cache', 'calibration')
+    SUFFIX = '.npy'
+    DEFAULT_MAX_BYTES = 512 * 1024 ** 2 # 512 MB
+    VERSION = 1 # 校正用imageの作り方を変えたら上げる。キーに含めるので古い保存結果は使われない
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def make_key(cls, lamp_spectrum: pd.DataFrame, up_response: np.ndarray, down_response: np.ndarray,
+                 wavelength_arr: np.ndarray, position_pixel_num: int, center_pixel: int) -> str:
+        """ 校正用imageを決める入力の中身からキーを作る """
+        digest = hashlib.sha1()
+        digest.update(f"v{cls.VERSION}|{position_pixel_num}|{center_pixel}".encode('utf-8'))
+        for array in (
+            lamp_spectrum['wavelength'].to_numpy(),
+            lamp_spectrum['intensity'].to_numpy(),
+            up_response,
+            down_response,
+            wavelength_arr,
+        ):
+            array = np.ascontiguousarray(array, dtype=np.float64) # dtypeの違いで別のキーにならないよう揃える
+            digest.update(str(array.shape).encode('utf-8'))
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def load(self, key: str):
+        """ 保存された校正用imageを読み込む。なければNone """
+        path = self._get_path(key)
+        try:
+            image = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f'校正用imageを読み込めませんでした: {path}, {e}')
+            return None
+        os.utime(path) # 使った時刻を更新して、消されにくくする
+        logger.debug(f'保存された校正用imageを使います: {path}')
+        return image
+
+    def save(self, key: str, image: np.ndarray):
+        """ 校正用imageを保存する。書き込めなければ警告だけ出す """
+        path = self._get_path(key)
+        tmp_path = path + '.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.save(f, image, allow_pickle=False)
+            os.replace(tmp_path, path) # 書きかけのファイルを残さない
+            logger.debug(f'校正用imageを保存しました: {path}')
+        except OSError as e:
+            logger.warning(f'校正用imageを保存できませんでした: {path}, {e}')
+            return
+        self._evict()
+
+    def get_or_build(self, key: str, builder) -> np.ndarray:
+        """ 保存されていればそれを、なければbuilder()で作って保存したものを返す """
+        image = self.load(key)
+        if image is None:
+            image = builder()
+            self.save(key, image)
+        return image
+
+    def _evict(self):
+        """ 合計がmax_bytesを超えていたら、最後に使った時刻が古いものから消す """
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(self.SUFFIX):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime_ns, stat.st_size, name))
+        except OSError:
+            return
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total_bytes -= size
+                logger.debug(f'古い校正用imageを削除しました: {name}')
+            except OSError:
+                pass
+
+    def clear(self):
+        """ 保存された校正用imageを全て消す """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.SUFFIX):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+# アプリ全体で共有するキャッシュ
+calibration_image_cache = CalibrationImageCache()
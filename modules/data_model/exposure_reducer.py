@@ -0,0 +1,112 @@
+""" 露光データを1回だけ走査して、frameごとの統計量をまとめて計算するクラス
+
+最大強度・上下半分の最大強度・(frame, position)ごとの最大強度・frameごとの合計と平均を、
+blockずつ読み込みながら同時に集計する。メモリは1block分と結果の配列分しか使わない。
+
+"""
+import numpy as np
+
+
+class ExposureReducer:
+    NOISE_HISTOGRAM_BINS = 200
+
+    def __init__(self, frame_num: int, position_pixel_num: int, wavelength_pixel_num: int, center_pixel: int):
+        """
+        :param frame_num:
+        :param position_pixel_num:
+        :param wavelength_pixel_num:
+        :param center_pixel: upとdownの境目
+        """
+        self.frame_num = frame_num
+        self.position_pixel_num = position_pixel_num
+        self.wavelength_pixel_num = wavelength_pixel_num
+        self.center_pixel = center_pixel
+        self.max_intensity_2d = None # dtypeは最初のblockに合わせる
+        self.sum_intensity = np.zeros(frame_num, dtype=np.float64)
+        self.processed_frame_num = 0
+
+    def update(self, start: int, block: np.ndarray):
+        """ shape=(frame, position, wavelength)のblockを集計に加える
+
+        :param start: blockの最初のframe
+        :param block:
+        :return:
+        """
+        stop = start + len(block)
+        if self.max_intensity_2d is None:
+            self.max_intensity_2d = np.zeros((self.frame_num, self.position_pixel_num), dtype=block.dtype)
+        # 波長方向の最大値を先に取れば、他の最大値はこの小さい配列から求まる
+        self.max_intensity_2d[start:stop] = block.max(axis=2)
+        self.sum_intensity[start:stop] = block.sum(axis=(1, 2), dtype=np.float64)
+        self.processed_frame_num += len(block)
+
+    def get_result(self) -> dict:
+        """ 集計結果を返す
+
+        :return dict of key=str, value=ndarray:
+            max_intensity: frameごとの最大強度
+            up_max_intensity, down_max_intensity: center_pixelで分けた上下それぞれの最大強度
+            max_intensity_2d: (frame, position)ごとの最大強度
+            sum_intensity, mean_intensity: frameごとの合計と平均
+            noise_*: compute_noise_statisticsを参照
+        """
+        if self.processed_frame_num != self.frame_num:
+            raise RuntimeError(f"集計が終わっていません: {self.processed_frame_num} / {self.frame_num} frame")
+        max_intensity_2d = self.max_intensity_2d
+        if max_intensity_2d is None: # frame数が0の場合
+            max_intensity_2d = np.zeros((0, self.position_pixel_num))
+        return {
+            **self.compute_noise_statistics(max_intensity_2d),
+            "max_intensity": max_intensity_2d.max(axis=1),
+            # NOTE: 元の実装と同じ範囲で分ける(端の1pixelは含まない)
+            "up_max_intensity": max_intensity_2d[:, 0:self.center_pixel - 1].max(axis=1),
+            "down_max_intensity": max_intensity_2d[:, self.center_pixel:-1].max(axis=1),
+            "max_intensity_2d": max_intensity_2d,
+            "sum_intensity": self.sum_intensity,
+            "mean_intensity": self.sum_intensity / (self.position_pixel_num * self.wavelength_pixel_num),
+        }
+
+    @classmethod
+    def compute_noise_statistics(cls, max_intensity_2d: np.ndarray) -> dict:
+        """ (frame, position)ごとの最大強度の分布から、背景(ノイズ)の統計量を求める
+
+        加熱されていない位置がほとんどなので、中央値を背景の強度、MADから換算した標準偏差をノイズの大きさとする。
+
+        :param max_intensity_2d:
+        :return dict:
+            noise_histogram_counts, noise_histogram_edges: 最大強度のヒストグラム
+            noise_median: 中央値
+            noise_sigma: MAD * 1.4826 (正規分布の標準偏差に相当)
+        """
+        if max_intensity_2d.size == 0:
+            return {
+                "noise_histogram_counts": np.zeros(0, dtype=np.int64),
+                "noise_histogram_edges": np.zeros(0),
+                "noise_median": np.nan,
+                "noise_sigma": np.nan,
+            }
+        counts, edges = np.histogram(max_intensity_2d, bins=cls.NOISE_HISTOGRAM_BINS)
+        median = float(np.median(max_intensity_2d))
+        mad = float(np.median(np.abs(max_intensity_2d.astype(np.float64) - median)))
+        return {
+            "noise_histogram_counts": counts,
+            "noise_histogram_edges": edges,
+            "noise_median": median,
+            "noise_sigma": 1.4826 * mad,
+        }
+
+    @classmethod
+    def reduce(cls, block_iterable, frame_num, position_pixel_num, wavelength_pixel_num, center_pixel,
+               progress_callback=None) -> dict:
+        """ blockのイテラブルを1回だけ走査して集計結果を返す
+
+        :param block_iterable: (blockの最初のframe, block) を返すイテラブル
+        :param progress_callback: 0から1の進捗を受け取る関数。Noneなら報告しない
+        :return: get_resultを参照
+        """
+        reducer = cls(frame_num, position_pixel_num, wavelength_pixel_num, center_pixel)
+        for start, block in block_iterable:
+            reducer.update(start, block)
+            if progress_callback is not None:
+                progress_callback(reducer.processed_frame_num / frame_num)
+        return reducer.get_result()
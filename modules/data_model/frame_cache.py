@@ -0,0 +1,101 @@
+""" SpectrumDataのインスタンス間で共有する、容量(バイト数)上限つきのframeキャッシュ
+
+functools.cacheと違い、上限を超えたら最も長く使われていないframeから捨てる(LRU)。
+キーは (ファイルの絶対パス, 更新時刻, frame) なので、ファイルが書き換わると古いframeは使われなくなる。
+書き換えたことが分かっている場合は invalidate で明示的に捨てる。
+
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from log_util import logger
+
+
+class FrameCache:
+    DEFAULT_MAX_BYTES = 256 * 1024 ** 2 # 256 MB
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> ndarray。末尾ほど最近使われたもの
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(file_path: str, frame: int) -> tuple:
+        """ (ファイルの絶対パス, 更新時刻, frame) のキーを作る """
+        file_path = os.path.abspath(file_path)
+        return file_path, os.stat(file_path).st_mtime_ns, frame
+
+    def get(self, key):
+        with self._lock:
+            array = self._entries.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def put(self, key, array: np.ndarray):
+        """ frameを追加する。呼び出し側で書き換えられないよう読み取り専用にする """
+        array.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._current_bytes -= self._entries.pop(key).nbytes
+            if array.nbytes > self.max_bytes: # 1frameで上限を超えるものはキャッシュしない
+                return
+            self._entries[key] = array
+            self._current_bytes += array.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """ キャッシュにあればそれを、なければloader()で読み込んで追加したものを返す """
+        array = self.get(key)
+        if array is None:
+            array = loader()
+            self.put(key, array)
+        return array
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def invalidate(self, file_path: str = None):
+        """ 指定したファイルのframeを捨てる。Noneなら全て捨てる """
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+                self._current_bytes = 0
+                return
+            file_path = os.path.abspath(file_path)
+            for key in [key for key in self._entries if key[0] == file_path]:
+                self._current_bytes -= self._entries.pop(key).nbytes
+        logger.debug(f'frameキャッシュを破棄しました: {file_path}')
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'frame_num': len(self._entries),
+                'current_bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# 全てのSpectrumDataで共有するキャッシュ
+frame_cache = FrameCache()
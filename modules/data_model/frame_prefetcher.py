@@ -0,0 +1,84 @@
+""" frameのblockを別スレッドで先読みするイテレータ
+
+読み込み(I/O)と計算を交互に行うループで、計算している間に次のblockを読み込んでおく。
+ネットワーク越しのフォルダなど、読み込みの待ち時間が長いときに効く。
+NumPyの大きな配列の読み込みやh5pyのI/OはGILを解放するので、スレッドでも重ねられる。
+
+"""
+import queue
+import threading
+
+from log_util import logger
+
+
+class FramePrefetcher:
+    """ blockを返すイテラブルを読み込みスレッドで回し、最大depth個のblockを先読みしてキューに貯める
+
+    使い方:
+        with FramePrefetcher(spectrum.iter_frame_blocks(), depth=2) as blocks:
+            for start, block in blocks:
+                ...
+    """
+    _END = object() # 読み込み終了の目印
+
+    def __init__(self, block_iterable, depth: int = 2):
+        """
+        :param block_iterable: (blockの最初のframe, block) を返すイテラブル。SpeWrapperやHDFDataFetcherから読み込むもの
+        :param depth: 先読みしておくblockの最大数。メモリはおよそ (depth + 1) block分使う
+        """
+        if depth < 1:
+            raise ValueError(f"先読みの深さは1以上にしてください: {depth}")
+        self.block_iterable = block_iterable
+        self.depth = depth
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _put(self, item) -> bool:
+        """ キューが空くまで待って入れる。止められたらFalse """
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_blocks(self):
+        try:
+            for item in self.block_iterable:
+                if not self._put(item):
+                    return
+        except BaseException as e: # 読み込みスレッドで起きた例外は取り出す側で投げ直す
+            self._put(e)
+            return
+        self._put(self._END)
+
+    def __iter__(self):
+        if self._thread is not None:
+            raise RuntimeError("FramePrefetcherは一度しかイテレートできません。")
+        self._thread = threading.Thread(target=self._read_blocks, name='frame_prefetcher', daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """ 読み込みスレッドを止める。途中でループを抜けた場合も呼ばれる """
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            logger.debug("先読みスレッドを終了しました")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
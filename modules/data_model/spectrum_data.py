@@ -3,14 +3,18 @@
 ファイル形式が異なっても同様の操作感を保つようにする
 
 """
-import functools
+import os
 from enum import Enum
 import numpy as np
 from scipy.ndimage import rotate
-import streamlit as st
 
 from modules.file_format.spe_wrapper import SpeWrapper
 from modules.file_format.HDF5 import HDF5Reader
+from modules.file_format.spe_catalog import SpeCatalog
+from modules.data_model.frame_prefetcher import FramePrefetcher
+from modules.data_model.exposure_reducer import ExposureReducer
+from modules.data_model.summary_cache import ExposureSummaryCache
+from modules.data_model.frame_cache import FrameCache, frame_cache
 from log_util import logger
 
 class RotateOption(Enum):
@@ -27,7 +31,11 @@ class RotateOption(Enum):
 
 class SpectrumData:
     """ 元データのファイル形式によって分岐する """
+    PREFETCH_DEPTH = 2 # frameを順に全て読むときに先読みしておくblock数
+    LAZY_CALIBRATION_MODE = "lazy" # 校正済みの値を持たず、元の.speと校正用imageだけを持つ.hdfの目印
+    BLOCK_BYTES = 64 * 1024 ** 2 # 1回に読み込むblockの大きさの目安
     file_extension: str # ファイル拡張子
+    file_path: str
     file_name: str # 由来のファイル名
     position_pixel_num: int
     wavelength_pixel_num: int
@@ -43,17 +51,29 @@ class SpectrumData:
         :exception ValueError: 未実装のファイル形式の場合
         """
         logger.info('インスタンス化の開始')
+        self.file_path = file_path
+        self._exposure_statistics = None # get_exposure_statisticsの結果
+        self._wavelength_arr = None # get_wavelength_arrの結果
+        self.calibration_image = None # 遅延校正の.hdfの場合だけ、読み込むときに掛ける校正用image
+        self.spectra_fetcher = None # 校正済みの値を持つ.hdfの場合だけ使う
 
         if file_path.endswith('.spe'): # file_dataでなくfile_pathをもらって、拡張子で判断する
             logger.debug('.speファイル分岐')
             self.file_extension = ".spe"
-            self.spe = SpeWrapper(file_path)
+            self.spe = SpeWrapper(file_path, header_only=True) # 波長などはフッターから必要になった時に読む
             self.file_name = self.spe.file_name
         elif file_path.endswith('.hdf'): # FIXME: 本当はHDFクラスの可能な拡張子一通りでひっかけないといけない -> h5pyのis_hdfみたいなやつ使う
             logger.debug('hdfファイル分岐')
             self.file_extension = ".hdf"
             self.hdf = HDF5Reader(file_path)
-            self.spectra_fetcher = self.hdf.create_fetcher(query='calibrated_spectra')
+            attrs = self.hdf.get_attrs()
+            if attrs.get('calibration_mode') == self.LAZY_CALIBRATION_MODE:
+                # 遅延校正: 元の.speを開き、読み込んだ部分にだけ校正用imageを掛ける
+                logger.debug('遅延校正の.hdf')
+                self.spe = SpeWrapper(self._find_raw_spe_path(attrs), header_only=True)
+                self.calibration_image = self.hdf.find_by(query='calibration_image')
+            else:
+                self.spectra_fetcher = self.hdf.create_fetcher(query='calibrated_spectra')
             self.file_name = file_path.split("/")[-1][:-4] # HDF5Readerクラスに実装すべきかもしれない # FIXME windows対応
         # その他の場合: 実装されていないのでエラー
         else:
@@ -63,17 +83,82 @@ class SpectrumData:
         self.get_data_shape()
         logger.info('インスタンス化の終了')
 
-    @functools.cache
+    def _find_raw_spe_path(self, attrs: dict) -> str:
+        """ 遅延校正の.hdfが参照する.speを探す。フォルダごと移動しても見つかるよう、相対パスを先に試す """
+        candidates = [attrs['raw_spe_path']]
+        if 'raw_spe_relpath' in attrs: # 別のドライブにある場合は相対パスを保存していない
+            candidates.insert(0, os.path.join(os.path.dirname(os.path.abspath(self.file_path)), attrs['raw_spe_relpath']))
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"参照している.speファイルが見つかりません: {attrs['raw_spe_path']}")
+
     def get_frame_data(self, frame):
         match self.file_extension:
+            case ".hdf" if self.calibration_image is not None:
+                return self.spe.as_memmap()[frame] * self.calibration_image
             case ".spe":
-                return self.spe.get_frame_data(frame=frame)
+                # ネイティブのdtypeのままのビュー。コピーしないので、キャッシュせずOSのページキャッシュに任せる
+                return self.spe.as_memmap()[frame]
             case ".hdf":
-                return self.spectra_fetcher.fetch_by_frame(frame=frame)
+                # 容量上限つきで全インスタンス共有のキャッシュを使う。読み取り専用の配列が返る
+                return frame_cache.get_or_load(
+                    FrameCache.make_key(self.file_path, frame),
+                    lambda: self.spectra_fetcher.fetch_by_frame(frame=frame)
+                )
+            case _:
+                raise ValueError("データ形式(拡張子)に対応していません。")
+
+    def get_default_block_size(self) -> int:
+        """ 1blockがおよそBLOCK_BYTESになるframe数を返す。.hdfでは、chunkをまたがないようchunkのframe数の倍数にする """
+        match self.file_extension:
+            case ".spe":
+                itemsize = self.spe.pixel_dtype.itemsize
+            case ".hdf" if self.calibration_image is not None:
+                itemsize = self.calibration_image.dtype.itemsize # 掛けた後の大きさ
+            case ".hdf":
+                itemsize = self.spectra_fetcher.dataset_dtype.itemsize
+            case _:
+                raise ValueError("データ形式(拡張子)に対応していません。")
+        frame_bytes = self.position_pixel_num * self.wavelength_pixel_num * itemsize
+        block_size = max(1, self.BLOCK_BYTES // frame_bytes)
+        if self.spectra_fetcher is not None and self.spectra_fetcher.chunks is not None:
+            chunk_frame_num = self.spectra_fetcher.chunks[0]
+            block_size = max(1, block_size // chunk_frame_num) * chunk_frame_num
+        return block_size
+
+    def iter_frame_blocks(self, block_size: int = None, start: int = 0, stop: int = None, prefetch_depth: int = 0):
+        """ 連続したframeをblock_sizeずつまとめて読み込んで返すイテレータ
+
+        1frameずつ読むよりも読み込みの回数が減る。メモリは1block分しか使わない。
+        prefetch_depthを指定すると、別スレッドで次のblockを先読みする(メモリは(prefetch_depth + 1) block分)。
+
+        :param block_size: 1回に読み込むframe数。Noneならget_default_block_sizeで決める
+        :param start: 最初のframe
+        :param stop: 最後のframeの次。Noneなら最後まで
+        :param prefetch_depth: 先読みしておくblock数。0なら先読みしない
+        :return: (blockの最初のframe, shape=(frame, position, wavelength)のndarray) のジェネレータ
+        """
+        if prefetch_depth > 0:
+            yield from FramePrefetcher(self.iter_frame_blocks(block_size, start, stop), depth=prefetch_depth)
+            return
+        if block_size is None:
+            block_size = self.get_default_block_size()
+        if stop is None:
+            stop = self.frame_num
+        match self.file_extension:
+            case ".hdf" if self.calibration_image is not None:
+                for block_start, block in self.spe.iter_frame_blocks(block_size, start=start, stop=stop):
+                    yield block_start, block * self.calibration_image
+            case ".spe":
+                yield from self.spe.iter_frame_blocks(block_size, start=start, stop=stop)
+            case ".hdf":
+                for block_start in range(start, stop, block_size):
+                    block_stop = min(block_start + block_size, stop)
+                    yield block_start, self.spectra_fetcher.fetch_by_frame_range(block_start, block_stop)
             case _:
                 raise ValueError("データ形式(拡張子)に対応していません。")
 
-    @functools.cache
     def get_data_shape(self) -> dict:
         """ 露光データの形(データ数)を返す
 
@@ -81,8 +166,8 @@ class SpectrumData:
         """
         logger.debug('shapeの取得開始')
         match self.file_extension:
-            case ".spe":
-                frame_num = self.spe.num_frames
+            case ".spe" | ".hdf" if self.spectra_fetcher is None: # .speと、遅延校正の.hdf(元の.speから取得する)
+                frame_num = int(self.spe.num_frames) # ヘッダーから読むとnp.uint64になり、intとの演算でfloatになるため
                 # NOTE: ↓ROIには対応できていないかも。ROI設定したこと無いのでわからない。
                 # TODO: 本当にheightがposでwidthがwlか確かめる。labのデータが違うpixel数を持ってたはず
                 position_pixel_num = self.spe.roi_list[0].height # 加熱位置
@@ -108,68 +193,142 @@ class SpectrumData:
                 self.frame_num = data_shape[0]
                 self.position_pixel_num = data_shape[1]
                 self.wavelength_pixel_num = data_shape[2]
-                self.center_pixel = round(self.wavelength_pixel_num / 2) # 四捨五入でなく、round to evenなので注意
+                self.center_pixel = round(self.position_pixel_num / 2) # 四捨五入でなく、round to evenなので注意
+                return {
+                    "frame_num": self.frame_num,
+                    "position_pixel_num": self.position_pixel_num,
+                    "center_pixel": self.center_pixel,
+                    "wavelength_pixel_num": self.wavelength_pixel_num
+                }
             case _:
                 raise ValueError("データ形式(拡張子)に対応していません。")
 
-    @functools.cache
     def get_wavelength_arr(self):
-        """ 測定された波長配列を返す
+        """ 測定された波長配列を返す。一度読み込んだらインスタンスに保持する
 
         :return:
         """
+        if self._wavelength_arr is None:
+            match self.file_extension:
+                case ".spe":
+                    self._wavelength_arr = self.spe.get_wavelengths()[0]
+                case ".hdf":
+                    self._wavelength_arr = self.hdf.find_by(query='wavelength_arr')
+                case _:
+                    raise ValueError("データ形式(拡張子)に対応していません。")
+        return self._wavelength_arr
+
+    def get_wavelength_slice(self, wavelength_range) -> slice:
+        """ 波長範囲 [lo, hi] に入る列を、連続した範囲(slice)として返す
+
+        :param wavelength_range: (下限, 上限) (nm)
+        :return:
+        :exception ValueError: 範囲に入る波長がない場合、または波長が単調でなく連続した範囲にならない場合
+        """
+        lower, upper = wavelength_range
+        wavelength_arr = self.get_wavelength_arr()
+        columns = np.flatnonzero((wavelength_arr >= lower) & (wavelength_arr <= upper))
+        if len(columns) == 0:
+            raise ValueError(f"{lower} - {upper} nm に入る波長がありません。")
+        if columns[-1] - columns[0] + 1 != len(columns):
+            raise ValueError("波長が単調でないため、連続した範囲として読み込めません。")
+        return slice(int(columns[0]), int(columns[-1]) + 1)
+
+    def get_spectra(self, frames, positions, wavelength_range=None):
+        """ (frame, position)の組ごとのスペクトルを、波長範囲の列だけ読み込んで返す
+
+        .hdfでは範囲外の列をファイルから読まず、.speではmemmapの必要な部分しか触らない。
+        frameごとにまとめて読むので、同じframeのpositionが多いほど読み込みの回数が減る。
+
+        :param frames: frameの配列
+        :param positions: positionの配列。framesと同じ長さで、同じ順番の要素が組になる
+        :param wavelength_range: (下限, 上限) (nm)。Noneなら全波長
+        :return: (範囲内の波長配列, shape=(組の数, 範囲内の波長数)のndarray)。dtypeは元データのまま
+        """
+        frames = np.asarray(frames, dtype=np.int64).ravel()
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        if frames.shape != positions.shape:
+            raise ValueError(f"framesとpositionsの長さが違います: {len(frames)}, {len(positions)}")
+        wavelength_slice = slice(None) if wavelength_range is None else self.get_wavelength_slice(wavelength_range)
+        wavelength_arr = self.get_wavelength_arr()[wavelength_slice]
         match self.file_extension:
             case ".spe":
-                return self.spe.get_wavelengths()[0]
+                # 整数配列での参照はコピーになるが、触るのは必要な行・列のページだけ
+                spectra = self.spe.as_memmap()[frames, positions, wavelength_slice]
+            case ".hdf" if self.calibration_image is not None:
+                spectra = self.spe.as_memmap()[frames, positions, wavelength_slice] \
+                    * self.calibration_image[positions, wavelength_slice]
             case ".hdf":
-                return self.hdf.find_by(query='wavelength_arr')
+                spectra = self.spectra_fetcher.fetch_spectra(frames, positions, wavelength_slice)
             case _:
                 raise ValueError("データ形式(拡張子)に対応していません。")
+        return wavelength_arr, spectra
 
-    @functools.cache
-    def get_max_intensity_arr(self):
+    def get_exposure_statistics(self, progress_callback=None) -> dict:
+        """ ファイルを1回だけ走査して、frameごとの統計量をまとめて計算する。結果はインスタンスに保持する
+
+        :param progress_callback: 0から1の進捗を受け取る関数。Noneなら報告しない
+        :return: ExposureReducer.get_resultを参照
+        """
+        if self._exposure_statistics is None:
+            match self.file_extension:
+                case ".spe" | ".hdf":
+                    # 以前に集計してファイルの横に保存してあれば、それを使う
+                    # 遅延校正の.hdfは元の.speから読むので、.speが変わったときも集計し直す
+                    dependency_paths = [self.spe.filepath] if self.calibration_image is not None else []
+                    summary_cache = ExposureSummaryCache(self.file_path, dependency_paths=dependency_paths)
+                    statistics = summary_cache.load()
+                    if statistics is None:
+                        logger.debug('露光データの統計量を集計')
+                        statistics = ExposureReducer.reduce(
+                            self.iter_frame_blocks(prefetch_depth=self.PREFETCH_DEPTH),
+                            frame_num=self.frame_num,
+                            position_pixel_num=self.position_pixel_num,
+                            wavelength_pixel_num=self.wavelength_pixel_num,
+                            center_pixel=self.center_pixel,
+                            progress_callback=progress_callback
+                        )
+                        summary_cache.save(statistics)
+                    self._exposure_statistics = statistics
+                case _:
+                    raise ValueError("データ形式(拡張子)に対応していません。")
+        return self._exposure_statistics
+
+    def get_max_intensity_arr(self, progress_callback=None):
         """ それぞれのframeでの最大強度からなる配列を集計して返す
         
+        :param progress_callback: 0から1の進捗を受け取る関数。Noneなら報告しない
         :return: 
         """
-        match self.file_extension:
-            case ".spe":
-                all_max_I = self.spe.get_all_data_arr().max(axis=(1, 2))
-                return all_max_I
-            case _:
-                raise ValueError("データ形式(拡張子)に対応していません。")
+        return self.get_exposure_statistics(progress_callback=progress_callback)['max_intensity']
 
-    @functools.cache
-    def get_separated_max_intensity_arr(self):
+    def get_separated_max_intensity_arr(self, progress_callback=None):
         """
 
-        :return:
+        :param progress_callback: 0から1の進捗を受け取る関数。Noneなら報告しない
+        :return: center_pixelで分けた上下それぞれの、frameごとの最大強度
         """
-        match self.file_extension:
-            case ".spe":
-                shape_params_dict = self.get_data_shape()
-                center_pixel = shape_params_dict['center_pixel']
-                all_data = self.spe.get_all_data_arr()
-                up_max_I = all_data[:, 0:center_pixel - 1, :].max(axis=(1, 2))
-                down_max_I = all_data[:, center_pixel:-1, :].max(axis=(1, 2))
-                return up_max_I, down_max_I
-            case _:
-                raise ValueError("データ形式(拡張子)に対応していません。")
+        statistics = self.get_exposure_statistics(progress_callback=progress_callback)
+        return statistics['up_max_intensity'], statistics['down_max_intensity']
+
+    def get_noise_statistics(self, progress_callback=None) -> dict:
+        """ (frame, position)ごとの最大強度から求めた背景(ノイズ)の統計量。集計結果と一緒に保存される
 
-    @functools.cache
-    def get_max_intensity_2d_arr(self):
+        :param progress_callback: 0から1の進捗を受け取る関数。Noneなら報告しない
+        :return: ExposureReducer.compute_noise_statisticsを参照
         """
+        statistics = self.get_exposure_statistics(progress_callback=progress_callback)
+        return {name: value for name, value in statistics.items() if name.startswith('noise_')}
 
-        :return: (frame, position)における最大強度を持つ二次元配列
+    def get_max_intensity_2d_arr(self, progress_callback=None):
+        """ blockずつ読み込んで、ベクトル化した計算で集計する。.speと校正済みの.hdfのどちらでも使える
+
+        :param progress_callback: 0から1の進捗を受け取る関数(st.progress(0.0).progressなど)。Noneなら報告しない
+        :return: (frame, position)における最大強度を持つ二次元配列(float64)
         """
         logger.debug("Entered get_max_intensity_2d_arr")
-        intensity_arr = np.zeros((self.frame_num, self.position_pixel_num))
-        progress = st.progress(0.0) # for debug
-        for frame in range(self.frame_num):
-            image = self.get_frame_data(frame)
-            intensity_arr[frame, :] = image.max(axis=1)
-            progress.progress(frame / self.frame_num) # for debug
-        return intensity_arr
+        # 集計はファイルのdtypeのまま行うが、返す配列は以前と同じfloat64にする(_dist.hdfに保存される形式を変えない)
+        return self.get_exposure_statistics(progress_callback=progress_callback)['max_intensity_2d'].astype(np.float64)
 
     def get_centers_arr_by_max(self, frame):
         """ frame?全体?のimshowにscatterする中心位置を得る
@@ -190,8 +349,11 @@ class SpectrumData:
         pass
 
     def get_rotated_image(self, frame, rotate_deg, rotate_option):
+        return self.rotate_image(self.get_frame_data(frame), rotate_deg, rotate_option)
+
+    def rotate_image(self, image, rotate_deg, rotate_option):
         option_enum = RotateOption.from_str(rotate_option)
-        image = self.get_frame_data(frame)
+        image = image.astype(np.float64) # 整数型のまま回転すると丸めが変わるので浮動小数点にしておく
         match option_enum:
             case RotateOption.WHOLE:
                 return rotate(image, angle=rotate_deg, reshape=False)
@@ -234,15 +396,21 @@ class SpectrumData:
             image_type = before_spe.DATA_TYPE_DICT[before_spe._data_type]
             image_size = before_radiation.position_pixel_num * before_radiation.wavelength_pixel_num
 
-            for frame in range(before_radiation.frame_num):
-                spe_file.seek(position) # 書き込み場所に行く
-                rotated_image = before_radiation.get_rotated_image(frame, rotate_deg, rotate_option)
-                # 次元数を取得して、1次元データに変換する
-                flattened_image = rotated_image.reshape(image_size, 1) # 2次元データを1次元に
-                new_image = flattened_image.astype(dtype=image_type)
-                # 書き込み処理
-                spe_file.write(new_image.tobytes()) # バイナリ書き込み
-                position = spe_file.tell() # 書き込み終了したところにpositionを更新する
+            # 連続したframeをまとめて読み込み、1frameずつ回転して書き込む
+            for _, block in before_radiation.iter_frame_blocks():
+                for image in block:
+                    spe_file.seek(position) # 書き込み場所に行く
+                    rotated_image = before_radiation.rotate_image(image, rotate_deg, rotate_option)
+                    # 次元数を取得して、1次元データに変換する
+                    flattened_image = rotated_image.reshape(image_size, 1) # 2次元データを1次元に
+                    new_image = flattened_image.astype(dtype=image_type)
+                    # 書き込み処理
+                    spe_file.write(new_image.tobytes()) # バイナリ書き込み
+                    position = spe_file.tell() # 書き込み終了したところにpositionを更新する
+        # 書き換えたファイルの集計結果と索引を削除する
+        # (.speのframeはmemmapのビューなのでframe_cacheには入っていない。memmapは書き換え後の内容が見える)
+        ExposureSummaryCache(after_spe_path).invalidate()
+        SpeCatalog.for_folder(os.path.dirname(os.path.abspath(after_spe_path))).invalidate(os.path.basename(after_spe_path))
 
 def confirm_valid_file_combination(before_radiation, after_radiation):
     if before_radiation.frame_num != after_radiation.frame_num:
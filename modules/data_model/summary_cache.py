@@ -0,0 +1,107 @@
+""" 露光データの集計結果(最大強度マップなど)をファイルの横に保存して使い回すクラス
+
+ページを開き直すたびに.speファイル全体を走査しないようにする。
+保存先はデータファイルと同じフォルダの .<ファイル名>.summary.npz (.はじまりなのでファイル一覧には出てこない)。
+そのフォルダに書き込めない場合はアプリのキャッシュフォルダ(CACHE_DIR)に保存する。
+(パス, サイズ, 更新時刻)が一致しない保存結果は使わない。
+遅延校正の.hdfのように中身を別のファイルから読む場合は、そのファイルの(パス, サイズ, 更新時刻)もキーに含める。
+
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from log_util import logger
+
+
+class ExposureSummaryCache:
+    SUFFIX = '.summary.npz'
+    CACHE_DIR = os.path.join('cache', 'summary') # データフォルダに書き込めないとき用
+    VERSION = 3 # 保存する項目を変えたら上げる。違うversionの保存結果は使わない
+
+    def __init__(self, file_path: str, dependency_paths: list = ()):
+        """
+        :param file_path: 集計したデータファイル
+        :param dependency_paths: file_pathの中身が参照している別のファイル(遅延校正の.hdfが参照する.speなど)
+        """
+        self.file_path = os.path.abspath(file_path)
+        self.dependency_paths = [os.path.abspath(path) for path in dependency_paths]
+        directory, file_name = os.path.split(self.file_path)
+        self.sidecar_path = os.path.join(directory, '.' + file_name + self.SUFFIX)
+        path_hash = hashlib.sha1(self.file_path.encode('utf-8')).hexdigest()
+        self.fallback_path = os.path.join(self.CACHE_DIR, path_hash + self.SUFFIX)
+
+    def _file_key(self) -> dict:
+        stat = os.stat(self.file_path)
+        dependencies = []
+        for path in self.dependency_paths:
+            dependency_stat = os.stat(path)
+            dependencies.append(f"{path}|{dependency_stat.st_size}|{dependency_stat.st_mtime_ns}")
+        return {'_path': self.file_path, '_size': stat.st_size, '_mtime_ns': stat.st_mtime_ns,
+                '_dependencies': ';'.join(dependencies)}
+
+    def load(self):
+        """ 保存された集計結果を読み込む
+
+        :return: 集計結果のdict。保存されていない・元ファイルが変わっている場合はNone
+        """
+        try:
+            key = self._file_key()
+        except OSError:
+            return None
+        for path in (self.sidecar_path, self.fallback_path):
+            if not os.path.exists(path):
+                continue
+            try:
+                with np.load(path, allow_pickle=False) as npz:
+                    saved = {name: npz[name] for name in npz.files}
+            except (OSError, ValueError) as e:
+                logger.warning(f'集計結果を読み込めませんでした: {path}, {e}')
+                continue
+            if saved.get('_version') is None or int(saved['_version']) != self.VERSION:
+                continue
+            if str(saved['_path']) != key['_path'] or int(saved['_size']) != key['_size'] \
+                    or int(saved['_mtime_ns']) != key['_mtime_ns'] \
+                    or str(saved.get('_dependencies', '')) != key['_dependencies']:
+                continue
+            logger.debug(f'保存された集計結果を使います: {path}')
+            # 0次元の配列はスカラーに戻す
+            return {name: (value.item() if value.ndim == 0 else value)
+                    for name, value in saved.items() if not name.startswith('_')}
+        return None
+
+    def save(self, statistics: dict):
+        """ 集計結果を保存する。どこにも書き込めなければ警告だけ出す
+
+        :param statistics: 値がndarrayかスカラーのdict
+        :return:
+        """
+        try:
+            key = self._file_key()
+        except OSError as e:
+            logger.warning(f'元ファイルが見つからないので集計結果を保存しません: {self.file_path}, {e}')
+            return
+        contents = {**statistics, **key, '_version': self.VERSION}
+        for path in (self.sidecar_path, self.fallback_path):
+            tmp_path = path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, **contents)
+                os.replace(tmp_path, path) # 書きかけのファイルを残さない
+                logger.debug(f'集計結果を保存しました: {path}')
+                return
+            except OSError as e:
+                logger.warning(f'集計結果を保存できませんでした: {path}, {e}')
+
+    def invalidate(self):
+        """ 保存された集計結果を削除する。ファイルをその場で書き換えたときに使う(更新時刻の精度が粗いファイルシステムでも確実に集計し直す) """
+        for path in (self.sidecar_path, self.fallback_path):
+            try:
+                os.remove(path)
+                logger.debug(f'集計結果を削除しました: {path}')
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f'集計結果を削除できませんでした: {path}, {e}')
@@ -1,8 +1,208 @@
 import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from enum import Enum
+
 import h5py
 import numpy as np
 import pandas as pd
 
+from log_util import logger
+
+
+class HDFHandlePool:
+    """
+    読み込み専用のh5py.Fileをファイルごとに1つだけ開いておき、使い回す
+    開く・閉じるたびにメタデータのキャッシュやchunkキャッシュが捨てられるのを防ぐ
+
+    使い方:
+        with hdf_handle_pool.checkout(file_path) as f:
+            data = f[data_path][frame]
+    """
+    DEFAULT_RDCC_NBYTES = 64 * 1024 ** 2 # chunkキャッシュの大きさ (h5pyの既定は1MB)
+
+    def __init__(self, rdcc_nbytes: int = DEFAULT_RDCC_NBYTES):
+        self.rdcc_nbytes = rdcc_nbytes
+        self._handles = {} # 絶対パス -> {'file': h5py.File, 'mtime_ns': int, 'refcount': int}
+        self._lock = threading.Lock()
+
+    def _open(self, file_path):
+        return {
+            'file': h5py.File(file_path, 'r', rdcc_nbytes=self.rdcc_nbytes),
+            'mtime_ns': os.stat(file_path).st_mtime_ns,
+            'refcount': 0,
+        }
+
+    @contextmanager
+    def checkout(self, file_path: str):
+        """ 開いてあるhandleを貸し出す。ファイルが更新されていて、誰も使っていなければ開き直す
+
+        h5pyはライブラリ内でロックを取るので、複数スレッドから同じhandleを使ってよい
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            entry = self._handles.get(file_path)
+            if entry is not None and entry['refcount'] == 0 \
+                    and os.stat(file_path).st_mtime_ns != entry['mtime_ns']:
+                entry['file'].close()
+                entry = None
+            if entry is None:
+                entry = self._open(file_path)
+                self._handles[file_path] = entry
+            entry['refcount'] += 1
+        try:
+            yield entry['file']
+        finally:
+            with self._lock:
+                entry['refcount'] -= 1
+
+    def close(self, file_path: str = None):
+        """ handleを閉じる。Noneなら全て閉じる。書き込む前には必ず閉じる(同じファイルを'r'と'a'で同時に開けないため)
+
+        :exception RuntimeError: 貸し出し中のhandleを閉じようとした場合
+        """
+        with self._lock:
+            if file_path is None:
+                file_paths = list(self._handles)
+            else:
+                file_paths = [os.path.abspath(file_path)]
+            for path in file_paths:
+                entry = self._handles.get(path)
+                if entry is None:
+                    continue
+                if entry['refcount'] > 0:
+                    raise RuntimeError(f"読み込み中のため閉じられません: {path}")
+                entry['file'].close()
+                del self._handles[path]
+
+    def set_rdcc_nbytes(self, rdcc_nbytes: int):
+        """ chunkキャッシュの大きさを変える。次に開いたhandleから反映される """
+        self.rdcc_nbytes = rdcc_nbytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# アプリ全体で共有するhandleのプール
+hdf_handle_pool = HDFHandlePool()
+
+
+HYBRID_CHUNK_BYTES = 1024 ** 2 # HDF5で推奨されるchunkの大きさ(数百KB〜1MB)に合わせる
+
+
+class ChunkLayout(Enum):
+    """
+    (frame, position, wavelength)の3次元データセットをどう区切って保存するか
+    FRAME_MAJOR: 1frameずつ。frame単位で読む場合(画像の表示、全体の走査)に速い
+    SPECTRUM_MAJOR: 1スペクトル((frame, position)の組)ずつ。1本ずつフィッティングする場合に速い
+    HYBRID: 1frameのうち、およそHYBRID_CHUNK_BYTESになるpositionの幅ずつ。frameが小さければ複数frameをまとめる
+    CONTIGUOUS: 区切らない(h5pyの既定)。圧縮はできない
+    """
+    FRAME_MAJOR = "frame_major"
+    SPECTRUM_MAJOR = "spectrum_major"
+    HYBRID = "hybrid"
+    CONTIGUOUS = "contiguous"
+
+    @classmethod
+    def from_str(cls, layout_str):
+        try:
+            return cls(layout_str.lower())
+        except ValueError:
+            raise ValueError(f"chunkの配置が不正です: {layout_str}\n以下で指定してください: {', '.join(o.value for o in cls)}")
+
+    def get_chunks(self, shape: tuple, itemsize: int):
+        """
+        shape=(frame, position, wavelength)のデータセットのchunkの形を返す。CONTIGUOUSならNone
+        """
+        frame_num, position_pixel_num, wavelength_pixel_num = (int(n) for n in shape) # np.uint64が混ざるとfloatになるため
+        match self:
+            case ChunkLayout.FRAME_MAJOR:
+                return 1, position_pixel_num, wavelength_pixel_num
+            case ChunkLayout.SPECTRUM_MAJOR:
+                return 1, 1, wavelength_pixel_num
+            case ChunkLayout.HYBRID:
+                chunk_bytes = HYBRID_CHUNK_BYTES
+                spectrum_bytes = wavelength_pixel_num * itemsize
+                frame_bytes = position_pixel_num * spectrum_bytes
+                if frame_bytes <= chunk_bytes:
+                    return max(1, min(frame_num, chunk_bytes // frame_bytes)), position_pixel_num, wavelength_pixel_num
+                return 1, max(1, chunk_bytes // spectrum_bytes), wavelength_pixel_num
+            case ChunkLayout.CONTIGUOUS:
+                return None
+
+
+class HDFPathIndex:
+    """
+    ファイル内の全データセットパスを1回だけ調べておき、検索を辞書引きで済ませる
+    ファイルごとに(更新時刻, サイズ)をキーにして保持し、ファイルが書き換わったら作り直す
+    保持するのは最近使ったMAX_FILE_NUMファイル分だけ(LRU)。書き換えたことが分かっている場合は invalidate で捨てる
+    """
+    MAX_FILE_NUM = 64
+    _indices = OrderedDict() # 絶対パス -> HDFPathIndex。末尾ほど最近使われたもの
+    _lock = threading.Lock()
+
+    def __init__(self, paths: list, file_key: tuple):
+        self.paths = paths
+        self.file_key = file_key
+        self._exact = set(paths)
+        # 'entry/calibrated_spectra' なら 'calibrated_spectra' と 'entry/calibrated_spectra' の両方で引けるようにする
+        self._suffix = {}
+        for path in paths:
+            parts = path.split('/')
+            for i in range(len(parts)):
+                self._suffix.setdefault('/'.join(parts[i:]), []).append(path)
+
+    @staticmethod
+    def _file_key(file_path: str) -> tuple:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def for_file(cls, file_path: str):
+        """ ファイルのindexを返す。初めてのファイルか、前回から書き換わっていれば作り直す """
+        file_path = os.path.abspath(file_path)
+        file_key = cls._file_key(file_path)
+        with cls._lock:
+            index = cls._indices.get(file_path)
+            if index is None or index.file_key != file_key:
+                paths = []
+                def collect_datasets(name, obj):
+                    if isinstance(obj, h5py.Dataset):
+                        paths.append(name)
+                with hdf_handle_pool.checkout(file_path) as f:
+                    f.visititems(collect_datasets)
+                index = cls(paths, file_key)
+                cls._indices[file_path] = index
+                logger.debug(f"データセットパスのindexを作成しました: {file_path} ({len(paths)} 個)")
+            cls._indices.move_to_end(file_path)
+            while len(cls._indices) > cls.MAX_FILE_NUM:
+                cls._indices.popitem(last=False)
+            return index
+
+    @classmethod
+    def invalidate(cls, file_path: str):
+        """ 書き換えたファイルのindexを捨てる """
+        with cls._lock:
+            cls._indices.pop(os.path.abspath(file_path), None)
+
+    def lookup(self, query: str) -> list:
+        """
+        queryに一致するパスのリストを返す
+        完全一致 -> 末尾一致(/区切り) の順に辞書で引き、どちらもなければ従来通り部分一致で探す
+        """
+        query = query.strip('/')
+        if query in self._exact:
+            return [query]
+        if query in self._suffix:
+            return list(self._suffix[query])
+        return [path for path in self.paths if query in path]
+
+
 class HDF5():
     SUPPORTED_FILE_TYPES = ['.hdf5', '.hdf', '.h5', '.nxs'] # 有効な拡張子を示すクラス変数
 
@@ -11,8 +211,7 @@ class HDF5():
             self.file_path = file_path
             # ファイルが存在すれば、ファイル内のpath構造を設定する。
             if os.path.exists(file_path):
-                with h5py.File(self.file_path, 'r') as f:
-                    self.path_list = self._get_all_dataset_paths(f)
+                self.path_list = HDFPathIndex.for_file(self.file_path).paths
             else:
                 print('ファイルが見つかりません。: ' + self.file_path)
         else:
@@ -38,11 +237,15 @@ class HDF5Writer(HDF5):
             print(f"HDF5ファイルが見つかりました: {self.file_path}")
 
     def _create_file(self):
+        hdf_handle_pool.close(self.file_path)
+        HDFPathIndex.invalidate(self.file_path)
         with h5py.File(self.file_path, 'w') as f:
             f.create_group('entry')
         print(f"HDF5ファイルが作成されました: {self.file_path}")
 
     def write(self, *, data_path, data, compression=None, overwrite=False):
+        hdf_handle_pool.close(self.file_path) # 読み込み用に開いたままのhandleがあると書き込めない
+        HDFPathIndex.invalidate(self.file_path)
         if overwrite:
             self._delete_if_exists(data_path)
         else:
@@ -50,7 +253,7 @@ class HDF5Writer(HDF5):
                 print(f"{data_path}にはすでにデータが存在します。上書きしたい場合は overwrite オプションをTrueにしてください。")
                 return
 
-        self._write_data(data_path, data, compression)
+        self._write_data(self.file_path, data_path, data, compression)
         print(f"書き込みに成功しました: '{data_path}' in {self.file_path}")
 
     def _delete_if_exists(self, data_path):
@@ -62,21 +265,50 @@ class HDF5Writer(HDF5):
         with h5py.File(self.file_path, 'r') as f:
             return data_path in f
 
-    def _write_data(self, data_path, data, compression):
+    @staticmethod
+    def _write_data(file_path, data_path, data, compression=None, chunks=None, h5_file=None):
+        """
+        file_path: 書き込み先のファイル
+        h5_file: file_pathを開いているh5pyのhandle。渡せば開き直さずにそれに書き込む
+            pandasはh5pyと同時に開けないので、DataFrameのときは渡さないこと
+        """
         # 単一のnumpyのデータの扱いがめんどくさいので、一括で浮動小数点に変換する。
         if isinstance(data, (np.integer, np.floating)):
             data = float(data)
         if isinstance(data, (int, float, str, np.ndarray)):
-            with h5py.File(self.file_path, 'a') as f:
-                f.create_dataset(data_path, data=data, compression=compression)
+            # スカラーはchunkも圧縮もできない
+            options = {'chunks': chunks, 'compression': compression} if isinstance(data, np.ndarray) else {}
+            if h5_file is not None:
+                h5_file.create_dataset(data_path, data=data, **options)
+            else:
+                with h5py.File(file_path, 'a') as f:
+                    f.create_dataset(data_path, data=data, **options)
         elif isinstance(data, pd.DataFrame):
-            data.to_hdf(self.file_path, key=data_path, mode='a')
+            if h5_file is not None:
+                raise RuntimeError("DataFrameはh5pyのhandleを閉じてから書き込んでください。")
+            data.to_hdf(file_path, key=data_path, mode='a')
         else:
             raise TypeError(
                 f"データの種類: {type(data)} は書き込めません。\n可能なもの: int, float, str, numpyの整数・小数系, np.ndarray, pd.DataFrame"
             )
 
+    def batch(self, dataset_options: dict = None):
+        """
+        1つのhandleで複数のデータセットをまとめて書き込むセッションを返す
+        使い方:
+            with HDF5Writer(path).batch() as w:
+                w.write(data_path='entry/value/T', data=T, overwrite=True)
+                ...
+        dataset_options: {data_path: {'chunks': ..., 'compression': ...}} の形で、データセットごとの既定の書き込み方法
+        途中で失敗したときに元のファイルを残せるよう、ファイルを一時ファイルにコピーしてから書き込むので、
+        ファイル全体のコピー時間と2倍の容量がかかる。HDF5WriteBatch.COPY_ON_WRITE_MAX_BYTESより大きいファイルは
+        コピーせず直接書き込む(失敗すると途中まで書き込まれた状態になる)
+        """
+        return HDF5WriteBatch(self.file_path, dataset_options)
+
     def delete(self, data_path):
+        hdf_handle_pool.close(self.file_path)
+        HDFPathIndex.invalidate(self.file_path)
         with h5py.File(self.file_path, 'a') as f:
             if data_path in f:
                 del f[data_path]
@@ -84,62 +316,176 @@ class HDF5Writer(HDF5):
             else:
                 raise KeyError(f"{data_path} が見つかりません。")
 
+class HDF5WriteBatch:
+    """
+    HDF5Writer.batchで作る書き込みセッション
+    COPY_ON_WRITE_MAX_BYTES以下のファイルは一時ファイルにコピーして書き込み、withを正常に抜けたときだけ元のファイルと置き換える
+    途中で例外が起きた場合は元のファイルをそのまま残す(書きかけの結果ファイルを作らない)
+    それより大きいファイルは、コピーに時間と2倍の容量がかかるので、元のファイルに1つのhandleで直接書き込む
+    この場合、例外が起きる前に書き込んだデータセットはそのまま残る
+    """
+    TMP_SUFFIX = '.tmp'
+    COPY_ON_WRITE_MAX_BYTES = 256 * 1024**2 # 校正済みのスペクトルを含むような大きいファイルはコピーしない
+
+    def __init__(self, file_path: str, dataset_options: dict = None):
+        self.file_path = file_path
+        self.tmp_path = file_path + self.TMP_SUFFIX
+        self.dataset_options = dataset_options or {}
+        self.in_place = False # Trueなら一時ファイルを使わず元のファイルに書き込む
+        self._file = None
+        self._dataframes = [] # pandasはh5pyと同時に開けないので、h5pyのhandleを閉じてから書く
+
+    @property
+    def target_path(self) -> str:
+        return self.file_path if self.in_place else self.tmp_path
+
+    def __enter__(self):
+        hdf_handle_pool.close(self.file_path) # 読み込み用に開いたままのhandleがあると書き込めない
+        if not os.path.exists(self.file_path):
+            self._file = h5py.File(self.tmp_path, 'w')
+            self._file.create_group('entry')
+        elif os.path.getsize(self.file_path) > self.COPY_ON_WRITE_MAX_BYTES:
+            self.in_place = True
+            self._file = h5py.File(self.file_path, 'a')
+        else:
+            shutil.copyfile(self.file_path, self.tmp_path) # 既存のデータセットは残す
+            self._file = h5py.File(self.tmp_path, 'a')
+        return self
+
+    def write(self, *, data_path, data, chunks=None, compression=None, overwrite=False):
+        """
+        data_path: 書き込み先
+        chunks, compression: 指定しなければdataset_optionsの設定を使う
+        overwrite: Falseですでにデータがある場合は書き込まない
+        """
+        if self._file is None:
+            raise RuntimeError("withの中で書き込んでください。")
+        if data_path in self._file:
+            if not overwrite:
+                print(f"{data_path}にはすでにデータが存在します。上書きしたい場合は overwrite オプションをTrueにしてください。")
+                return
+            del self._file[data_path]
+
+        if isinstance(data, pd.DataFrame):
+            self._dataframes.append((data_path, data)) # withを抜けてh5pyのhandleを閉じてから書く
+            return
+        options = self.dataset_options.get(data_path, {})
+        if chunks is None:
+            chunks = options.get('chunks')
+        if compression is None:
+            compression = options.get('compression')
+        HDF5Writer._write_data(self.target_path, data_path, data, compression=compression, chunks=chunks, h5_file=self._file)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            try:
+                self._file.flush()
+            finally:
+                self._file.close()
+                self._file = None
+            if exc_type is None:
+                for data_path, data in self._dataframes:
+                    HDF5Writer._write_data(self.target_path, data_path, data)
+                if not self.in_place:
+                    os.replace(self.tmp_path, self.file_path)
+                HDFPathIndex.invalidate(self.file_path)
+                print(f"まとめて書き込みました: {self.file_path}")
+                return False
+        except BaseException:
+            self._discard()
+            raise
+        self._discard()
+        return False
+
+    def _discard(self):
+        if self.in_place:
+            # 直接書き込んだ分は戻せない。データセットの一覧が変わっているかもしれないので索引は捨てる
+            HDFPathIndex.invalidate(self.file_path)
+            print(f"書き込みを中止しました。{self.file_path} には途中までのデータが書き込まれています。")
+            return
+        # 一時ファイルを消して、元のファイルはそのまま残す
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        print(f"書き込みを中止しました。{self.file_path} は変更していません。")
+
+
 class HDF5Reader(HDF5):
     def __init__(self, file_path):
         super().__init__(file_path)
         print(f"HDF5ファイルが見つかりました: {self.file_path}")
 
     def find_by(self, query, shape: list = None):
-        with h5py.File(self.file_path, 'r') as f_read:
-            self.path_list = self._get_all_dataset_paths(f_read)  # 最新のデータパスリストを取得する
-            to_data = self.search_data_path(query=query)
+        to_data = self.search_data_path(query=query)
 
-            if type(to_data) is str:
-                return self.return_data(data_path=to_data, shape=shape)
-            elif type(to_data) is list:
-                raise Exception("複数のlayer pathが見つかりました。一括で返して欲しい場合は実装してください。")
-            else:
-                raise Exception("layer pathが見つかりませんでした。")
+        if type(to_data) is str:
+            return self.return_data(data_path=to_data, shape=shape)
+        elif type(to_data) is list:
+            raise Exception("複数のlayer pathが見つかりました。一括で返して欲しい場合は実装してください。")
+        else:
+            raise Exception("layer pathが見つかりませんでした。")
 
-    def search_data_path(self, query: str):
-        result_list = []
+    def find_many(self, queries: list, shape: list = None) -> dict:
+        """
+        複数のqueryのデータを、ファイルを1回開くだけでまとめて返す
+        queries: find_byと同じquery文字列のリスト
+        shape: 全てのデータに共通のスライス指定
+        return: {query: データ}
+        """
+        data_paths = {}
+        for query in queries:
+            to_data = self.search_data_path(query=query)
+            if type(to_data) is list:
+                raise Exception(f"「{query}」で複数のlayer pathが見つかりました: {to_data}")
+            elif to_data is None:
+                raise Exception(f"「{query}」でlayer pathが見つかりませんでした。")
+            data_paths[query] = to_data
+        with hdf_handle_pool.checkout(self.file_path) as f:
+            return {query: self._read_dataset(f, data_path, shape) for query, data_path in data_paths.items()}
 
-        print(f"「{query}」で検索します。")
-        for path in self.path_list:
-            if query in path:
-                if path.startswith('/'): # 最初のスラッシュを削除する
-                    path = path[1:]
-                result_list.append(path)
+    def search_data_path(self, query: str):
+        index = HDFPathIndex.for_file(self.file_path) # ファイルが書き換わっていれば作り直される
+        self.path_list = index.paths
+        result_list = index.lookup(query)
 
         if len(result_list) >= 2: # 2個以上見つかった場合
-            print(f"\t-> {len(result_list)} 個のpathが見つかりました。リストで返しました。\n")
-            for i, path in enumerate(result_list):
-                print(f"{i: >2}: {path}")
+            logger.debug(f"「{query}」で {len(result_list)} 個のpathが見つかりました。リストで返しました: {result_list}")
             return result_list
         elif len(result_list) == 1: # 1個だけに絞られた場合
             result = result_list[0]
-            print(f"\t-> {result} を返しました。")
+            logger.debug(f"「{query}」で {result} を返しました。")
             return result
         else: # 0個の場合
-            print(f"\t-> 「{query}」を含むpathは見つかりませんでした。")
+            logger.debug(f"「{query}」を含むpathは見つかりませんでした。")
             return None
 
+    def get_attrs(self, data_path: str = '/') -> dict:
+        """
+        ファイル(またはdata_pathのグループ・データセット)の属性をdictで返す。文字列はstrにする
+        """
+        with hdf_handle_pool.checkout(self.file_path) as f:
+            attrs = dict(f[data_path].attrs)
+        return {key: (value.decode('utf-8') if isinstance(value, bytes) else value) for key, value in attrs.items()}
+
     def return_data(self, data_path: str, shape: list = None):
-        with h5py.File(self.file_path, 'r') as f:
-            dataset = f[data_path]
-            if dataset.shape == ():  # スカラー(単一値)の場合
-                value = dataset[()]  # スカラーの場合の読み取り
-                try:
-                    # 文字列への変換を試みる
-                    value = value.decode('utf-8')
-                except:
-                    # できなかったら処理をそのまま流す
-                    pass
-            else:
-                if shape is None:  # スライス指定がない場合
-                    value = f.get(data_path)[:]
-                else:  # スライス指定がある場合
-                    value = f.get(data_path)[tuple(shape)]  # 部分的に返す
+        with hdf_handle_pool.checkout(self.file_path) as f:
+            return self._read_dataset(f, data_path, shape)
+
+    @staticmethod
+    def _read_dataset(f, data_path: str, shape: list = None):
+        dataset = f[data_path]
+        if dataset.shape == ():  # スカラー(単一値)の場合
+            value = dataset[()]  # スカラーの場合の読み取り
+            try:
+                # 文字列への変換を試みる
+                value = value.decode('utf-8')
+            except:
+                # できなかったら処理をそのまま流す
+                pass
+        else:
+            if shape is None:  # スライス指定がない場合
+                value = dataset[:]
+            else:  # スライス指定がある場合
+                value = dataset[tuple(shape)]  # 部分的に返す
         return value
 
     def print_contents(self, preview_elements=2):
@@ -184,6 +530,9 @@ class HDFDataFetcher:
         self.file_path = file_path
         self.data_path = data_path
         self.dataset_shape = None
+        self.dataset_dtype = None
+        self.chunks = None # Noneならcontiguous
+        self.chunk_layout = None # 書き込み時に記録されたChunkLayout。記録がなければchunksから推定する
         self.path_list = self._get_all_dataset_paths()
 
         if data_path:
@@ -191,19 +540,20 @@ class HDFDataFetcher:
 
     def _get_all_dataset_paths(self):
         """ファイル内の全データセットパスを取得"""
-        with h5py.File(self.file_path, 'r') as f:
-            dataset_paths = []
-            def collect_datasets(name, obj):
-                if isinstance(obj, h5py.Dataset):
-                    dataset_paths.append(name)
-            f.visititems(collect_datasets)
-        return dataset_paths
+        return HDFPathIndex.for_file(self.file_path).paths
 
     def _initialize_dataset_shape(self):
         """指定されたdata_pathのデータセットの形状を初期化"""
-        with h5py.File(self.file_path, 'r') as f:
+        with hdf_handle_pool.checkout(self.file_path) as f:
             if self.data_path in f:
-                self.dataset_shape = f[self.data_path].shape
+                dataset = f[self.data_path]
+                self.dataset_shape = dataset.shape
+                self.dataset_dtype = dataset.dtype
+                self.chunks = dataset.chunks
+                if 'chunk_layout' in dataset.attrs:
+                    self.chunk_layout = ChunkLayout.from_str(str(dataset.attrs['chunk_layout']))
+                elif self.chunks is None:
+                    self.chunk_layout = ChunkLayout.CONTIGUOUS
             else:
                 raise KeyError(f"指定されたデータパス '{self.data_path}' が見つかりません。")
 
@@ -219,25 +569,78 @@ class HDFDataFetcher:
             raise IndexError(f"指定されたframe {frame} は範囲外です (最大: {self.dataset_shape[0] - 1})。")
 
         # 指定されたframeのデータを取得
-        with h5py.File(self.file_path, 'r') as f:
+        with hdf_handle_pool.checkout(self.file_path) as f:
             dataset = f[self.data_path]
             return dataset[frame]  # frameの部分だけを返す
 
+    def fetch_by_frame_range(self, start: int, stop: int):
+        """
+        連続したframe [start, stop) のデータを1回の読み込みで取得する
+        start: 最初のframe
+        stop: 最後のframeの次
+        """
+        if self.dataset_shape is None:
+            raise RuntimeError("データセットのshapeが初期化されていません。")
+
+        if start < 0 or stop > self.dataset_shape[0] or start > stop:
+            raise IndexError(f"指定されたframe範囲 [{start}, {stop}) は範囲外です (最大: {self.dataset_shape[0] - 1})。")
+
+        with hdf_handle_pool.checkout(self.file_path) as f:
+            dataset = f[self.data_path]
+            return dataset[start:stop]  # 連続したhyperslabとして読む
+
+    def fetch_spectra(self, frames, positions, wavelength_slice: slice = slice(None)):
+        """
+        (frame, position)の組ごとのスペクトルを、wavelength_sliceの列だけ読み込む
+        h5pyの点リストでの選択は1軸だけなので、frameごとにまとめて1回のhyperslabとして読む
+        frames, positions: 同じ長さの整数配列
+        return: shape=(組の数, 範囲内の波長数)
+        """
+        if self.dataset_shape is None:
+            raise RuntimeError("データセットのshapeが初期化されていません。")
+        frames = np.asarray(frames, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        column_num = len(range(*wavelength_slice.indices(self.dataset_shape[2])))
+        spectra = np.empty((len(frames), column_num), dtype=self.dataset_dtype)
+        order = np.argsort(frames, kind='stable')
+        unique_frames, group_starts = np.unique(frames[order], return_index=True)
+        group_stops = np.append(group_starts[1:], len(order))
+        with hdf_handle_pool.checkout(self.file_path) as f:
+            dataset = f[self.data_path]
+            for frame, group_start, group_stop in zip(unique_frames, group_starts, group_stops):
+                indices = order[group_start:group_stop]
+                # h5pyの点リストは昇順で重複なしでなければならない
+                unique_positions, inverse = np.unique(positions[indices], return_inverse=True)
+                block = dataset[int(frame), unique_positions, wavelength_slice]
+                spectra[indices] = block[inverse]
+        return spectra
+
     def get_shape(self):
         """データセットの形状を返す"""
         return self.dataset_shape
 
+    def close(self):
+        """プールで開いたままのhandleを閉じる。他で読み込み中なら何もしない"""
+        try:
+            hdf_handle_pool.close(self.file_path)
+        except RuntimeError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def search_data_path(self, query: str):
         """queryに基づいてデータパスを検索し、1つに絞られた場合のみ返す"""
-        result_list = []
-        print(f"「{query}」で検索します。")
-        for path in self.path_list:
-            if query in path:
-                result_list.append(path)
+        index = HDFPathIndex.for_file(self.file_path)
+        self.path_list = index.paths
+        result_list = index.lookup(query)
 
         if len(result_list) == 1:
             result = result_list[0]
-            print(f"\t-> {result} を返しました。")
+            logger.debug(f"「{query}」で {result} を返しました。")
             return result
         elif len(result_list) > 1:
             raise Exception(f"複数のデータパスが見つかりました: {result_list}")
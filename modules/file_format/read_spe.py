@@ -27,6 +27,7 @@ Example usage of SpeReference class:
 
 import xml.etree.ElementTree as ET
 import xml.dom.minidom as md
+import io
 from collections.abc import Sequence
 from pathlib import Path, PurePath
 from typing import TypeAlias, NewType, Optional, cast
@@ -294,6 +295,8 @@ class SpeReference():
     - create reference to data with construction of class:
 
     `img_reference = SpeReference(spe_file)`
+    ----- pass `header_only=True` to parse only the data geometry up front;
+    calibrations and metadata formats are then parsed on first use
     - to pull data, call get_data:
 
     `image = img_reference.get_data(frames=[idx], rois=[])[0][0]`
@@ -335,24 +338,32 @@ class SpeReference():
     _full_wavelength_coverage: WavelengthNdArray
     _sensor_dims: _ROI
     _meta_list: list[Metadata]
-    _frame_metadata_values: Sequence[Sequence[MetaType]]
+    _frame_metadata_values: Optional[Sequence[Sequence[MetaType]]]
     _xml_footer: str
+    _xml_root: Optional[ET.Element]
 
-    def __init__(self, filepath: str):
+    def __init__(self, filepath: str, *, header_only: bool = False):
         self._filepath = filepath
         (self._file_directory, self._file_name, self._file_extension) \
             = SpeReference._split_file_path(self._filepath)
         if self._file_extension.casefold() != '.spe':
             raise ValueError('Input filepath does not have a .spe extension.')
+        self._header_only = header_only
         self._roi_list = []
         self._full_wavelength_coverage = np.array([])
         self._meta_list = []
-        self._frame_metadata_values = []
+        self._frame_metadata_values = None
+        self._xml_root = None
+        self._footer_parsed = False
         self._initialize_spe()
 
     def _initialize_spe(self):
         """Fills in members with info from spe file (if that info exists).
         Should always be called internally.
+
+        With `header_only`, only the DataBlock geometry is parsed here; the
+        metadata format and calibrations are parsed on first use from the
+        cached xml tree (see `_ensure_footer_parsed`).
         """
         with open(self._filepath, encoding="utf8") as f:
             f.seek(678)
@@ -361,91 +372,21 @@ class SpeReference():
             self._spe_version = np.fromfile(f, dtype=np.float32, count=1)[0]
 
             # get ROIs and shapes
-            # pylint: disable=line-too-long
             if self._spe_version == 3:
                 f.seek(self.xml_loc)
                 self._xml_footer = f.read()
-                xml_root = ET.fromstring(self._xml_footer)
-                for child in xml_root:
-                    if 'DataFormat'.casefold() in child.tag.casefold():
-                        for child1 in child:
-                            if 'DataBlock'.casefold() in child1.tag.casefold():
-                                self._readout_stride = np.uint64(child1.get('stride'))  # type: ignore
-                                self._frame_stride = np.uint64(child1.get('size'))  # type: ignore
-                                self._num_frames = np.uint64(child1.get('count'))  # type: ignore
-                                self._pixel_format_key = child1.get('pixelFormat')  # type: ignore
-                                for child2 in child1:
-                                    if 'DataBlock'.casefold() in child1.tag.casefold():
-                                        reg_stride = np.int64(child2.get('stride'))  # type: ignore
-                                        reg_width = np.int64(child2.get('width'))  # type: ignore
-                                        reg_height = np.int64(child2.get('height'))  # type: ignore
-                                        self._roi_list.append(_ROI(reg_width, reg_height, reg_stride))
-                    if 'MetaFormat'.casefold() in child.tag.casefold():
-                        for child1 in child:
-                            if 'MetaBlock'.casefold() in child1.tag.casefold():
-                                for child2 in child1:
-                                    meta_type: str = child2.tag.rsplit('}', maxsplit=1)[1]
-                                    meta_event: str = child2.get('event')  # type: ignore
-                                    meta_datatype: str = child2.get('type')  # type: ignore
-                                    meta_bitdepth = np.uint64(child2.get('bitDepth'))  # type: ignore
-                                    match meta_type:
-                                        case 'TimeStamp':
-                                            meta_resolution = np.uint64(child2.get('resolution'))  # type: ignore
-                                            meta_absolute_time: str = child2.get('absoluteTime')  # type: ignore
-                                            self._meta_list.append(
-                                                TimeStamp(meta_event, meta_datatype, meta_bitdepth, meta_resolution,
-                                                          meta_absolute_time))
-                                        case 'FrameTrackingNumber':
-                                            self._meta_list.append(FrameTrackingNumber(meta_datatype, meta_bitdepth))
-                                        case 'GateTracking':
-                                            meta_event: str = child2.get('component')  # type: ignore
-                                            meta_monotonic = bool(child2.get('monotonic'))
-                                            self._meta_list.append(
-                                                GateTracking(meta_event, meta_datatype, meta_bitdepth, meta_monotonic))
-                                        case _:
-                                            raise RuntimeError('Metadata block was not recognized.')
-
-                    if 'Calibrations'.casefold() in child.tag.casefold():
-                        counter = 0
-                        for child1 in child:
-                            if 'WavelengthMapping'.casefold() in child1.tag.casefold():
-                                for child2 in child1:
-                                    if 'WavelengthError'.casefold() in child2.tag.casefold():
-                                        wavelengths = np.array([])
-                                        assert child2.text
-                                        wl_text = child2.text.rsplit()
-                                        for elem in wl_text:
-                                            wavelengths = np.append(wavelengths, np.fromstring(elem, sep=',')[0])
-                                        self._full_wavelength_coverage = wavelengths
-                                    else:
-                                        self._full_wavelength_coverage = np.fromstring(child2.text,
-                                                                                       sep=',')  # type: ignore
-                            if 'SensorInformation'.casefold() in child1.tag.casefold():
-                                width = np.int32(child1.get('width'))  # type: ignore
-                                height = np.uint32(child1.get('height'))  # type: ignore
-                                self._sensor_dims = _ROI(width, height, 0)
-                            if 'SensorMapping'.casefold() in child1.tag.casefold():
-                                if counter < len(self._roi_list):
-                                    self._roi_list[counter].x = np.uint64(child1.get('x'))  # type: ignore
-                                    self._roi_list[counter].y = np.uint64(child1.get('y'))  # type: ignore
-                                    og_width = np.uint64(child1.get('width'))  # type: ignore
-                                    og_height = np.uint64(child1.get('height'))  # type: ignore
-                                    self._roi_list[counter].xbin = np.uint64(child1.get('xBinning'))  # type: ignore
-                                    self._roi_list[counter].ybin = np.uint64(child1.get('yBinning'))  # type: ignore
-                                    self._roi_list[counter].width = np.uint64(
-                                        og_width / self._roi_list[counter].xbin)  # type: ignore
-                                    self._roi_list[counter].height = np.uint64(
-                                        og_height / self._roi_list[counter].ybin)  # type: ignore
-                                    counter += 1
-                                else:
-                                    break
-                # now that xml parsing is done, extract all the metadata (if present)
-                if len(self._meta_list) > 0:
-                    self._frame_metadata_values = self.get_frame_metadata_value(
-                        frames=range(0, self._num_frames))
+                data_format = self._find_data_format() \
+                    if self._header_only else None
+                if data_format is not None:
+                    self._parse_data_format(data_format)
+                else:
+                    self._parse_footer()
+                # per-frame metadata values are extracted lazily, see
+                # `frame_metadata_values`
 
             elif self._spe_version >= 2 and self._spe_version < 3:
                 self._xml_footer = ''
+                self._footer_parsed = True
                 f.seek(108)
                 self._pixel_format_key = np.fromfile(f, dtype=np.int16, count=1)[0]
                 f.seek(42)
@@ -460,8 +401,118 @@ class SpeReference():
             else:
                 raise ValueError('Unrecognized spe file.')
 
+    def _find_data_format(self) -> Optional[ET.Element]:
+        """Incrementally parses the xml footer only up to the end of the
+        DataFormat element, which comes first in the footer. Returns None if
+        it could not be found.
+        """
+        try:
+            for _, element in ET.iterparse(io.StringIO(self._xml_footer),
+                                           events=('end',)):
+                if element.tag.casefold().endswith('DataFormat'.casefold()):
+                    return element
+        except ET.ParseError:
+            return None
+        return None
+
+    def _parse_footer(self):
+        """Parses DataFormat (if not done yet), MetaFormat and Calibrations
+        from the cached xml tree.
+        """
+        for child in self.xml_root:
+            if 'DataFormat'.casefold() in child.tag.casefold():
+                if len(self._roi_list) == 0:
+                    self._parse_data_format(child)
+            if 'MetaFormat'.casefold() in child.tag.casefold():
+                self._parse_meta_format(child)
+            if 'Calibrations'.casefold() in child.tag.casefold():
+                self._parse_calibrations(child)
+        self._footer_parsed = True
+
+    def _ensure_footer_parsed(self):
+        """Completes a header-only open on first use of footer information."""
+        if not self._footer_parsed:
+            self._parse_footer()
+
+    # pylint: disable=line-too-long
+    def _parse_data_format(self, child: ET.Element):
+        for child1 in child:
+            if 'DataBlock'.casefold() in child1.tag.casefold():
+                self._readout_stride = np.uint64(child1.get('stride'))  # type: ignore
+                self._frame_stride = np.uint64(child1.get('size'))  # type: ignore
+                self._num_frames = np.uint64(child1.get('count'))  # type: ignore
+                self._pixel_format_key = child1.get('pixelFormat')  # type: ignore
+                for child2 in child1:
+                    if 'DataBlock'.casefold() in child1.tag.casefold():
+                        reg_stride = np.int64(child2.get('stride'))  # type: ignore
+                        reg_width = np.int64(child2.get('width'))  # type: ignore
+                        reg_height = np.int64(child2.get('height'))  # type: ignore
+                        self._roi_list.append(_ROI(reg_width, reg_height, reg_stride))
+
+    def _parse_meta_format(self, child: ET.Element):
+        for child1 in child:
+            if 'MetaBlock'.casefold() in child1.tag.casefold():
+                for child2 in child1:
+                    meta_type: str = child2.tag.rsplit('}', maxsplit=1)[1]
+                    meta_event: str = child2.get('event')  # type: ignore
+                    meta_datatype: str = child2.get('type')  # type: ignore
+                    meta_bitdepth = np.uint64(child2.get('bitDepth'))  # type: ignore
+                    match meta_type:
+                        case 'TimeStamp':
+                            meta_resolution = np.uint64(child2.get('resolution'))  # type: ignore
+                            meta_absolute_time: str = child2.get('absoluteTime')  # type: ignore
+                            self._meta_list.append(
+                                TimeStamp(meta_event, meta_datatype, meta_bitdepth, meta_resolution,
+                                          meta_absolute_time))
+                        case 'FrameTrackingNumber':
+                            self._meta_list.append(FrameTrackingNumber(meta_datatype, meta_bitdepth))
+                        case 'GateTracking':
+                            meta_event: str = child2.get('component')  # type: ignore
+                            meta_monotonic = bool(child2.get('monotonic'))
+                            self._meta_list.append(
+                                GateTracking(meta_event, meta_datatype, meta_bitdepth, meta_monotonic))
+                        case _:
+                            raise RuntimeError('Metadata block was not recognized.')
+
+    def _parse_calibrations(self, child: ET.Element):
+        counter = 0
+        for child1 in child:
+            if 'WavelengthMapping'.casefold() in child1.tag.casefold():
+                for child2 in child1:
+                    if 'WavelengthError'.casefold() in child2.tag.casefold():
+                        wavelengths = np.array([])
+                        assert child2.text
+                        wl_text = child2.text.rsplit()
+                        for elem in wl_text:
+                            wavelengths = np.append(wavelengths, np.fromstring(elem, sep=',')[0])
+                        self._full_wavelength_coverage = wavelengths
+                    else:
+                        self._full_wavelength_coverage = np.fromstring(child2.text,
+                                                                       sep=',')  # type: ignore
+            if 'SensorInformation'.casefold() in child1.tag.casefold():
+                width = np.int32(child1.get('width'))  # type: ignore
+                height = np.uint32(child1.get('height'))  # type: ignore
+                self._sensor_dims = _ROI(width, height, 0)
+            if 'SensorMapping'.casefold() in child1.tag.casefold():
+                if counter < len(self._roi_list):
+                    self._roi_list[counter].x = np.uint64(child1.get('x'))  # type: ignore
+                    self._roi_list[counter].y = np.uint64(child1.get('y'))  # type: ignore
+                    og_width = np.uint64(child1.get('width'))  # type: ignore
+                    og_height = np.uint64(child1.get('height'))  # type: ignore
+                    self._roi_list[counter].xbin = np.uint64(child1.get('xBinning'))  # type: ignore
+                    self._roi_list[counter].ybin = np.uint64(child1.get('yBinning'))  # type: ignore
+                    self._roi_list[counter].width = np.uint64(
+                        og_width / self._roi_list[counter].xbin)  # type: ignore
+                    self._roi_list[counter].height = np.uint64(
+                        og_height / self._roi_list[counter].ybin)  # type: ignore
+                    counter += 1
+                else:
+                    break
+
     def get_data(self, *, rois: Optional[Sequence[int]] = None,
-                 frames: Optional[Sequence[int]] = None) -> \
+                 frames: Optional[Sequence[int]] = None,
+                 dtype: Optional[np.dtype | type] = None,
+                 out: Optional[Sequence[np.ndarray]] = None) -> \
             Sequence[SpeNdArray]:
         """Extracts requested data from the referenced spe file. Only grabs
         the frame(s) and ROI(s) requested in the input parameters.
@@ -482,6 +533,13 @@ class SpeReference():
         None, then all ROIs in the spe file are parsed.
         - `frames`: Optional named argument for a sequence of desired frames.
         If None, then all frames in the spe file are parsed.
+        - `dtype`: Optional named argument for the dtype of the returned
+        arrays (e.g. `np.float32`). If None, the native pixel dtype of the
+        spe file is kept (or the dtype of `out`, if given).
+        - `out`: Optional named argument for a sequence of preallocated
+        arrays, one per requested ROI, each of shape [Frames, Rows, Cols].
+        Data is written into them and they are returned, so batch loops can
+        reuse the same buffers across calls.
         ----------------------------------------------------------------------
         Output:
         ----------------------------------------------------------------------
@@ -492,7 +550,8 @@ class SpeReference():
         Exceptions:
         ----------------------------------------------------------------------
         - `ValueError` raised if desired ROI(s) and / or frame(s) fall outside
-        of the range contained in the spe file.
+        of the range contained in the spe file, or if `out` does not match the
+        requested ROI(s), frame(s) and dtype.
         - `TypeError` raised if inputs are not iterable.
         """
         data_list = list()
@@ -518,57 +577,222 @@ class SpeReference():
                         % (0, self._num_frames - 1))
         except TypeError as exc:
             raise TypeError('Frame input needs to be iterable') from exc
-        if self._spe_version >= 3:
-            region_offset = 0
-            with open(self._filepath, encoding="utf8") as f:
-                bpp = np.dtype(self.dataTypes[
-                                   str(self._pixel_format_key)]).itemsize
-                for _, roi in enumerate(rois):
-                    region_data = np.zeros([len(frames),
-                                            self._roi_list[roi].height,
-                                            self._roi_list[roi].width])
-                    region_offset = 0
-                    if roi > 0:
-                        for ii in range(0, roi):
-                            region_offset += np.uint64(
-                                self._roi_list[ii].stride / bpp)
-                    for idx_frame, frame in enumerate(frames):
-                        f.seek(0)
-                        frame_offset = np.uint64(
-                            frame * self._readout_stride / bpp)
-                        read_count = np.uint64(
-                            self._roi_list[roi].stride / bpp)
-                        tmp = np.fromfile(f, dtype=self.dataTypes[str(
-                            self._pixel_format_key)], count=read_count,
-                                          offset=np.uint64(
-                                              4100 + (region_offset * bpp) + (frame_offset * bpp)))
-                        region_data[idx_frame, :] = np.reshape(tmp, [
-                            self._roi_list[roi].height,
-                            self._roi_list[roi].width])
-                    data_list.append(region_data)
-        elif self._spe_version >= 2 and self._spe_version < 3:
+        if self._spe_version >= 2 and self._spe_version < 3:
             if len(rois) != 1 and rois[0] != 0:
                 raise ValueError('Only one ROI allowed for spe v2 parsing.')
-            with open(self._filepath, encoding="utf8") as f:
-                bpp = np.dtype(self.dataTypes_old_spe[
-                                   self._pixel_format_key]).itemsize  # type: ignore
-                region_data = np.zeros(
-                    [len(frames), self._roi_list[0].height,
-                     self._roi_list[0].width], dtype=self.dataTypes_old_spe[
-                        self._pixel_format_key])  # type: ignore
+        elif self._spe_version < 2:
+            raise ValueError('Unrecognized spe file.')
+        if out is not None and len(out) != len(rois):
+            raise ValueError('Number of output arrays (%d) does not match '
+                             'number of ROIs (%d)' % (len(out), len(rois)))
+        for idx_roi, roi in enumerate(rois):
+            region_map = self.get_memmap(roi=roi)
+            shape = (len(frames), region_map.shape[1], region_map.shape[2])
+            if out is None:
+                region_data = np.empty(shape, dtype=region_map.dtype
+                                       if dtype is None else dtype)
+            else:
+                region_data = out[idx_roi]
+                if region_data.shape != shape:
+                    raise ValueError('Output array shape %s does not match '
+                                     'requested shape %s'
+                                     % (region_data.shape, shape))
+                if dtype is not None and region_data.dtype != np.dtype(dtype):
+                    raise ValueError('Output array dtype %s does not match '
+                                     'requested dtype %s'
+                                     % (region_data.dtype, np.dtype(dtype)))
+            if isinstance(frames, range) and frames.step == 1:
+                # consecutive frames are fetched with one sequential read
+                self.get_frames(frames.start, frames.stop, roi=roi,
+                                out=region_data)
+            else:
                 for idx_frame, frame in enumerate(frames):
-                    f.seek(0)
-                    frame_offset = (self._roi_list[0].stride) * frame
-                    tmp = np.fromfile(f, dtype=self.dataTypes_old_spe[
-                        self._pixel_format_key], count=np.uint64(
-                        self._roi_list[0].stride / bpp),
-                                      offset=np.uint64(4100 + frame_offset))  # type: ignore
-                    region_data[idx_frame] = np.reshape(tmp,
-                                                        [len(frames), self._roi_list[0].height,
-                                                         self._roi_list[0].width])
-                data_list.append(region_data)
+                    region_data[idx_frame] = region_map[frame]
+            data_list.append(region_data)
         return data_list
 
+    def get_memmap(self, *, roi: int = 0) -> SpeNdArray:
+        """Maps the data block of one ROI into memory without reading it.
+        Frames are sliced straight out of the OS page cache, so no file
+        handles are opened and no intermediate buffers are allocated per
+        frame.
+
+        Example usage:
+
+        `frames = img_reference.get_memmap(roi=0)`
+        `image = frames[idx]`
+        ----- that will get a read-only view of frame #idx
+
+        ----------------------------------------------------------------------
+        Input:
+        ----------------------------------------------------------------------
+        - `roi`: Optional named argument for the desired ROI index.
+        ----------------------------------------------------------------------
+        Output:
+        ----------------------------------------------------------------------
+        - `SpeNdArray`: read-only view of shape [Frames, Rows, Cols] in the
+        native pixel dtype of the spe file. Per-frame metadata is skipped
+        via the frame stride.
+        ----------------------------------------------------------------------
+        Exceptions:
+        ----------------------------------------------------------------------
+        - `ValueError` raised if the ROI falls outside of the range contained
+        in the spe file, or if more than one ROI is requested for spe v2.
+        """
+        (pixel_dtype, frame_stride, region_offset, height, width) = \
+            self._get_region_layout(roi)
+        num_frames = int(self._num_frames)
+        data_length = frame_stride * num_frames
+        if num_frames == 0:
+            return np.empty((0, height, width), dtype=pixel_dtype)
+        raw = np.memmap(self._filepath, dtype=np.uint8, mode='r',
+                        offset=4100, shape=(data_length,))
+        # frame stride includes the per-frame metadata, so build a strided
+        # view instead of reshaping
+        return np.ndarray(shape=(num_frames, height, width),
+                          dtype=pixel_dtype, buffer=raw,
+                          offset=region_offset,
+                          strides=(frame_stride,
+                                   width * pixel_dtype.itemsize,
+                                   pixel_dtype.itemsize))
+
+    def _get_region_layout(self, roi: int) -> \
+            tuple[np.dtype, int, int, int, int]:
+        """Helper returning (pixel dtype, frame stride in bytes, byte offset
+        of the ROI inside a frame, height, width) for one ROI.
+        """
+        if roi < 0 or roi >= len(self._roi_list):
+            raise ValueError(
+                'ROI value outside of allowed ranged (%d through %d)'
+                % (0, len(self._roi_list) - 1))
+        if self._spe_version >= 3:
+            frame_stride = int(self._readout_stride)
+            region_offset = sum(int(self._roi_list[ii].stride)
+                                for ii in range(0, roi))
+        elif self._spe_version >= 2 and self._spe_version < 3:
+            if roi != 0:
+                raise ValueError('Only one ROI allowed for spe v2 parsing.')
+            frame_stride = int(self._roi_list[0].stride)
+            region_offset = 0
+        else:
+            raise ValueError('Unrecognized spe file.')
+        return (self.pixel_dtype, frame_stride, region_offset,
+                int(self._roi_list[roi].height),
+                int(self._roi_list[roi].width))
+
+    # frames further apart than this are read one by one instead of reading
+    # the whole span and discarding the frames in between
+    _max_span_step = 4
+
+    def get_frames(self, start: int = 0, stop: Optional[int] = None,
+                   step: int = 1, *, roi: int = 0,
+                   dtype: Optional[np.dtype | type] = None,
+                   out: Optional[np.ndarray] = None) -> SpeNdArray:
+        """Extracts the frames `range(start, stop, step)` of one ROI. The
+        frames are fetched with a single sequential read of the span they
+        cover, instead of one read per frame.
+
+        Example usage:
+
+        `block = img_reference.get_frames(100, 200)`
+        ----- that will get frames #100 through #199 of the first region
+
+        ----------------------------------------------------------------------
+        Inputs:
+        ----------------------------------------------------------------------
+        - `start`, `stop`, `step`: frame range, with the same meaning as for
+        `range`. If `stop` is None, frames are read until the last frame.
+        - `roi`: Optional named argument for the desired ROI index.
+        - `dtype`: Optional named argument for the dtype of the returned
+        array. If None, the native pixel dtype is kept.
+        - `out`: Optional named argument for a preallocated array of shape
+        [Frames, Rows, Cols] to write the frames into.
+        ----------------------------------------------------------------------
+        Output:
+        ----------------------------------------------------------------------
+        - `SpeNdArray`: array of shape [Frames, Rows, Cols]
+        ----------------------------------------------------------------------
+        Exceptions:
+        ----------------------------------------------------------------------
+        - `ValueError` raised if the range falls outside of the frames
+        contained in the spe file, if `step` is not positive, or if `out`
+        does not match the requested frames and dtype.
+        """
+        num_frames = int(self._num_frames)
+        if stop is None:
+            stop = num_frames
+        if step <= 0:
+            raise ValueError('Frame step has to be positive.')
+        if start < 0 or stop > num_frames:
+            raise ValueError(
+                'Frame value outside of allowed ranged (%d through %d)'
+                % (0, num_frames - 1))
+        frames = range(start, stop, step)
+        (pixel_dtype, frame_stride, region_offset, height, width) = \
+            self._get_region_layout(roi)
+        shape = (len(frames), height, width)
+        if out is not None:
+            if out.shape != shape:
+                raise ValueError('Output array shape %s does not match '
+                                 'requested shape %s' % (out.shape, shape))
+            if dtype is not None and out.dtype != np.dtype(dtype):
+                raise ValueError('Output array dtype %s does not match '
+                                 'requested dtype %s'
+                                 % (out.dtype, np.dtype(dtype)))
+        if len(frames) == 0:
+            return out if out is not None else \
+                np.empty(shape, dtype=pixel_dtype if dtype is None else dtype)
+        if step > self._max_span_step:
+            region_data = self.get_memmap(roi=roi)[start:stop:step]
+        else:
+            span = frames[-1] - frames[0] + 1
+            frame_bytes = height * width * pixel_dtype.itemsize
+            with open(self._filepath, 'rb') as f:
+                f.seek(4100 + frames[0] * frame_stride)
+                raw = np.fromfile(f, dtype=np.uint8, count=(span - 1) *
+                                  frame_stride + region_offset + frame_bytes)
+            region_data = np.ndarray(shape=(span, height, width),
+                                     dtype=pixel_dtype, buffer=raw,
+                                     offset=region_offset,
+                                     strides=(frame_stride,
+                                              width * pixel_dtype.itemsize,
+                                              pixel_dtype.itemsize))[::step]
+            if out is None and (dtype is None or np.dtype(dtype) == pixel_dtype) \
+                    and region_data.flags.c_contiguous:
+                # nothing interleaved with the pixels: hand out the read
+                # buffer itself instead of copying it
+                return region_data
+        if out is None:
+            out = np.empty(shape, dtype=pixel_dtype if dtype is None else dtype)
+        out[...] = region_data
+        return out
+
+    def iter_frame_blocks(self, block_size: int = 64, *, start: int = 0,
+                          stop: Optional[int] = None, roi: int = 0,
+                          dtype: Optional[np.dtype | type] = None):
+        """Iterates over consecutive frames in blocks of `block_size`, each
+        fetched with one sequential read (see `get_frames`). Memory use is
+        bounded by one block.
+
+        Example usage:
+
+        `for first_frame, block in img_reference.iter_frame_blocks(128):`
+        ----- `block[i]` is frame #(first_frame + i)
+        ----------------------------------------------------------------------
+        Output:
+        ----------------------------------------------------------------------
+        - generator of `(int, SpeNdArray)` tuples: index of the first frame in
+        the block, and the block of shape [Frames, Rows, Cols]
+        """
+        if block_size <= 0:
+            raise ValueError('Block size has to be positive.')
+        if stop is None:
+            stop = int(self._num_frames)
+        for block_start in range(start, stop, block_size):
+            block_stop = min(block_start + block_size, stop)
+            yield block_start, self.get_frames(block_start, block_stop,
+                                               roi=roi, dtype=dtype)
+
     def get_wavelengths(self, *, rois: Optional[Sequence[int]] = None) -> \
             Sequence[WavelengthNdArray]:
         """Extracts wavelength calibration axis for the ROI(s) specified by
@@ -597,6 +821,7 @@ class SpeReference():
         if self._spe_version < 3:
             print('Version %0.1f spe files do not have wavelength cal.' %
                   (self._spe_version))
+        self._ensure_footer_parsed()
         if not any(self._full_wavelength_coverage):
             return []
         if not rois:
@@ -639,8 +864,7 @@ class SpeReference():
             'sensor_info': None
         }
         # pylint: disable=line-too-long
-        xml_root = ET.fromstring(self._xml_footer)
-        for child in xml_root:
+        for child in self.xml_root:
             if 'DataHistories'.casefold() in child.tag.casefold():
                 for child1 in child:
                     if 'DataHistory'.casefold() in child1.tag.casefold():
@@ -706,8 +930,7 @@ class SpeReference():
 
         # xml parsing
         # pylint: disable=line-too-long
-        xml_root = ET.fromstring(self._xml_footer)
-        for child in xml_root:
+        for child in self.xml_root:
             if 'DataHistories'.casefold() in child.tag.casefold():
                 for child1 in child:
                     if 'DataHistory'.casefold() in child1.tag.casefold():
@@ -887,29 +1110,39 @@ class SpeReference():
         for each metadata type present in the spe file. These types can be
         found in the `meta_list` member of `SpeReference`.
         """
-        output_metadata: list = [0] * len(frames)
-        with open(self._filepath, encoding="utf8") as f:
-            for idx_frame, frame in enumerate(frames):
-                output_metadata[idx_frame] = [0] * len(self._meta_list)
-                readout_offset = frame * self._readout_stride
-                metadata_offset = int(readout_offset + self._frame_stride)
-                for idx_meta, meta in enumerate(self._meta_list):
-                    f.seek(0)
-                    if idx_meta > 0:
-                        metadata_offset += int(
-                            (self._meta_list[idx_meta - 1].bit_depth) / 8)
-                    meta_length = np.dtype(meta.datatype).itemsize // int((
-                                                                              self._meta_list[
-                                                                                  idx_meta - 1].bit_depth) / 8)
-                    output_metadata[idx_frame][idx_meta] = np.fromfile(
-                        f, dtype=meta.datatype, count=meta_length,
-                        offset=int(4100 + metadata_offset))[0]
-                    tmp = meta
-                    if isinstance(tmp, TimeStamp):
-                        output_metadata[idx_frame][idx_meta] = (
-                                                                       output_metadata[idx_frame][idx_meta] /
-                                                                       tmp.resolution) * 1000
-        return output_metadata
+        self._ensure_footer_parsed()
+        if len(self._meta_list) == 0 or len(frames) == 0:
+            return [[] for _ in frames]
+        # all metadata columns are read in one strided pass over the frames
+        metadata_map = np.memmap(self._filepath, dtype=self._get_metadata_dtype(),
+                                 mode='r', offset=4100,
+                                 shape=(int(self._num_frames),))
+        frame_idx = np.asarray(frames, dtype=np.int64)
+        columns = []
+        for idx_meta, meta in enumerate(self._meta_list):
+            # index the field first, so only the metadata bytes are copied
+            values = metadata_map['meta%d' % idx_meta][frame_idx]
+            if isinstance(meta, TimeStamp):
+                values = (values / meta.resolution) * 1000
+            columns.append(values)
+        del metadata_map
+        return list(map(list, zip(*columns)))
+
+    def _get_metadata_dtype(self) -> np.dtype:
+        """Structured dtype of one frame readout, with a field per metadata
+        element placed after the frame data. Itemsize is the readout stride so
+        that the frames can be walked in a single strided view.
+        """
+        names, formats, offsets = [], [], []
+        metadata_offset = int(self._frame_stride)
+        for idx_meta, meta in enumerate(self._meta_list):
+            names.append('meta%d' % idx_meta)
+            formats.append(meta.datatype)
+            offsets.append(metadata_offset)
+            metadata_offset += int(meta.bit_depth) // 8
+        return np.dtype({'names': names, 'formats': formats,
+                         'offsets': offsets,
+                         'itemsize': int(self._readout_stride)})
 
     @property
     def filepath(self) -> str:
@@ -961,24 +1194,41 @@ class SpeReference():
         """key to access value in the appropriate pixel format dictionary"""
         return self._pixel_format_key
 
+    @property
+    def pixel_dtype(self) -> np.dtype:
+        """numpy dtype of the pixels stored in the data block"""
+        if self._spe_version >= 3:
+            return np.dtype(self.dataTypes[str(self._pixel_format_key)])
+        return np.dtype(
+            self.dataTypes_old_spe[self._pixel_format_key])  # type: ignore
+
     @property
     def sensor_dims(self) -> _ROI:
         """ROI object that has height and width corresponding to original
         sensor dimensions.
         """
+        self._ensure_footer_parsed()
         return self._sensor_dims
 
     @property
     def meta_list(self) -> Sequence[Metadata]:
         """Tuple of metadata types contained in each frame's data block."""
+        self._ensure_footer_parsed()
         return tuple(self._meta_list)
 
     @property
     def frame_metadata_values(self) -> Sequence[Sequence[MetaType]]:
         """Nested tuple containing all frame metadata values in the full
         data block. Outer loop indexes frame, and inner loop indexes metadata
-        element.
+        element. Values are read from the file on first access.
         """
+        if self._frame_metadata_values is None:
+            self._ensure_footer_parsed()
+            if len(self._meta_list) > 0:
+                self._frame_metadata_values = self.get_frame_metadata_value(
+                    frames=range(0, self._num_frames))
+            else:
+                self._frame_metadata_values = []
         return tuple(map(tuple, self._frame_metadata_values))
 
     @property
@@ -988,6 +1238,15 @@ class SpeReference():
         """
         return self._xml_footer
 
+    @property
+    def xml_root(self) -> ET.Element:
+        """Root of the parsed xml footer. Parsed once on first access and
+        shared by every method that reads footer information.
+        """
+        if self._xml_root is None:
+            self._xml_root = ET.fromstring(self._xml_footer)
+        return self._xml_root
+
     @property
     def xml_footer_pretty_print(self) -> str:
         """xml footer in pretty print form for easier visualization"""
@@ -0,0 +1,203 @@
+""" フォルダ内の.speファイルのヘッダー情報を索引(サイドカーファイル)として保存するクラス
+
+ファイル一覧を表示するたびに全ファイルを開いてxmlを解析しないようにする。
+索引はデータフォルダ内の INDEX_FILE_NAME に保存し、(ファイル名, サイズ, 更新時刻)が変わっていないファイルは開き直さない。
+新しいファイルや変更されたファイルだけをスレッドプールで並列に読み込む。
+削除・名前変更されてフォルダにないファイルは、保存するときに索引から除く。
+
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from modules.file_format.spe_wrapper import SpeWrapper
+from log_util import logger
+
+
+class SpeCatalog:
+    INDEX_FILE_NAME = '.spe_catalog.json' # .はじまりなのでファイル一覧には出てこない
+    INDEX_VERSION = 1 # 保存する項目を変えたら上げる。違うversionの索引は作り直す
+    MAX_WORKERS = 4
+
+    # ページの再実行をまたいで共有する
+    _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='spe_catalog')
+    _catalogs: dict = {}
+    _catalogs_lock = threading.Lock()
+
+    def __init__(self, folder_path: str):
+        self.folder_path = folder_path
+        self.index_path = os.path.join(folder_path, self.INDEX_FILE_NAME)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() # 索引ファイルへの書き込みは1つずつ
+        self._pending = {} # file_name -> Future
+        self._listing = None # 最後にupdateで渡されたファイル名。保存するときにこれにないものは除く
+        self._entries = self._load_index()
+
+    @classmethod
+    def for_folder(cls, folder_path: str) -> 'SpeCatalog':
+        """ フォルダごとに1つのインスタンスを使い回す """
+        key = os.path.abspath(folder_path)
+        with cls._catalogs_lock:
+            if key not in cls._catalogs:
+                cls._catalogs[key] = cls(folder_path)
+            return cls._catalogs[key]
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f'索引の読み込みに失敗したので作り直します: {self.index_path}, {e}')
+            return {}
+        if index.get('version') != self.INDEX_VERSION:
+            return {}
+        return index.get('files', {})
+
+    def _save_index(self):
+        with self._lock:
+            files = {file_name: entry for file_name, entry in self._entries.items()
+                     if self._listing is None or file_name in self._listing}
+            index = {'version': self.INDEX_VERSION, 'files': files}
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with self._save_lock:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(index, f, ensure_ascii=False)
+                os.replace(tmp_path, self.index_path) # 書きかけの索引を残さない
+        except OSError as e:
+            # 書き込めないフォルダでもメモリ上の索引は使える
+            logger.warning(f'索引を保存できませんでした: {self.index_path}, {e}')
+
+    def _file_key(self, file_name: str) -> dict:
+        stat = os.stat(os.path.join(self.folder_path, file_name))
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def is_up_to_date(self, file_name: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(file_name)
+        if entry is None:
+            return False
+        try:
+            key = self._file_key(file_name)
+        except OSError:
+            return False
+        return entry['size'] == key['size'] and entry['mtime_ns'] == key['mtime_ns']
+
+    @staticmethod
+    def read_header_facts(file_path: str) -> dict:
+        """ .speファイルを開いて、一覧表示に使う情報を集める。取得できなかった項目はNoneにする
+
+        :param file_path:
+        :return: OD, framerate, date, frame_num, ROIの形, 波長範囲, pixel_format
+        """
+        spe = SpeWrapper(file_path, header_only=True)
+        roi = spe.roi_list[0]
+        facts = {
+            'frame_num': int(spe.num_frames),
+            'position_pixel_num': int(roi.height),
+            'wavelength_pixel_num': int(roi.width),
+            'pixel_format': str(spe.pixel_format_key),
+            'OD': None,
+            'framerate': None,
+            'date': None,
+            'wavelength_min': None,
+            'wavelength_max': None,
+        }
+        try:
+            spe.get_params_from_xml()
+            facts['OD'] = getattr(spe, 'OD', None)
+            facts['framerate'] = getattr(spe, 'framerate', None)
+            facts['date'] = getattr(spe, 'date', None)
+        except Exception as e:
+            logger.debug(f'xmlから情報を取得できませんでした: {file_path}, {e}')
+        try:
+            wavelength_list = spe.get_wavelengths()
+            if len(wavelength_list) > 0:
+                facts['wavelength_min'] = float(np.min(wavelength_list[0]))
+                facts['wavelength_max'] = float(np.max(wavelength_list[0]))
+        except Exception as e:
+            logger.debug(f'波長配列を取得できませんでした: {file_path}, {e}')
+        return facts
+
+    def _index_file(self, file_name: str):
+        try:
+            key = self._file_key(file_name) # 読み込み前に取って、読み込み中の変更は次回拾い直す
+        except OSError as e:
+            logger.warning(f'.speファイルが見つかりません: {file_name}, {e}')
+            with self._lock:
+                self._pending.pop(file_name, None)
+            return
+        try:
+            facts = self.read_header_facts(os.path.join(self.folder_path, file_name))
+        except Exception as e:
+            logger.warning(f'.speファイルを索引に登録できませんでした: {file_name}, {e}')
+            facts = {'OD': None}
+        with self._lock:
+            self._entries[file_name] = {**key, **facts}
+            self._pending.pop(file_name, None)
+
+    def update(self, files, wait_for_completion: bool = False):
+        """ 索引にない・変更されたファイルをスレッドプールで読み込む
+
+        :param files: フォルダ内の全ての.speファイル名のリスト。ここにないファイルは索引から除く
+        :param wait_for_completion: Trueなら読み込みが終わるまで待つ。
+            Falseなら待たずに返り、終わったものから索引に入る(全て終わったら索引ファイルに保存する)
+        :return:
+        """
+        futures = []
+        with self._lock:
+            self._listing = set(files)
+            removed_files = [file_name for file_name in self._entries if file_name not in self._listing]
+            for file_name in removed_files:
+                del self._entries[file_name]
+        for file_name in files:
+            if self.is_up_to_date(file_name):
+                continue
+            with self._lock:
+                future = self._pending.get(file_name)
+                if future is None:
+                    future = self._executor.submit(self._index_file, file_name)
+                    self._pending[file_name] = future
+            futures.append(future)
+        if not futures:
+            if removed_files:
+                self._save_index()
+            return
+        logger.info(f'{len(futures)} 個の.speファイルを索引に登録します: {self.folder_path}')
+        if wait_for_completion:
+            wait(futures)
+            self._save_index()
+        else:
+            for future in futures:
+                future.add_done_callback(lambda _: self._save_index_if_done())
+
+    def _save_index_if_done(self):
+        # ファイルごとに保存すると、索引ファイルをファイル数の回数だけ書き直すことになるので、全て終わったときだけ保存する
+        if self.get_pending_num() == 0:
+            self._save_index()
+
+    def get_pending_num(self) -> int:
+        """ 読み込み中(まだ索引に入っていない)のファイル数 """
+        with self._lock:
+            return len(self._pending)
+
+    def invalidate(self, file_name: str):
+        """ ファイルを書き換えたときに、そのファイルの索引を削除する。次のupdateで読み込み直す """
+        with self._lock:
+            removed = self._entries.pop(file_name, None) is not None
+        if removed:
+            self._save_index()
+
+    def get_entry(self, file_name: str):
+        with self._lock:
+            return self._entries.get(file_name)
+
+    def get_entries(self, files) -> list:
+        """ 索引から各ファイルの情報を返す。まだ索引にないファイルはNone """
+        with self._lock:
+            return [self._entries.get(file_name) for file_name in files]
@@ -16,25 +16,43 @@ class SpeWrapper(SpeReference):
     }
     INITIAL_POSITION = 4100
 
-    def __init__(self, filepath: str):
-        super().__init__(filepath)
+    def __init__(self, filepath: str, *, header_only: bool = False):
+        super().__init__(filepath, header_only=header_only)
         self._filepath = filepath
+        self._memmap = None
+
+    # (frame_num, pixel, pixel)のメモリマップを返す。読み込みもコピーもせず、スライスしたframeだけがディスクから読まれる
+    def as_memmap(self) -> np.ndarray:
+        if self._memmap is None:
+            self._memmap = self.get_memmap(roi=0)
+        return self._memmap
 
     # 指定されたframeのimgデータを返す
     def get_frame_data(self,
                        rois:Optional[Sequence[int]] = None,
-                       frame:Optional[int] = None) -> np.ndarray:
+                       frame:Optional[int] = None,
+                       dtype=None) -> np.ndarray:
         # NOTE: frameを指定しないと、shape=(1, 800, 512, 512)のように返ってくる。
         # numpy.ndarrayのlistなので四次元 (List(ndarray))
-        return self.get_data(frames=[frame])[0][0] # list, ndarrayを外して、二次元の露光データを取得
+        return self.get_data(frames=[frame], dtype=dtype)[0][0] # list, ndarrayを外して、二次元の露光データを取得
 
     # (frame_num, pixel, pixel)の3次元のndarrayを返す
-    def get_all_data_arr(self) -> np.ndarray:
-        return self.get_data()[0]
+    # dtypeを指定しなければネイティブのdtype(uint16など)のまま。outを渡すとそこに書き込んで使い回せる
+    def get_all_data_arr(self, dtype=None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        return self.get_data(dtype=dtype, out=None if out is None else [out])[0]
 
     # 最大値配列を返す
-    def get_max_intensity(self):
-        return self.get_all_data_arr().max(axis=2).max(axis=1)
+    # 全frameを一度に確保せず、使い回すバッファにblock_sizeずつ読み込んで集計する
+    def get_max_intensity(self, block_size: int = 64):
+        frame_num = int(self.num_frames)
+        height, width = int(self.roi_list[0].height), int(self.roi_list[0].width)
+        buffer = np.empty((min(block_size, frame_num), height, width), dtype=self.pixel_dtype)
+        max_intensity = np.empty(frame_num, dtype=self.pixel_dtype)
+        for start in range(0, frame_num, block_size):
+            stop = min(start + block_size, frame_num)
+            block = self.get_data(frames=range(start, stop), out=[buffer[:stop - start]])[0]
+            max_intensity[start:stop] = block.max(axis=(1, 2))
+        return max_intensity
 
     # SpeFileからの借用
     def _read_at(self, pos, size, ntype):
@@ -47,38 +65,24 @@ class SpeWrapper(SpeReference):
     def set_datatype(self):
         self._data_type = self._read_at(108, 1, np.uint16)[0]
 
-    def _get_xml_string(self):
-        """Reads out the xml string from the file end"""
-        self.xml_offset = self._read_at(678, 1, np.int_)[0]
-        with open(self._filepath, 'rb') as fid:
-            fid.seek(int(self.xml_offset))
-            self.xml_string = fid.read()
-
     def get_params_from_xml(self):
-        self._get_xml_string()
-        xml = self.xml_string
-        str_xml = str(xml)
-        list_xml = str_xml.split("<")
-
-        # 特定の文字列が入っているものから情報を抜き出す
-        for i, ele in enumerate(list_xml):
-            if ('FrameRate r:readOnly' in ele) and ('/' not in ele):
-                # print(f"{i}: {ele = }") # デバッグ用
-                self.framerate = float(ele.split('>')[-1])
-            if ('BaseFileName' in ele) and ('/' not in ele):
-                # print(f"{i}: {ele = }")
-                self.basename = ele.split('>')[-1]
-            if ('IncrementNumber' in ele) and ('/' not in ele):
-                # print(f"{i}: {ele = }")
-                self.filenum = int(ele.split('>')[-1])
-            if ('ReferenceFileDate r:readOnly' in ele) and ('/' not in ele):
-                # print(f"{i}: {ele = }")
-                self.date = ele.split('>')[-1]
-            if ('Date r:readOnly' in ele) and ('Reference' not in ele) and ('/' not in ele):
-                # print(f"{i}: {ele = }")
-                self.calibration_date = ele.split('>')[-1]
-            if ('Name type' in ele) and ('/' not in ele):
-                # print(f"{i}: {ele = }")
-                self.OD = ele.split('>')[-1]
-
-
+        # SpeReferenceでキャッシュしたxmlの木を共有して使う。フッターを読み直したり文字列分割したりしない
+        # 特定のタグ(と属性)を持つ要素から情報を抜き出す。後から見つかったものが優先される
+        for element in self.xml_root.iter():
+            tag = element.tag.rsplit('}', maxsplit=1)[-1]
+            attributes = [key.rsplit('}', maxsplit=1)[-1] for key in element.keys()]
+            text = element.text
+            if text is None:
+                continue
+            if tag == 'FrameRate' and 'readOnly' in attributes:
+                self.framerate = float(text)
+            if tag == 'BaseFileName':
+                self.basename = text
+            if tag == 'IncrementNumber':
+                self.filenum = int(text)
+            if tag == 'ReferenceFileDate' and 'readOnly' in attributes:
+                self.date = text
+            if tag.endswith('Date') and ('Reference' not in tag) and 'readOnly' in attributes:
+                self.calibration_date = text
+            if tag.endswith('Name') and 'type' in attributes:
+                self.OD = text
@@ -3,6 +3,11 @@ from scipy.constants import h, c, k  # プランク定数, 光速, ボルツマ
 from scipy.optimize import curve_fit
 
 class PlanckFitter:
+    DEFAULT_INITIAL_TEMPERATURE = 5_000 # Wien近似で求まらないときの初期温度 (K)
+    DEFAULT_INITIAL_SCALE = 1e-14 # 最小二乗で求まらないときの初期スケール因子
+    WAVELENGTH_CONSTANTS_CACHE_SIZE = 16 # 覚えておく波長配列の数
+    _wavelength_constants = {} # 波長配列 -> (c1, c2)。get_wavelength_constantsを参照
+
     # プランク関数の定義
     @staticmethod
     def planck_function(wavelength, T, A):
@@ -13,17 +18,202 @@ class PlanckFitter:
         intensity = (2 * h * c**2) / (wavelength_m**5) * (1 / (np.exp((h * c) / (wavelength_m * k * T)) - 1))
         return A * intensity
 
+    @classmethod
+    def get_wavelength_constants(cls, wavelength_fit):
+        """
+        波長ごとの定数 c1 = 2hc^2/λ^5 と c2 = hc/(λk) を返す。プランク関数は c1 / (exp(c2/T) - 1)
+        同じ波長範囲で何本もフィッティングするので、波長配列ごとに覚えておく
+        wavelength_fit: 波長 (nm単位)
+        """
+        wavelength_fit = np.ascontiguousarray(wavelength_fit, dtype=np.float64)
+        key = (wavelength_fit.shape, wavelength_fit.tobytes())
+        constants = cls._wavelength_constants.get(key)
+        if constants is None:
+            wavelength_m = wavelength_fit * 1e-9  # nm -> m
+            constants = (2 * h * c**2 / wavelength_m**5, h * c / (wavelength_m * k))
+            for constant in constants:
+                constant.setflags(write=False) # 使い回すので書き換えられないようにする
+            if len(cls._wavelength_constants) >= cls.WAVELENGTH_CONSTANTS_CACHE_SIZE:
+                cls._wavelength_constants.pop(next(iter(cls._wavelength_constants))) # 最も古いものを消す
+            cls._wavelength_constants[key] = constants
+        return constants
+
     @classmethod
     def fit_by_planck(cls, wavelength_fit, intensity_fit):
-        initial_temperature = 5_000  # 初期温度を 5000 K に設定
-        initial_scale = 1e-14       # 初期スケール因子を適当に設定
-        params, covariance = curve_fit(cls.planck_function, wavelength_fit, intensity_fit, p0=[initial_temperature, initial_scale])
+        """
+        1本のスペクトルをcurve_fitでフィッティングする
+        パラメータは(T, ln(scale))にして、ヤコビアンは差分でなく解析的に与える
+        scaleは1e-14程度で、そのまま動かすとTと桁が違いすぎて収束しにくいため。初期値はWien近似から決める
+        return: dict。T, scale, T_error, scale_error と、関数・ヤコビアンの評価回数 nfev, njev
+        """
+        # float32で保存されたスペクトルでも、curve_fitの中はfloat64で計算する
+        wavelength_fit = np.asarray(wavelength_fit, dtype=np.float64)
+        intensity_fit = np.asarray(intensity_fit, dtype=np.float64)
+        c1, c2 = cls.get_wavelength_constants(wavelength_fit)
+
+        def model(_, T, log_scale):
+            with np.errstate(over='ignore'):
+                return np.exp(log_scale) * c1 / np.expm1(c2 / T)
+
+        def jacobian(_, T, log_scale):
+            x = c2 / T
+            with np.errstate(over='ignore', invalid='ignore'):
+                intensity = np.exp(log_scale) * c1 / np.expm1(x)
+                # d/dT = intensity * x/T * e^x/(e^x - 1), d/d(ln scale) = intensity
+                return np.column_stack([intensity * x / T / -np.expm1(-x), intensity])
+
+        # 初期値: 温度はWien近似、scaleはその温度での最小二乗解
+        wien = cls.fit_by_wien(wavelength_fit, intensity_fit)
+        initial_temperature = wien['T'] if wien['valid'] else cls.DEFAULT_INITIAL_TEMPERATURE
+        with np.errstate(over='ignore'):
+            basis = c1 / np.expm1(c2 / initial_temperature)
+        initial_scale = np.dot(intensity_fit, basis) / np.dot(basis, basis)
+        if not (np.isfinite(initial_scale) and initial_scale > 0):
+            initial_scale = cls.DEFAULT_INITIAL_SCALE
+        params, covariance, infodict, _, _ = curve_fit(
+            model, wavelength_fit, intensity_fit, p0=[initial_temperature, np.log(initial_scale)],
+            jac=jacobian, full_output=True
+        )
         # フィッティング結果と標準誤差
-        T, scale = params
-        T_error, scale_error = np.sqrt(np.diag(covariance))
+        T, log_scale = params
+        T_error, log_scale_error = np.sqrt(np.diag(covariance))
+        scale = np.exp(log_scale)
+        return {
+            'T': T,
+            'scale': scale,
+            'T_error': T_error,
+            'scale_error': scale * log_scale_error, # d(scale) = scale * d(ln scale)
+            'nfev': infodict['nfev'],
+            'njev': infodict.get('njev', 0)
+        }
+
+    @classmethod
+    def fit_by_wien(cls, wavelength_fit, spectra):
+        """
+        Wien近似 I = scale * 2hc^2/λ^5 * exp(-hc/(λkT)) で、ln(I λ^5 / 2hc^2) を hc/(λk) に対して直線で当てはめる
+        傾きが-1/T、切片がln(scale)になるので、反復せずに和(行列積)だけで解ける。(frame, position, 波長)の全体にも使える
+        λT が小さい(hc/(λkT) >> 1)ほど正確。2000 K・800 nmでPlanckとの差は1%以下
+        重みはI^2 (強度の誤差が一定なら ln I の分散は 1/I^2 に比例するため)。I <= 0 の点は使わない
+        wavelength_fit: 波長 (nm単位), shape=(W,)
+        spectra: shape=(..., W)
+        return: dict。T, scale, T_error, scale_error, valid (shape=spectra.shape[:-1])
+            誤差は重み付き回帰の残差から見積もったもの。validは3点以上使えて、傾きが負のもの
+        """
+        c1, z = cls.get_wavelength_constants(wavelength_fit)
+        spectra = np.asarray(spectra, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y = np.log(spectra / c1)
+            weight = np.where(spectra > 0, spectra**2, 0.0)
+            y = np.where(weight > 0, y, 0.0)
+            # 重み付き最小二乗の和。波長の軸について行列積で計算する
+            s_w = weight.sum(axis=-1)
+            s_z = weight @ z
+            s_zz = weight @ z**2
+            s_y = (weight * y).sum(axis=-1)
+            s_zy = (weight * y) @ z
+            determinant = s_w * s_zz - s_z**2
+            slope = (s_w * s_zy - s_z * s_y) / determinant
+            intercept = (s_y - slope * s_z) / s_w
+            point_num = np.count_nonzero(weight, axis=-1)
+            variance = (weight * (y - intercept[..., None] - slope[..., None] * z)**2).sum(axis=-1) / (point_num - 2)
+            slope_error = np.sqrt(variance * s_w / determinant)
+            intercept_error = np.sqrt(variance * s_zz / determinant)
+            T = -1 / slope
+            scale = np.exp(intercept)
+        return {
+            'T': T,
+            'scale': scale,
+            'T_error': T**2 * slope_error,  # dT/d(slope) = 1/slope^2 = T^2
+            'scale_error': scale * intercept_error,
+            'valid': (point_num > 2) & (slope < 0) & np.isfinite(T) & np.isfinite(scale)
+        }
+
+    @staticmethod
+    def _planck_basis(c1, c2, T):
+        """ scale=1のプランク関数。shape=(len(T), 波長数)。c1 = 2hc^2/λ^5, c2 = hc/(λk) """
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            return c1 / np.expm1(c2 / T[:, None])
+
+    @classmethod
+    def fit_batch(cls, wavelength_fit, spectra, initial_temperature=None, max_iterations=50, tolerance=1e-8):
+        """
+        N本のスペクトルを、まとめてLevenberg-Marquardt法でフィッティングする
+        scaleは温度を決めれば線形最小二乗で決まるので、毎回それで消去し、1/Tの1変数だけを反復で解く(variable projection)
+        Tとscaleを同時に動かすと、強く相関した細い谷をゆっくり進むことになり収束が遅いため
+        wavelength_fit: 波長 (nm単位), shape=(W,)
+        spectra: shape=(N, W)
+        initial_temperature: 温度の初期値 (K)。スカラーか、shape=(N,)。Noneならfit_by_wienの結果(求まらなければDEFAULT_INITIAL_TEMPERATURE)
+        return: dict。T, scale, T_error, scale_error (shape=(N,)) と、収束したかどうか converged (bool)
+            誤差はcurve_fitと同じく、(T, scale)の共分散を残差から見積もった分散でスケールしたもの
+        """
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=np.float64))
+        spectrum_num, wavelength_num = spectra.shape
+        c1, c2 = cls.get_wavelength_constants(wavelength_fit)
+
+        def solve_scale(T, spectra_a):
+            # 温度を固定したときの最適なscaleと残差の二乗和
+            basis = cls._planck_basis(c1, c2, T)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = np.sum(spectra_a * basis, axis=1) / np.sum(basis**2, axis=1)
+                ssr = np.sum((spectra_a - scale[:, None] * basis)**2, axis=1)
+            return basis, scale, ssr
+
+        if initial_temperature is None:
+            wien = cls.fit_by_wien(wavelength_fit, spectra)
+            initial_temperature = np.where(wien['valid'], wien['T'], cls.DEFAULT_INITIAL_TEMPERATURE)
+        inverse_T = 1 / np.broadcast_to(np.asarray(initial_temperature, dtype=np.float64), (spectrum_num,))
+        _, scale, ssr = solve_scale(1 / inverse_T, spectra)
+        damping = np.full(spectrum_num, 1e-3)
+        converged = np.zeros(spectrum_num, dtype=bool)
+        active = np.isfinite(ssr) & (inverse_T > 0)
+
+        for _ in range(max_iterations):
+            indices = np.flatnonzero(active)
+            if indices.size == 0:
+                break
+            inverse_T_a, spectra_a, ssr_a, damping_a = inverse_T[indices], spectra[indices], ssr[indices], damping[indices]
+            basis, scale_a, _ = solve_scale(1 / inverse_T_a, spectra_a)
+            residual = spectra_a - scale_a[:, None] * basis
+            x = c2 * inverse_T_a[:, None]
+            with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+                # d(model)/d(1/T)から、scaleの方向の成分を除く (scaleは別に最適化するので)
+                jacobian = -scale_a[:, None] * basis * c2 / -np.expm1(-x)
+                jacobian -= basis * (np.sum(jacobian * basis, axis=1) / np.sum(basis**2, axis=1))[:, None]
+                step = np.sum(jacobian * residual, axis=1) / (np.sum(jacobian**2, axis=1) * (1 + damping_a))
+            inverse_T_new = inverse_T_a + step
+            _, scale_new, ssr_new = solve_scale(1 / inverse_T_new, spectra_a)
+
+            # 残差が減ったら採用して減衰を弱め、減らなければ減衰を強めてやり直す
+            accepted = (inverse_T_new > 0) & np.isfinite(ssr_new) & (ssr_new <= ssr_a)
+            inverse_T[indices] = np.where(accepted, inverse_T_new, inverse_T_a)
+            scale[indices] = np.where(accepted, scale_new, scale_a)
+            ssr[indices] = np.where(accepted, ssr_new, ssr_a)
+            damping[indices] = np.where(accepted, damping_a / 10, damping_a * 10)
+
+            # 却下されたステップは減衰を強めた分だけ小さくなるので、ステップの大きさでの判定も採用されたときだけにする
+            done = accepted & ((np.abs(step) <= tolerance * inverse_T_a) | (ssr_a - ssr_new <= tolerance * ssr_a))
+            converged[indices[done]] = True
+            # 解けない(ヤコビアンが0など)・減衰が大きくなりすぎた(ずっと採用されない)ものは収束しなかったとして打ち切る
+            stuck = ~np.isfinite(step) | (damping[indices] > 1e16)
+            active[indices[done | stuck]] = False
+        T = 1 / inverse_T
+
+        # 標準誤差: 共分散 = s^2 (J^TJ)^-1, s^2 = 残差の二乗和 / 自由度
+        x = c2 / T[:, None]
+        basis = cls._planck_basis(c1, c2, T)
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            jacobian_T = scale[:, None] * basis * x / T[:, None] / -np.expm1(-x)
+            norm_T_sq = np.sum(jacobian_T**2, axis=1)
+            norm_scale_sq = np.sum(basis**2, axis=1)
+            correlation_sq = np.sum(jacobian_T * basis, axis=1)**2 / (norm_T_sq * norm_scale_sq)
+            variance = ssr / (wavelength_num - 2) if wavelength_num > 2 else np.full(spectrum_num, np.inf)
+            T_error = np.sqrt(variance / (norm_T_sq * (1 - correlation_sq)))
+            scale_error = np.sqrt(variance / (norm_scale_sq * (1 - correlation_sq)))
+        converged &= np.isfinite(T) & np.isfinite(scale) & (T > 0) & (scale > 0) # 強度が負になる解は物理的でない
         return {
             'T': T,
             'scale': scale,
             'T_error': T_error,
-            'scale_error': scale_error
+            'scale_error': scale_error,
+            'converged': converged
         }
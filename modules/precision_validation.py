@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from modules.planck_fitter import PlanckFitter
+from modules.color_pyrometer import ColorPyrometer
+
+class PrecisionValidator:
+    """
+    校正済みスペクトルをfloat32で保存しても温度が変わらないことを確かめる
+    float64で校正したスペクトルと、それをfloat32に丸めたスペクトルで同じ計算をして、温度を比べる
+    """
+    @staticmethod
+    def _color_temperature(wavelength_fit, intensity_fit):
+        # 全ペアの温度の中央値を、二色法の代表値とする
+        T, _, _ = ColorPyrometer.calculate_temperature_all_pairs(wavelength_fit, intensity_fit)
+        T = T[(T > 0) & (T < 10_000)]
+        return np.median(T) if len(T) > 0 else np.nan
+
+    @classmethod
+    def compare(cls, wavelength_fit, spectra_float64, dtype=np.float32, with_color_pyrometer=False) -> pd.DataFrame:
+        """
+        wavelength_fit: 波長 (nm単位)
+        spectra_float64: shape=(スペクトル数, 波長数)。float64で校正したスペクトル
+        dtype: 比べる精度
+        with_color_pyrometer: 二色法でも比べるか。1本あたり波長数の2乗回解くので遅い
+        return: 1行が1本のスペクトルに対応するDataFrame
+        """
+        spectra_float64 = np.asarray(spectra_float64, dtype=np.float64)
+        spectra_low = spectra_float64.astype(dtype)
+        rows = []
+        for spectrum_float64, spectrum_low in zip(spectra_float64, spectra_low):
+            row = {}
+            for label, spectrum in (('float64', spectrum_float64), (np.dtype(dtype).name, spectrum_low)):
+                try:
+                    fit_result = PlanckFitter.fit_by_planck(wavelength_fit, spectrum)
+                    row[f'planck_T_{label}'] = fit_result['T']
+                    row[f'planck_T_error_{label}'] = fit_result['T_error']
+                except Exception:
+                    row[f'planck_T_{label}'] = np.nan
+                    row[f'planck_T_error_{label}'] = np.nan
+                if with_color_pyrometer:
+                    row[f'color_T_{label}'] = cls._color_temperature(wavelength_fit, spectrum)
+            rows.append(row)
+        report = pd.DataFrame(rows)
+        label = np.dtype(dtype).name
+        report['planck_T_diff'] = report[f'planck_T_{label}'] - report['planck_T_float64']
+        if with_color_pyrometer:
+            report['color_T_diff'] = report[f'color_T_{label}'] - report['color_T_float64']
+        return report
+
+    @staticmethod
+    def summarize(report: pd.DataFrame) -> dict:
+        """
+        compareの結果をまとめる
+        max_abs_diff: 温度差の絶対値の最大 (K)
+        max_diff_per_error: 温度差をフィッティングの誤差(float64)で割った値の最大。1より十分小さければ問題ない
+        failed: どちらかの精度でフィットできなかった本数
+        """
+        diff = report['planck_T_diff']
+        summary = {
+            'spectrum_num': len(report),
+            'failed': int(diff.isna().sum()),
+            'max_abs_diff': float(np.nanmax(np.abs(diff))) if diff.notna().any() else np.nan,
+            'max_diff_per_error': float(np.nanmax(np.abs(diff) / report['planck_T_error_float64']))
+                if diff.notna().any() else np.nan,
+        }
+        if 'color_T_diff' in report:
+            color_diff = report['color_T_diff']
+            summary['color_max_abs_diff'] = float(np.nanmax(np.abs(color_diff))) if color_diff.notna().any() else np.nan
+        return summary
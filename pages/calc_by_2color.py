@@ -84,7 +84,7 @@ if need_raw_spectrum:
         )
         # インスタンス化して最大強度配列を取得
         raw_spectrum = SpectrumData(file_path=os.path.join(raw_spectrum_path, selected_reference_file))
-        max_intensity_arr = raw_spectrum.get_max_intensity_2d_arr()
+        max_intensity_arr = raw_spectrum.get_max_intensity_2d_arr(progress_callback=st.progress(0.0).progress)
         # 強度を表示。しきい値を選択できるようにして、計算範囲の表示も行う。
         # TODO: figure makerへ
         # まず元強度のプロット
@@ -147,12 +147,12 @@ selected_position = st.number_input(
     value=0,
     step=1
 )
-# 波長範囲を示すmask配列を作成
-mask = (wavelength_arr >= lower_wavelength) & (wavelength_arr <= upper_wavelength)  # boolean配列が作成される
-wavelength_fit = wavelength_arr[mask]  # boolean配列を入れてあげると、trueのところだけ抽出できる
-# 対応するスペクトルデータを取得
-intensity_spectrum = calibrated_spectrum.get_frame_data(frame=selected_frame)[selected_position]
-intensity_fit = intensity_spectrum[mask]
+# 対応するスペクトルデータのうち、波長範囲の列だけを取得
+wavelength_range = (lower_wavelength, upper_wavelength)
+wavelength_fit, intensity_fit = calibrated_spectrum.get_spectra(
+    [selected_frame], [selected_position], wavelength_range=wavelength_range
+)
+intensity_fit = intensity_fit[0]
 
 # FIXME: スペクトルを表示
 if st.checkbox(label='スペクトルとPlanck fitを表示', value=True):
@@ -275,13 +275,16 @@ if st.checkbox(label='一括で計算を行う', value=False):
         color_T_error = []
         x = []
 
-        for idx, i in enumerate(loop_range):
-            if extend_option == 'frame':
-                intensity_spectrum = calibrated_spectrum.get_frame_data(frame=i)[selected_position]
-            else:
-                intensity_spectrum = calibrated_spectrum.get_frame_data(frame=selected_frame)[i]
+        # 計算するスペクトルは先にまとめて読み込んでおく
+        if extend_option == 'frame':
+            batch_frames = list(loop_range)
+            batch_positions = [selected_position] * len(loop_range)
+        else:
+            batch_frames = [selected_frame] * len(loop_range)
+            batch_positions = list(loop_range)
+        _, batch_spectra = calibrated_spectrum.get_spectra(batch_frames, batch_positions, wavelength_range=wavelength_range)
 
-            intensity_fit = intensity_spectrum[mask]
+        for idx, (i, intensity_fit) in enumerate(zip(loop_range, batch_spectra)):
 
             # Planck fit
             try:
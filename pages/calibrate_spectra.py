@@ -1,13 +1,17 @@
 import os
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 from app_utils import setting_handler, display_handler
 from app_utils.file_handler import FileHandler
 from app_utils.writer import CalibrateSpectraWriter
+from app_utils.batch_calibrator import BatchCalibrator
 from modules.file_format.spe_wrapper import SpeWrapper
 from modules.data_model.spectrum_data import SpectrumData
+from modules.file_format.HDF5 import ChunkLayout
+from modules.precision_validation import PrecisionValidator
 from log_util import logger
 
 
@@ -39,6 +43,19 @@ def load_spe_files(path):
         logger.error(f"ファイル読み込みエラー: {e}")
         st.stop()
 
+def display_spe_file_list(read_path, files):
+    """ ODごとに.speファイルの一覧を表示する。索引にないファイルは読み込み終わったものから表に入る """
+    spe_display_data = FileHandler.get_file_list_with_OD(read_path, files)
+    indexing_file_num = FileHandler.get_indexing_file_num(read_path)
+    for _, od_display_data in spe_display_data.groupby('OD', dropna=False, sort=False):
+        st.table(od_display_data)
+    if indexing_file_num > 0:
+        st.progress(1 - indexing_file_num / len(files), text=f'.speファイルの情報を読み込み中... 残り {indexing_file_num} ファイル')
+    elif st.session_state.get('is_indexing_spe_files', False):
+        # 読み込みが終わったらページ全体を再実行して、一覧の定期的な更新を止める
+        st.session_state['is_indexing_spe_files'] = False
+        st.rerun()
+
 def display_spe_metadata(spe: SpeWrapper):
     try:
         spe.get_params_from_xml()
@@ -101,47 +118,138 @@ def display_calibration_selection(lamp_files, filter_files):
 
     return selected_lamp_path, selected_up_filter_path, selected_down_filter_path
 
-def execute_calibration(spe: SpeWrapper, path_to_spe: str, lamp_path: str, up_path: str, down_path: str, save_path: str):
+def display_storage_options():
+    layout_col, compression_col, precision_col = st.columns(3)
+    with layout_col:
+        chunk_layout = st.selectbox(
+            '保存時の区切り方 (chunk)',
+            options=[layout.value for layout in ChunkLayout],
+            index=[layout.value for layout in ChunkLayout].index(ChunkLayout.HYBRID.value),
+            help='frame_major: frame単位の表示が速い / spectrum_major: 1本ずつのフィッティングが速い / hybrid: その中間'
+        )
+    with compression_col:
+        compression = st.selectbox('圧縮', options=['なし', 'lzf', 'gzip'], help='lzfは速く、gzipはよく縮む')
+    with precision_col:
+        precision = st.selectbox('精度', options=['float32', 'float64'], help='元データは16bitなので、通常はfloat32で十分')
+    return ChunkLayout.from_str(chunk_layout), (None if compression == 'なし' else compression), np.dtype(precision)
+
+def display_precision_validation(path_to_spe: str, lamp_path: str, up_path: str, down_path: str, dtype):
+    # 強度の大きい(frame, position)のスペクトルで、float64とdtypeの温度を比べる
+    if not st.checkbox(f'{dtype.name}で保存した場合の温度の差を確認する', value=False):
+        return
+    spectrum_num = st.number_input('比べるスペクトルの本数 (強度の大きい順)', min_value=1, max_value=200, value=20)
+    if not st.button('精度を確認'):
+        return
+    radiation = SpectrumData(path_to_spe)
+    lamp_spectrum = pd.read_csv(lamp_path, header=None, names=["wavelength", "intensity"])
+    up_response = SpeWrapper(up_path, header_only=True).get_frame_data(frame=0)[0]
+    down_response = SpeWrapper(down_path, header_only=True).get_frame_data(frame=0)[0]
+    wavelength_arr = radiation.get_wavelength_arr()
+    calibration_image = CalibrateSpectraWriter.get_calibration_image(
+        wavelength_arr, lamp_spectrum, up_response, down_response, radiation.position_pixel_num, radiation.center_pixel
+    )
+    max_intensity_2d = radiation.get_max_intensity_2d_arr(progress_callback=st.progress(0.0).progress)
+    brightest = np.argsort(max_intensity_2d, axis=None)[::-1][:spectrum_num]
+    frames, positions = np.unravel_index(brightest, max_intensity_2d.shape)
+    spectra = np.array([
+        radiation.get_frame_data(frame)[position] * calibration_image[position]
+        for frame, position in zip(frames, positions)
+    ])
+    # Fit by Planckの既定と同じ600-800 nmで比べる
+    mask = (wavelength_arr >= 600) & (wavelength_arr <= 800)
+    if not mask.any():
+        mask = np.ones_like(wavelength_arr, dtype=bool)
+    report = PrecisionValidator.compare(wavelength_arr[mask], spectra[:, mask], dtype=dtype)
+    report.insert(0, 'position', positions)
+    report.insert(0, 'frame', frames)
+    st.write(PrecisionValidator.summarize(report))
+    st.dataframe(report)
+
+def execute_calibration(spe: SpeWrapper, path_to_spe: str, lamp_path: str, up_path: str, down_path: str, save_path: str,
+                        chunk_layout: ChunkLayout = ChunkLayout.HYBRID, compression: str = None, dtype=np.float32,
+                        lazy: bool = False):
     st.info('書き込み開始', icon='➡️')
     output_name = spe.file_name + '_calib.hdf'
     path_to_hdf5 = os.path.join(save_path, output_name)
 
     radiation = SpectrumData(path_to_spe)
     lamp_spectrum = pd.read_csv(lamp_path, header=None, names=["wavelength", "intensity"])
-    up_response = SpeWrapper(up_path).get_frame_data(frame=0)[0]
-    down_response = SpeWrapper(down_path).get_frame_data(frame=0)[0]
+    up_response = SpeWrapper(up_path, header_only=True).get_frame_data(frame=0)[0]
+    down_response = SpeWrapper(down_path, header_only=True).get_frame_data(frame=0)[0]
 
     # ログ出力
     os.makedirs('log', exist_ok=True)
     with open('log/calibration_log.txt', 'a') as f:
         f.write(f"{datetime.now()}\n\tfrom {spe.filepath}\n\tto {path_to_hdf5}\n\twith {lamp_path}\n\t     {up_path}\n\t     {down_path}\n\n")
 
-    CalibrateSpectraWriter.output_to_hdf5(
-        original_radiation=radiation,
-        lamp_spectrum=lamp_spectrum,
-        up_response=up_response,
-        down_response=down_response,
-        path_to_hdf5=path_to_hdf5
-    )
+    if lazy:
+        CalibrateSpectraWriter.output_lazy_to_hdf5(
+            original_radiation=radiation,
+            lamp_spectrum=lamp_spectrum,
+            up_response=up_response,
+            down_response=down_response,
+            path_to_hdf5=path_to_hdf5,
+            dtype=dtype
+        )
+    else:
+        CalibrateSpectraWriter.output_to_hdf5(
+            original_radiation=radiation,
+            lamp_spectrum=lamp_spectrum,
+            up_response=up_response,
+            down_response=down_response,
+            path_to_hdf5=path_to_hdf5,
+            chunk_layout=chunk_layout,
+            compression=compression,
+            dtype=dtype
+        )
 
     st.success(f'完了: `{path_to_hdf5}`', icon='🎊')
     logger.info(f'校正結果を出力: {path_to_hdf5}')
 
 
+def display_batch_calibration(read_path: str, lamp_path: str, up_path: str, down_path: str, save_path: str,
+                              chunk_layout: ChunkLayout, compression: str, dtype, lazy: bool = False):
+    st.info('フォルダ、またはglobのパターン(例: `/path/to/*_02_*.spe`)に一致する`.spe`をまとめて校正します。'
+            '校正設定は↑で選んだものを全ファイルに使います。', icon='💡')
+    path_or_glob = st.text_input('対象のフォルダまたはパターン', value=read_path)
+    spe_paths = BatchCalibrator.find_spe_files(path_or_glob)
+    st.write(f'対象: {len(spe_paths)} ファイル')
+    worker_col, overwrite_col = st.columns(2)
+    with worker_col:
+        max_workers = st.number_input('並列数 (プロセス)', min_value=1, max_value=os.cpu_count() or 1,
+                                      value=BatchCalibrator.DEFAULT_MAX_WORKERS)
+    with overwrite_col:
+        overwrite = st.checkbox('最新の出力があっても校正し直す', value=False)
+    if st.button('一括で校正', type='primary', disabled=len(spe_paths) == 0):
+        batch_calibrator = BatchCalibrator(lamp_path, up_path, down_path, save_path,
+                                           chunk_layout=chunk_layout, compression=compression, dtype=dtype, lazy=lazy)
+        results = batch_calibrator.run(spe_paths, max_workers=max_workers, overwrite=overwrite,
+                                       progress_callback=st.progress(0.0).progress)
+        st.dataframe(results)
+        failed_num = (results['status'] == 'failed').sum()
+        if failed_num > 0:
+            st.error(f'{failed_num} ファイルの校正に失敗しました。')
+        else:
+            st.success(f'完了: `{save_path}`', icon='🎊')
+        logger.info(f'一括校正: {results["status"].value_counts().to_dict()}')
+
+
 # ------------------------ MAIN ------------------------
 configure()
 
 display_handler.display_title_with_link("1. 露光ファイル選択", "1. 露光ファイル選択", "select_file")
 read_path = display_path_input("オリジナルの.speフォルダパス", 'read_radiation_path', setting_handler.Setting().update_read_radiation_path)
 files = load_spe_files(read_path)
-spe_display_data = FileHandler.get_file_list_with_OD(read_path, files)
-for od in set(spe_display_data['OD']):
-    st.table(spe_display_data[spe_display_data['OD'] == od])
+FileHandler.get_file_list_with_OD(read_path, files) # 索引にないファイルの読み込みを始めておく
+is_indexing = FileHandler.get_indexing_file_num(read_path) > 0
+st.session_state['is_indexing_spe_files'] = is_indexing
+# 読み込み中は一覧だけを1秒ごとに更新する。ページの他の部分は待たずに表示する
+st.fragment(display_spe_file_list, run_every=1.0 if is_indexing else None)(read_path, files)
 st.divider()
 file_name = st.selectbox("ファイルを選択", files)
 
 path_to_spe = os.path.join(read_path, file_name)
-spe = SpeWrapper(path_to_spe)
+spe = SpeWrapper(path_to_spe, header_only=True)
 display_spe_metadata(spe)
 
 # 校正設定
@@ -156,8 +264,24 @@ save_path = display_path_input("保存フォルダパス", 'save_calibrated_path
 file_format = st.radio('出力ファイル形式', ['`.hdf5`', '`.spe`'])
 
 if file_format == '`.hdf5`':
+    lazy = st.checkbox(
+        '遅延校正 (校正済みの値を書き込まない)', value=False,
+        help='元の.speへの参照と校正用imageだけを保存し、読み込むときに校正します。'
+             '書き込みがすぐ終わり容量もほぼ使いませんが、元の.speを移動・削除すると読めなくなります。'
+    )
+    chunk_layout, compression, dtype = display_storage_options()
+    if lazy:
+        st.caption('遅延校正では、保存時の区切り方と圧縮は使いません。精度は校正用imageの精度になります。')
+    elif chunk_layout == ChunkLayout.CONTIGUOUS and compression is not None:
+        st.warning('contiguousでは圧縮できません。')
+        st.stop()
+    if dtype != np.float64:
+        display_precision_validation(path_to_spe, lamp_path, up_path, down_path, dtype)
     if st.button('`.hdf5` として書き出し', type='primary'):
-        execute_calibration(spe, path_to_spe, lamp_path, up_path, down_path, save_path)
+        execute_calibration(spe, path_to_spe, lamp_path, up_path, down_path, save_path, chunk_layout, compression, dtype, lazy)
+
+    display_handler.display_title_with_link("4. 一括校正", "4. 一括校正", "batch_calibrate")
+    display_batch_calibration(read_path, lamp_path, up_path, down_path, save_path, chunk_layout, compression, dtype, lazy)
 else:
     st.warning('`.spe`形式での出力は未対応です。必要なら実装してください')
     st.stop()
@@ -11,6 +11,9 @@ from modules.data_model.spectrum_data import SpectrumData
 from modules.planck_fitter import PlanckFitter
 from log_util import logger
 
+READ_BATCH = 4096 # 一度に読み込むスペクトルの本数
+
+
 
 def configure_app():
     # 共通設定とタイトルの表示
@@ -44,7 +47,7 @@ def load_reference_data(setting, selected_calib_file):
             selected_raw = st.selectbox("Raw Spectra", options=raw_files, index=index)
             raw_spectrum = SpectrumData(file_path=os.path.join(raw_path, selected_raw))
             st.write('ファイル読み込み')
-            max_intensity_arr = raw_spectrum.get_max_intensity_2d_arr()
+            max_intensity_arr = raw_spectrum.get_max_intensity_2d_arr(progress_callback=st.progress(0.0).progress)
             # 最大強度マップを描画
             fig, ax = plt.subplots(figsize=(8, 4))
             img = ax.imshow(max_intensity_arr.T, cmap='jet')
@@ -69,6 +72,33 @@ def filter_positions_by_threshold(max_intensity_arr):
     threshold = st.slider("Intensity Threshold", 0, round(max_intensity_arr.max()/10), 1000, step=100)
     return threshold
 
+def display_quick_look(calibrated_spectrum, lower, upper):
+    # Wien近似の直線回帰で、全(frame, position)の温度マップをすぐに表示する
+    st.markdown("##### クイックルック (Wien近似)")
+    st.caption("反復しないので全体でも数秒で終わります。λTが大きい(高温・長波長)ほどPlanckフィッティングとずれます。")
+    if not st.button("Wien近似で温度マップを表示"):
+        return
+    start = time.time()
+    wavelength_slice = calibrated_spectrum.get_wavelength_slice((lower, upper))
+    fit_wl = calibrated_spectrum.get_wavelength_arr()[wavelength_slice]
+    T = np.full((calibrated_spectrum.frame_num, calibrated_spectrum.position_pixel_num), np.nan)
+    T_err = np.full_like(T, np.nan)
+    progress = st.progress(0.0)
+    for block_start, block in calibrated_spectrum.iter_frame_blocks(prefetch_depth=SpectrumData.PREFETCH_DEPTH):
+        result = PlanckFitter.fit_by_wien(fit_wl, block[..., wavelength_slice])
+        block_stop = block_start + len(block)
+        T[block_start:block_stop] = np.where(result['valid'], result['T'], np.nan)
+        T_err[block_start:block_stop] = np.where(result['valid'], result['T_error'], np.nan)
+        progress.progress(block_stop / calibrated_spectrum.frame_num)
+    logger.info(f"Wien quick look completed in {round(time.time()-start, 2)} seconds")
+    T_col, T_err_col = st.columns(2)
+    with T_col:
+        st.write("T (K)")
+        show_results(T)
+    with T_err_col:
+        st.write("T の誤差 (K)")
+        show_results(T_err)
+
 def run_fitting(calibrated_spectrum, mask, lower, upper, need_raw, max_intensity_arr, save_path, output_filename):
     # プランクフィッティングの実行
     writer = HDF5Writer(os.path.join(save_path, output_filename))
@@ -81,6 +111,7 @@ def run_fitting(calibrated_spectrum, mask, lower, upper, need_raw, max_intensity
         target_indices = np.argwhere(max_intensity_arr >= mask)
     else:
         target_indices = np.array([(i, j) for i in range(calibrated_spectrum.frame_num) for j in range(calibrated_spectrum.position_pixel_num)])
+    target_indices = target_indices.reshape(-1, 2)
 
     # 結果格納用配列の初期化
     T = np.zeros((calibrated_spectrum.frame_num, calibrated_spectrum.position_pixel_num))
@@ -88,31 +119,35 @@ def run_fitting(calibrated_spectrum, mask, lower, upper, need_raw, max_intensity
     T_err = np.zeros_like(T)
     scale_err = np.zeros_like(T)
 
-    # 波長フィルタリング
-    wl_arr = calibrated_spectrum.get_wavelength_arr()
-    fit_mask = (wl_arr >= lower) & (wl_arr <= upper)
-    fit_wl = wl_arr[fit_mask]
-
-    for idx, (frame, pos) in enumerate(target_indices):
-        try:
-            intensity = calibrated_spectrum.get_frame_data(frame=frame)[pos][fit_mask]
-            result = PlanckFitter.fit_by_planck(fit_wl, intensity)
-            T[frame, pos] = result['T']
-            scale[frame, pos] = result['scale']
-            T_err[frame, pos] = result['T_error']
-            scale_err[frame, pos] = result['scale_error']
-        except Exception as e:
-            logger.warning(f"Fit failed: frame={frame}, pos={pos}, error={e}")
-        progress.progress((idx + 1) / len(target_indices))
-
+    # 採用する波長の列だけを、READ_BATCH本ずつまとめて読み込む
+    failed_num = 0
+    for batch_start in range(0, len(target_indices), READ_BATCH):
+        batch_indices = target_indices[batch_start:batch_start + READ_BATCH]
+        fit_wl, spectra = calibrated_spectrum.get_spectra(
+            batch_indices[:, 0], batch_indices[:, 1], wavelength_range=(lower, upper)
+        )
+        # READ_BATCH本をまとめてフィッティングし、収束したものだけ書き込む。初期値はWien近似で決める
+        result = PlanckFitter.fit_batch(fit_wl, spectra)
+        converged = result['converged']
+        frames, positions = batch_indices[converged, 0], batch_indices[converged, 1]
+        T[frames, positions] = result['T'][converged]
+        scale[frames, positions] = result['scale'][converged]
+        T_err[frames, positions] = result['T_error'][converged]
+        scale_err[frames, positions] = result['scale_error'][converged]
+        failed_num += int((~converged).sum())
+        progress.progress(min(batch_start + READ_BATCH, len(target_indices)) / len(target_indices))
+
+    if failed_num > 0:
+        logger.warning(f"Fit failed: {failed_num} / {len(target_indices)} spectra did not converge")
     logger.info(f"Fitting completed in {round(time.time()-start, 2)} seconds")
     return T, scale, T_err, scale_err
 
 def save_results(writer: HDF5Writer, result_dict: dict):
-    # フィッティング結果をHDF5に保存する
-    for path, data in result_dict.items():
-        if data is not None:
-            writer.write(data_path=path, data=data)
+    # フィッティング結果をHDF5に保存する。1つのhandleでまとめて書き込み、途中で失敗したらファイルを変更しない
+    with writer.batch() as batch:
+        for path, data in result_dict.items():
+            if data is not None:
+                batch.write(data_path=path, data=data)
 
 def show_results(T_result):
     # T 分布の可視化
@@ -131,6 +166,8 @@ need_raw, max_intensity = load_reference_data(setting, filename)
 wavelengths = calibrated.get_wavelength_arr()
 lower_wl, upper_wl = wavelength_range_ui(wavelengths)
 
+display_quick_look(calibrated, lower_wl, upper_wl)
+
 threshold = None
 if need_raw:
     threshold = filter_positions_by_threshold(max_intensity)
@@ -0,0 +1,110 @@
+""" テスト共通の設定と、小さな.speファイルを作る関数
+
+実データは大きいので、SpeWrapperが読める最小限のヘッダーとXMLを持つ.speをその場で作る。
+
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# リポジトリ直下のモジュール(modules, app_utils, log_util)をimportできるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WAVELENGTH_START = 500 # nm
+WAVELENGTH_STEP = 10 # nm
+TIME_STAMP_RESOLUTION = 1000000 # write_speが書くTimeStampの分解能 (tick/s)
+
+
+# 実験設定(get_params_from_xmlが読む項目)。LightFieldのフッターと同じタグ・属性の並びにする
+EXPERIMENT_XML = (
+    '<DataHistories><DataHistory><Origin software="LightField">'
+    '<Experiment xmlns:r="http://www.princetoninstruments.com/experiment/2009"><Devices><Cameras><Camera>'
+    '<ShutterTiming><ExposureTime>10</ExposureTime></ShutterTiming>'
+    '<Acquisition><FrameRate r:readOnly="true">12.5</FrameRate></Acquisition>'
+    '<Filter><Name type="String">OD2</Name></Filter>'
+    '</Camera></Cameras></Devices>'
+    '<System><FileNameGeneration><BaseFileName>radiation</BaseFileName><IncrementNumber>3</IncrementNumber>'
+    '</FileNameGeneration>'
+    '<Calibration><Date r:readOnly="true">2024-04-30T09:00:00</Date>'
+    '<ReferenceFileDate r:readOnly="true">2024-05-01T10:00:00</ReferenceFileDate></Calibration></System>'
+    '</Experiment></Origin></DataHistory></DataHistories>'
+)
+
+
+def write_spe(path: str, frame_num: int, position_pixel_num: int = 16, wavelength_pixel_num: int = 32, seed: int = 0,
+              with_metadata: bool = False):
+    """
+    uint16の露光データを持つ.spe(version 3)を書き込む
+    :param path: 書き込み先
+    :param frame_num:
+    :param position_pixel_num: 画像の高さ
+    :param wavelength_pixel_num: 画像の幅。波長は500 nmから10 nm刻み
+    :param seed: 乱数のseed
+    :param with_metadata: Trueなら各frameの後ろに、露光開始・終了のTimeStampとFrameTrackingNumber(全てInt64)を書く
+        値はframe_metadata(frame_num)を参照
+    :return: 書き込んだデータ。shape=(frame, position, wavelength)
+    """
+    data = np.random.default_rng(seed).integers(0, 60000, size=(frame_num, position_pixel_num, wavelength_pixel_num),
+                                                dtype=np.uint16)
+    frame_size = position_pixel_num * wavelength_pixel_num * data.itemsize
+    metadata = frame_metadata(frame_num) if with_metadata else np.zeros((frame_num, 0), dtype=np.int64)
+    readout_stride = frame_size + metadata.shape[1] * metadata.itemsize
+    header = bytearray(4100)
+    xml_offset = 4100 + frame_num * readout_stride
+    header[108:110] = np.array([3], dtype=np.uint16).tobytes() # データ型 (3: uint16)
+    header[678:686] = np.array([xml_offset], dtype=np.uint64).tobytes()
+    header[1992:1996] = np.array([3.0], dtype=np.float32).tobytes() # ファイルのversion
+    wavelengths = ','.join(str(WAVELENGTH_START + WAVELENGTH_STEP * i) for i in range(wavelength_pixel_num))
+    meta_format = (
+        '<MetaFormat><MetaBlock type="Frame" count="1">'
+        f'<TimeStamp event="ExposureStarted" type="Int64" bitDepth="64" resolution="{TIME_STAMP_RESOLUTION}" '
+        'absoluteTime="2024-05-01T10:00:00.0000000+09:00"/>'
+        f'<TimeStamp event="ExposureEnded" type="Int64" bitDepth="64" resolution="{TIME_STAMP_RESOLUTION}" '
+        'absoluteTime="2024-05-01T10:00:00.0000000+09:00"/>'
+        '<FrameTrackingNumber type="Int64" bitDepth="64"/>'
+        '</MetaBlock></MetaFormat>'
+    ) if with_metadata else ''
+    xml = (
+        '<SpeFormat version="3.0" xmlns="http://www.princetoninstruments.com/spe/2009"><DataFormat>'
+        f'<DataBlock type="Frame" count="{frame_num}" pixelFormat="MonochromeUnsigned16" size="{frame_size}" stride="{readout_stride}">'
+        f'<DataBlock type="Region" count="1" width="{wavelength_pixel_num}" height="{position_pixel_num}" '
+        f'size="{frame_size}" stride="{frame_size}" calibrations="1"/></DataBlock></DataFormat>'
+        f'{meta_format}'
+        f'<Calibrations><WavelengthMapping id="1"><Wavelength xml:space="preserve">{wavelengths}</Wavelength></WavelengthMapping>'
+        f'<SensorInformation id="1" width="{wavelength_pixel_num}" height="{position_pixel_num}"/>'
+        f'<SensorMapping id="1" x="0" y="0" width="{wavelength_pixel_num}" height="{position_pixel_num}" xBinning="1" yBinning="1"/>'
+        f'</Calibrations>{EXPERIMENT_XML}</SpeFormat>'
+    )
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        for frame, metadata_values in zip(data, metadata):
+            f.write(frame.tobytes())
+            f.write(metadata_values.tobytes())
+        f.write(xml.encode('utf-8'))
+    return data
+
+
+def frame_metadata(frame_num: int) -> np.ndarray:
+    """ write_speが書く各frameのmetadata。shape=(frame, 3)で、露光開始・終了(tick)とFrameTrackingNumber """
+    frames = np.arange(frame_num, dtype=np.int64)
+    started = frames * 80000 + 12345 # 12.5 Hz
+    return np.stack([started, started + 10000, frames + 1], axis=1)
+
+
+@pytest.fixture
+def calibration_inputs():
+    """ 校正に使うランプのスペクトルとUp/Downのフィルター応答(波長32点用) """
+    lamp_spectrum = pd.DataFrame({'wavelength': np.linspace(400, 900, 50), 'intensity': np.linspace(1, 2, 50)})
+    up_response = np.linspace(1, 2, 32)
+    down_response = np.linspace(2, 3, 32)
+    return lamp_spectrum, up_response, down_response
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    """ cache/ や log/ をリポジトリに作らないよう、一時フォルダで実行する """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import write_spe
+from app_utils.batch_calibrator import BatchCalibrator
+from modules.data_model.spectrum_data import SpectrumData
+from modules.file_format.HDF5 import hdf_handle_pool
+
+
+@pytest.fixture
+def batch_calibrator(work_dir):
+    pd.DataFrame({'wavelength': np.linspace(400, 900, 50), 'intensity': np.linspace(1, 2, 50)}) \
+        .to_csv(work_dir / 'lamp.csv', header=False, index=False)
+    write_spe(str(work_dir / 'up.spe'), frame_num=1, seed=1)
+    write_spe(str(work_dir / 'down.spe'), frame_num=1, seed=2)
+    write_spe(str(work_dir / 'radiation.spe'), frame_num=20)
+    return BatchCalibrator(str(work_dir / 'lamp.csv'), str(work_dir / 'up.spe'), str(work_dir / 'down.spe'),
+                           str(work_dir / 'calibrated'))
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_overwrite_while_output_is_open(work_dir, batch_calibrator, max_workers):
+    # 出力ファイルをアプリで開いたまま(プールにhandleが残ったまま)でも、校正し直せる
+    spe_paths = [str(work_dir / 'radiation.spe')]
+    assert batch_calibrator.run(spe_paths, max_workers=1)['status'].tolist() == ['done']
+    output_path = batch_calibrator.get_output_path(spe_paths[0])
+    SpectrumData(output_path).get_frame_data(0)
+    results = batch_calibrator.run(spe_paths, max_workers=max_workers, overwrite=True)
+    assert results['status'].tolist() == ['done']
+
+
+def test_output_in_use_is_reported(work_dir, batch_calibrator):
+    # 読み込み中で閉じられない出力ファイルは、校正せずにファイルごとのエラーとして返す
+    spe_paths = [str(work_dir / 'radiation.spe')]
+    batch_calibrator.run(spe_paths, max_workers=1)
+    with hdf_handle_pool.checkout(batch_calibrator.get_output_path(spe_paths[0])):
+        results = batch_calibrator.run(spe_paths, max_workers=1, overwrite=True)
+    assert results['status'].tolist() == ['failed']
+    assert '使用中' in results['error'][0]
@@ -0,0 +1,74 @@
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.file_format.HDF5 import HDF5Writer
+
+
+def test_batch_writes_all_datasets(work_dir):
+    path = str(work_dir / 'result_dist.hdf')
+    with HDF5Writer(path).batch(dataset_options={'entry/value/T': {'chunks': (2, 3)}}) as batch:
+        batch.write(data_path='entry/value/T', data=np.ones((4, 6)))
+        batch.write(data_path='entry/value/count', data=np.int64(3))
+    with h5py.File(path, 'r') as f:
+        assert f['entry/value/T'].chunks == (2, 3)
+        assert f['entry/value/count'][()] == 3.0
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_batch_failed_dataframe_write_keeps_original(work_dir, monkeypatch):
+    # DataFrameの書き込みに失敗したら、一時ファイルを残さず元のファイルも変えない
+    path = str(work_dir / 'result_dist.hdf')
+    HDF5Writer(path).write(data_path='entry/value/T', data=np.zeros(3))
+
+    def fail_to_hdf(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(pd.DataFrame, 'to_hdf', fail_to_hdf)
+    with pytest.raises(OSError):
+        with HDF5Writer(path).batch() as batch:
+            batch.write(data_path='entry/value/T', data=np.ones(3), overwrite=True)
+            batch.write(data_path='entry/table', data=pd.DataFrame({'a': [1, 2]}))
+    assert not os.path.exists(path + '.tmp')
+    with h5py.File(path, 'r') as f:
+        np.testing.assert_array_equal(f['entry/value/T'][()], np.zeros(3))
+
+
+def test_path_index_is_bounded_and_invalidated(work_dir, monkeypatch):
+    from modules.file_format.HDF5 import HDFPathIndex
+    monkeypatch.setattr(HDFPathIndex, 'MAX_FILE_NUM', 2)
+    monkeypatch.setattr(HDFPathIndex, '_indices', HDFPathIndex._indices.__class__())
+    paths = []
+    for i in range(3):
+        path = str(work_dir / f'file{i}.hdf')
+        HDF5Writer(path).write(data_path='entry/value/T', data=np.zeros(3))
+        HDFPathIndex.for_file(path)
+        paths.append(os.path.abspath(path))
+    assert list(HDFPathIndex._indices) == paths[1:] # 最も古いものから捨てる
+
+    # batchで置き換えたファイルのindexは捨てられ、次に引くと新しいデータセットが見つかる
+    with HDF5Writer(paths[2]).batch() as batch:
+        batch.write(data_path='entry/value/scale', data=np.ones(3))
+    assert paths[2] not in HDFPathIndex._indices
+    assert HDFPathIndex.for_file(paths[2]).lookup('scale') == ['entry/value/scale']
+
+
+def test_batch_writes_large_file_in_place(work_dir, monkeypatch):
+    # 大きいファイルはコピーせず、元のファイルに直接書き込む
+    from modules.file_format.HDF5 import HDF5WriteBatch
+    path = str(work_dir / 'radiation_calib.hdf')
+    HDF5Writer(path).write(data_path='entry/calibrated_spectra', data=np.zeros((8, 4, 16)))
+    monkeypatch.setattr(HDF5WriteBatch, 'COPY_ON_WRITE_MAX_BYTES', 0)
+
+    def fail_to_copy(*args, **kwargs):
+        raise AssertionError('copied the whole file')
+    monkeypatch.setattr('shutil.copyfile', fail_to_copy)
+    with HDF5Writer(path).batch() as batch:
+        assert batch.in_place
+        batch.write(data_path='entry/value/T', data=np.ones(3))
+    assert not os.path.exists(path + '.tmp')
+    with h5py.File(path, 'r') as f:
+        np.testing.assert_array_equal(f['entry/value/T'][()], np.ones(3))
+        assert f['entry/calibrated_spectra'].shape == (8, 4, 16)
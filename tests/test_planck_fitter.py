@@ -0,0 +1,31 @@
+import numpy as np
+
+from modules.planck_fitter import PlanckFitter
+
+WAVELENGTH_FIT = np.linspace(600, 800, 100)
+
+
+def test_fit_batch_recovers_temperature():
+    T_true = np.array([1500.0, 2500.0, 3500.0])
+    spectra = 1e-11 * PlanckFitter.planck_function(WAVELENGTH_FIT[None, :], T_true[:, None], 1)
+    result = PlanckFitter.fit_batch(WAVELENGTH_FIT, spectra)
+    assert result['converged'].all()
+    np.testing.assert_allclose(result['T'], T_true, rtol=1e-6)
+    np.testing.assert_allclose(result['scale'], 1e-11, rtol=1e-6)
+
+
+def test_fit_batch_rejects_non_positive_spectra():
+    # 負やゼロのスペクトルは収束扱いにしない(負のscaleで温度マップに書き込まれないように)
+    positive = 1e-11 * PlanckFitter.planck_function(WAVELENGTH_FIT, 2500.0, 1)
+    spectra = np.stack([-positive, np.zeros_like(positive), positive])
+    result = PlanckFitter.fit_batch(WAVELENGTH_FIT, spectra)
+    np.testing.assert_array_equal(result['converged'], [False, False, True])
+
+
+def test_fit_batch_does_not_converge_on_rejected_steps():
+    # 長波長端の1点だけが光っているスペクトルは、有限の温度では残差が最小にならない(T→0へ進み続ける)
+    # 基底がアンダーフローしてステップが却下され続けたものを、減衰で小さくなったステップを理由に収束扱いにしない
+    spike = np.zeros_like(WAVELENGTH_FIT)
+    spike[-1] = 1.0
+    result = PlanckFitter.fit_batch(WAVELENGTH_FIT, spike[None, :], initial_temperature=1e5)
+    assert not result['converged'][0]
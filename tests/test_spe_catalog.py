@@ -0,0 +1,41 @@
+import json
+import os
+import time
+
+from conftest import write_spe
+from modules.file_format.spe_catalog import SpeCatalog
+
+
+def wait_for_indexing(catalog, timeout=10):
+    deadline = time.monotonic() + timeout
+    while catalog.get_pending_num() > 0:
+        assert time.monotonic() < deadline, '索引の作成が終わりません'
+        time.sleep(0.01)
+
+
+def test_update_returns_before_indexing_and_saves_when_done(work_dir):
+    for i in range(3):
+        write_spe(str(work_dir / f'run{i}.spe'), frame_num=2, seed=i)
+    files = [f'run{i}.spe' for i in range(3)]
+    catalog = SpeCatalog(str(work_dir))
+    catalog.update(files) # 待たずに返る
+    wait_for_indexing(catalog)
+    assert [entry['frame_num'] for entry in catalog.get_entries(files)] == [2, 2, 2]
+    deadline = time.monotonic() + 10
+    while not os.path.exists(work_dir / SpeCatalog.INDEX_FILE_NAME): # 最後の読み込みのcallbackで保存される
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_removed_files_are_dropped_from_index(work_dir):
+    # 削除・名前変更されたファイルの情報が索引ファイルに溜まり続けない
+    for file_name in ('keep.spe', 'delete.spe'):
+        write_spe(str(work_dir / file_name), frame_num=2)
+    SpeCatalog(str(work_dir)).update(['keep.spe', 'delete.spe'], wait_for_completion=True)
+    os.remove(work_dir / 'delete.spe')
+
+    catalog = SpeCatalog(str(work_dir))
+    catalog.update(['keep.spe'], wait_for_completion=True)
+    assert catalog.get_entry('delete.spe') is None
+    with open(work_dir / SpeCatalog.INDEX_FILE_NAME, encoding='utf-8') as f:
+        assert list(json.load(f)['files']) == ['keep.spe']
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from conftest import write_spe, frame_metadata, TIME_STAMP_RESOLUTION
+from modules.file_format.spe_wrapper import SpeWrapper
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_frame_metadata_values(work_dir, header_only):
+    # 元の実装と同じく、TimeStampはms(tick / resolution * 1000)、FrameTrackingNumberはそのままの値を返す
+    path = str(work_dir / 'radiation.spe')
+    data = write_spe(path, frame_num=5, with_metadata=True)
+    spe = SpeWrapper(path, header_only=header_only)
+    metadata = frame_metadata(5)
+    expected = [(started / TIME_STAMP_RESOLUTION * 1000, ended / TIME_STAMP_RESOLUTION * 1000, tracking_number)
+                for started, ended, tracking_number in metadata]
+    assert spe.frame_metadata_values == tuple(expected)
+    assert spe.get_frame_metadata_value([3, 1]) == [list(expected[3]), list(expected[1])]
+    assert [type(value) for value in spe.frame_metadata_values[0]] == [np.float64, np.float64, np.int64]
+    # frameの間にmetadataがあっても、露光データはframeのstrideで読める
+    np.testing.assert_array_equal(spe.as_memmap(), data)
+
+
+def test_frame_metadata_values_without_metadata(work_dir):
+    path = str(work_dir / 'radiation.spe')
+    write_spe(path, frame_num=3)
+    spe = SpeWrapper(path)
+    assert spe.frame_metadata_values == ()
+    assert spe.get_frame_metadata_value([0, 2]) == [[], []]
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_get_params_from_xml(work_dir, header_only):
+    # 元の実装(フッターの文字列を'<'で分割して探す)が同じファイルから読んだ値と同じになる
+    path = str(work_dir / 'radiation.spe')
+    write_spe(path, frame_num=2)
+    spe = SpeWrapper(path, header_only=header_only)
+    spe.get_params_from_xml()
+    assert spe.framerate == 12.5
+    assert spe.basename == 'radiation'
+    assert spe.filenum == 3
+    assert spe.date == '2024-05-01T10:00:00'
+    assert spe.calibration_date == '2024-04-30T09:00:00'
+    assert spe.OD == 'OD2'
@@ -0,0 +1,86 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from conftest import write_spe
+from modules.data_model.spectrum_data import SpectrumData
+
+
+def test_max_intensity_2d_arr_spe(work_dir):
+    data = write_spe(str(work_dir / 'radiation.spe'), frame_num=70)
+    spectrum = SpectrumData(str(work_dir / 'radiation.spe'))
+    max_intensity_2d = spectrum.get_max_intensity_2d_arr()
+    assert max_intensity_2d.dtype == np.float64 # Fit by Planckが保存する2d_max_intensityの形式
+    np.testing.assert_array_equal(max_intensity_2d, data.max(axis=2))
+    np.testing.assert_array_equal(spectrum.get_max_intensity_arr(), data.max(axis=(1, 2)))
+
+
+def test_max_intensity_2d_arr_hdf(work_dir):
+    # 校正済みの.hdfでも、Fit by Planckの画面で使う最大強度マップが求まる
+    cube = np.random.default_rng(0).random((70, 16, 32))
+    path = str(work_dir / 'radiation_calib.hdf')
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('entry/calibrated_spectra', data=cube)
+        f.create_dataset('entry/wavelength_arr', data=500 + 10 * np.arange(32.0))
+    spectrum = SpectrumData(path)
+    np.testing.assert_array_equal(spectrum.get_max_intensity_2d_arr(), cube.max(axis=2))
+    up_max, down_max = spectrum.get_separated_max_intensity_arr()
+    assert up_max.shape == down_max.shape == (70,)
+
+
+def test_lazy_hdf_summary_follows_raw_spe(work_dir, calibration_inputs):
+    # 遅延校正の.hdfの集計結果は、参照している.speを書き換えたら使われない
+    from app_utils.writer import CalibrateSpectraWriter
+    lamp_spectrum, up_response, down_response = calibration_inputs
+    spe_path = str(work_dir / 'radiation.spe')
+    hdf_path = str(work_dir / 'radiation_calib.hdf')
+    write_spe(spe_path, frame_num=10, seed=0)
+    CalibrateSpectraWriter.output_lazy_to_hdf5(SpectrumData(spe_path), lamp_spectrum, up_response, down_response, hdf_path)
+    before = SpectrumData(hdf_path).get_max_intensity_2d_arr()
+
+    write_spe(spe_path, frame_num=10, seed=1)
+    stat = os.stat(spe_path)
+    os.utime(spe_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9)) # 同じ時刻と判定されないようにずらす
+    spectrum = SpectrumData(hdf_path)
+    after = spectrum.get_max_intensity_2d_arr()
+    assert not np.array_equal(before, after)
+    expected = np.stack([spectrum.get_frame_data(frame).max(axis=1) for frame in range(10)])
+    np.testing.assert_allclose(after, expected)
+
+
+def test_noise_statistics_are_stored_in_summary(work_dir):
+    # ノイズのヒストグラム・中央値・MADからの標準偏差も、最大強度マップと一緒に保存して使い回す
+    data = write_spe(str(work_dir / 'radiation.spe'), frame_num=20)
+    noise = SpectrumData(str(work_dir / 'radiation.spe')).get_noise_statistics()
+    max_intensity_2d = data.max(axis=2)
+    median = np.median(max_intensity_2d)
+    assert noise['noise_median'] == median
+    assert noise['noise_sigma'] == pytest.approx(1.4826 * np.median(np.abs(max_intensity_2d - median)))
+    assert noise['noise_histogram_counts'].sum() == max_intensity_2d.size
+
+    assert os.path.exists(work_dir / '.radiation.spe.summary.npz')
+    cached = SpectrumData(str(work_dir / 'radiation.spe')).get_noise_statistics()
+    assert cached.keys() == noise.keys()
+    for name in noise:
+        np.testing.assert_array_equal(cached[name], noise[name])
+
+
+def test_overwrite_spe_image_invalidates_summary_and_catalog(work_dir):
+    # 書き換えた.speの集計結果と索引は使われない(サイズも変わらないので、更新時刻の精度に頼らない)
+    from modules.file_format.spe_catalog import SpeCatalog
+    data = write_spe(str(work_dir / 'before.spe'), frame_num=4)
+    write_spe(str(work_dir / 'after.spe'), frame_num=4, seed=1)
+    SpectrumData(str(work_dir / 'after.spe')).get_max_intensity_2d_arr()
+    catalog = SpeCatalog.for_folder(str(work_dir))
+    catalog.update(['after.spe'], wait_for_completion=True)
+    assert os.path.exists(work_dir / '.after.spe.summary.npz')
+    assert catalog.get_entry('after.spe') is not None
+
+    SpectrumData.overwrite_spe_image(str(work_dir / 'before.spe'), str(work_dir / 'after.spe'), 0, 'whole')
+    assert not os.path.exists(work_dir / '.after.spe.summary.npz')
+    assert catalog.get_entry('after.spe') is None
+    # 0度の回転でもスプライン補間の誤差があり、整数に切り捨てると1ずれることがある
+    np.testing.assert_allclose(SpectrumData(str(work_dir / 'after.spe')).get_max_intensity_2d_arr(), data.max(axis=2),
+                               atol=1)
@@ -0,0 +1,66 @@
+import h5py
+import numpy as np
+import pytest
+
+from conftest import write_spe, WAVELENGTH_START, WAVELENGTH_STEP
+from app_utils.writer import CalibrateSpectraWriter
+from modules.data_model.spectrum_data import SpectrumData
+
+
+def expected_calibration(data, calibration_inputs, center_pixel):
+    # 校正用image = ランプの強度 / フィルター応答 (center_pixelより上はUp、以降はDown)
+    lamp_spectrum, up_response, down_response = calibration_inputs
+    wavelength_arr = WAVELENGTH_START + WAVELENGTH_STEP * np.arange(data.shape[2])
+    lamp_intensity = np.interp(wavelength_arr, lamp_spectrum['wavelength'], lamp_spectrum['intensity'])
+    response = np.empty(data.shape[1:])
+    response[:center_pixel] = up_response
+    response[center_pixel:] = down_response
+    return data * (lamp_intensity / response)
+
+
+def test_output_to_hdf5_multi_frame_spe(work_dir, calibration_inputs):
+    # ヘッダーのframe数はnp.uint64なので、chunkやblockの計算で整数に戻せていることを確かめる
+    data = write_spe(str(work_dir / 'radiation.spe'), frame_num=150)
+    radiation = SpectrumData(str(work_dir / 'radiation.spe'))
+    lamp_spectrum, up_response, down_response = calibration_inputs
+    path = str(work_dir / 'radiation_calib.hdf')
+    result = CalibrateSpectraWriter.output_to_hdf5(radiation, lamp_spectrum, up_response, down_response, path,
+                                                   block_size=32)
+    assert result['frame_num'] == 150
+    with h5py.File(path, 'r') as f:
+        calibrated = f['entry/calibrated_spectra'][()]
+    np.testing.assert_allclose(calibrated, expected_calibration(data, calibration_inputs, radiation.center_pixel),
+                               rtol=1e-6)
+
+
+def test_output_lazy_to_hdf5_without_relative_path(work_dir, calibration_inputs, monkeypatch):
+    # Windowsで.speと出力先のドライブが違うと相対パスにできない。絶対パスだけで読めるようにする
+    data = write_spe(str(work_dir / 'radiation.spe'), frame_num=5)
+    radiation = SpectrumData(str(work_dir / 'radiation.spe'))
+    lamp_spectrum, up_response, down_response = calibration_inputs
+    path = str(work_dir / 'radiation_calib.hdf')
+
+    def relpath_on_other_drive(path, start=None):
+        raise ValueError("path is on mount 'D:', start on mount 'C:'")
+
+    monkeypatch.setattr('os.path.relpath', relpath_on_other_drive)
+    CalibrateSpectraWriter.output_lazy_to_hdf5(radiation, lamp_spectrum, up_response, down_response, path)
+    monkeypatch.undo()
+    with h5py.File(path, 'r') as f:
+        assert 'raw_spe_relpath' not in f.attrs
+    lazy = SpectrumData(path)
+    np.testing.assert_allclose(lazy.get_frame_data(0),
+                               expected_calibration(data, calibration_inputs, radiation.center_pixel)[0], rtol=1e-6)
+
+
+def test_output_lazy_to_hdf5_rejects_mismatched_calibration_image(work_dir, calibration_inputs):
+    # 形の合わない校正用imageは、書き込む前に弾く(既存のファイルを壊さない)
+    write_spe(str(work_dir / 'radiation.spe'), frame_num=5)
+    radiation = SpectrumData(str(work_dir / 'radiation.spe'))
+    lamp_spectrum, up_response, down_response = calibration_inputs
+    path = work_dir / 'radiation_calib.hdf'
+    path.write_bytes(b'existing')
+    with pytest.raises(ValueError):
+        CalibrateSpectraWriter.output_lazy_to_hdf5(radiation, lamp_spectrum, up_response, down_response, str(path),
+                                                   calibration_image=np.ones((3, 32)))
+    assert path.read_bytes() == b'existing'